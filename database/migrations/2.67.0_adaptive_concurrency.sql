@@ -0,0 +1,29 @@
+-- Migration: 2.67.0 - Adaptive worker concurrency
+-- Description: The daemon records its current worker limit and every change
+-- (with the load/rate-limit signals behind it) in daemon_status.
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'daemon_status'
+               AND COLUMN_NAME = 'max_parallel');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE daemon_status ADD COLUMN max_parallel INT DEFAULT NULL COMMENT ''Current worker limit (adaptive concurrency)''',
+    'SELECT ''Column max_parallel already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'daemon_status'
+               AND COLUMN_NAME = 'concurrency_log');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE daemon_status ADD COLUMN concurrency_log JSON DEFAULT NULL COMMENT ''Floor, ceiling and recent worker limit changes''',
+    'SELECT ''Column concurrency_log already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,30 @@
+-- Migration: 2.67.0 - Per-project backup policy
+-- Description: Backups and exports leave out regenerable paths (node_modules/, vendor/, ...)
+-- of the project type. backup_exclude adds gitignore-style lines (! re-includes) and
+-- backup_gitignore also applies the project's .gitignore files.
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'projects'
+               AND COLUMN_NAME = 'backup_exclude');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE projects ADD COLUMN backup_exclude TEXT COMMENT ''Gitignore-style paths left out of backups and exports; ! re-includes''',
+    'SELECT ''Column backup_exclude already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'projects'
+               AND COLUMN_NAME = 'backup_gitignore');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE projects ADD COLUMN backup_gitignore TINYINT(1) DEFAULT 0 COMMENT ''Also leave .gitignore''''d paths out of backups and exports''',
+    'SELECT ''Column backup_gitignore already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
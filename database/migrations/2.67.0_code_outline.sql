@@ -0,0 +1,17 @@
+-- Migration: 2.67.0 - Code outline in project maps
+-- Description: Project maps carry a ranked, token-budgeted outline of the code (files,
+-- classes, functions, routes) built from the persistent code index, and fill
+-- architecture_type / design_patterns from it.
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'project_maps'
+               AND COLUMN_NAME = 'code_outline');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE project_maps ADD COLUMN code_outline MEDIUMTEXT COMMENT ''Ranked outline of files, classes, functions and routes'' AFTER design_patterns',
+    'SELECT ''Column code_outline already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,18 @@
+-- Migration: 2.67.0 - Daemon nodes (multi-host mode)
+-- Description: Every daemon registers and heartbeats here. Live nodes split the
+-- projects between them by consistent hashing.
+
+CREATE TABLE IF NOT EXISTS daemon_nodes (
+    node_id VARCHAR(100) NOT NULL COMMENT 'NODE_ID from system.conf (default: hostname)',
+    hostname VARCHAR(255) DEFAULT NULL,
+    pid INT DEFAULT NULL,
+    status ENUM('running','stopped','dead') DEFAULT 'running',
+    started_at TIMESTAMP NULL DEFAULT NULL,
+    last_heartbeat TIMESTAMP NULL DEFAULT NULL,
+    max_parallel INT DEFAULT NULL,
+    active_workers INT DEFAULT 0,
+    active_tickets JSON DEFAULT NULL,
+    scheduler_stats JSON DEFAULT NULL,
+    PRIMARY KEY (node_id),
+    KEY idx_status_heartbeat (status, last_heartbeat)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
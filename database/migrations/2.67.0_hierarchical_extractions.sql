@@ -0,0 +1,45 @@
+-- Migration: 2.67.0 - Hierarchical conversation extractions
+-- Description: Level-0 extractions summarize message chunks; groups of them are merged
+-- into level-1/level-2 extractions. Merged rows point at their replacement.
+
+-- Add level (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'conversation_extractions'
+               AND COLUMN_NAME = 'level');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE conversation_extractions ADD COLUMN level TINYINT NOT NULL DEFAULT 0 COMMENT ''0 = message chunk, 1-2 = merged extractions'' AFTER covers_msg_to_id',
+    'SELECT ''Column level already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add merged_into_id (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'conversation_extractions'
+               AND COLUMN_NAME = 'merged_into_id');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE conversation_extractions ADD COLUMN merged_into_id INT DEFAULT NULL COMMENT ''Higher-level extraction that replaced this one (NULL = active)'' AFTER level',
+    'SELECT ''Column merged_into_id already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add index for active extractions lookup (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'conversation_extractions'
+               AND INDEX_NAME = 'idx_active');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE conversation_extractions ADD INDEX idx_active (ticket_id, merged_into_id, level)',
+    'SELECT ''Index idx_active already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,16 @@
+-- Migration: 2.67.0 - Parallel tickets per project
+-- Description: Opt-in concurrent ticket execution. With parallel_tickets > 1 the daemon
+-- runs up to that many tickets of the project at once, each in its own git worktree.
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'projects'
+               AND COLUMN_NAME = 'parallel_tickets');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE projects ADD COLUMN parallel_tickets INT DEFAULT 1 COMMENT ''Tickets run concurrently; >1 runs each in its own git worktree''',
+    'SELECT ''Column parallel_tickets already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -0,0 +1,16 @@
+-- Migration: 2.67.0 - Global ticket scheduler metrics
+-- Description: The daemon publishes ticket queue depth and time-to-start
+-- percentiles per priority to daemon_status.scheduler_stats.
+
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'daemon_status'
+               AND COLUMN_NAME = 'scheduler_stats');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE daemon_status ADD COLUMN scheduler_stats JSON DEFAULT NULL COMMENT ''Ticket queue depth and time-to-start per priority''',
+    'SELECT ''Column scheduler_stats already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
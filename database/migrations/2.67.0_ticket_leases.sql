@@ -0,0 +1,45 @@
+-- Migration: 2.67.0 - Ticket leases
+-- Description: Tickets are claimed atomically (SELECT ... FOR UPDATE SKIP LOCKED) by one
+-- daemon process, which renews a lease while it works. Expired leases are recovered.
+
+-- Add claimed_by (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'tickets'
+               AND COLUMN_NAME = 'claimed_by');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE tickets ADD COLUMN claimed_by VARCHAR(100) DEFAULT NULL COMMENT ''Daemon process (host:pid) holding the lease'' AFTER ai_model',
+    'SELECT ''Column claimed_by already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add lease_expires_at (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'tickets'
+               AND COLUMN_NAME = 'lease_expires_at');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE tickets ADD COLUMN lease_expires_at TIMESTAMP NULL DEFAULT NULL COMMENT ''Claim is void after this; renewed by worker heartbeat'' AFTER claimed_by',
+    'SELECT ''Column lease_expires_at already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Add index for expired lease recovery (idempotent)
+SET @exist := (SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+               WHERE TABLE_SCHEMA = DATABASE()
+               AND TABLE_NAME = 'tickets'
+               AND INDEX_NAME = 'idx_lease');
+
+SET @query := IF(@exist = 0,
+    'ALTER TABLE tickets ADD INDEX idx_lease (status, lease_expires_at)',
+    'SELECT ''Index idx_lease already exists''');
+
+PREPARE stmt FROM @query;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
@@ -39,6 +39,8 @@ CREATE TABLE `conversation_extractions` (
   `important_notes` json DEFAULT NULL,
   `covers_msg_from_id` int DEFAULT NULL COMMENT 'First message ID covered by this extraction',
   `covers_msg_to_id` int DEFAULT NULL COMMENT 'Last message ID covered by this extraction',
+  `level` tinyint NOT NULL DEFAULT '0' COMMENT '0 = message chunk, 1-2 = merged extractions',
+  `merged_into_id` int DEFAULT NULL COMMENT 'Higher-level extraction that replaced this one (NULL = active)',
   `messages_summarized` int DEFAULT '0' COMMENT 'Number of messages compressed',
   `tokens_before` int DEFAULT '0' COMMENT 'Tokens in original messages',
   `tokens_after` int DEFAULT '0' COMMENT 'Tokens in extraction',
@@ -48,6 +50,7 @@ CREATE TABLE `conversation_extractions` (
   PRIMARY KEY (`id`),
   KEY `idx_ticket` (`ticket_id`),
   KEY `idx_coverage` (`ticket_id`,`covers_msg_to_id`),
+  KEY `idx_active` (`ticket_id`,`merged_into_id`,`level`),
   CONSTRAINT `conversation_extractions_ibfk_1` FOREIGN KEY (`ticket_id`) REFERENCES `tickets` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Extracted knowledge from older conversation messages';
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -77,6 +80,29 @@ CREATE TABLE `conversation_messages` (
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `daemon_nodes`
+--
+
+DROP TABLE IF EXISTS `daemon_nodes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `daemon_nodes` (
+  `node_id` varchar(100) NOT NULL COMMENT 'NODE_ID from system.conf (default: hostname)',
+  `hostname` varchar(255) DEFAULT NULL,
+  `pid` int DEFAULT NULL,
+  `status` enum('running','stopped','dead') DEFAULT 'running',
+  `started_at` timestamp NULL DEFAULT NULL,
+  `last_heartbeat` timestamp NULL DEFAULT NULL,
+  `max_parallel` int DEFAULT NULL,
+  `active_workers` int DEFAULT '0',
+  `active_tickets` json DEFAULT NULL,
+  `scheduler_stats` json DEFAULT NULL,
+  PRIMARY KEY (`node_id`),
+  KEY `idx_status_heartbeat` (`status`,`last_heartbeat`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `daemon_status`
 --
@@ -91,6 +117,9 @@ CREATE TABLE `daemon_status` (
   `current_session_id` int DEFAULT NULL,
   `last_heartbeat` timestamp NULL DEFAULT NULL,
   `started_at` timestamp NULL DEFAULT NULL,
+  `scheduler_stats` json DEFAULT NULL COMMENT 'Ticket queue depth and time-to-start per priority',
+  `max_parallel` int DEFAULT NULL COMMENT 'Current worker limit (adaptive concurrency)',
+  `concurrency_log` json DEFAULT NULL COMMENT 'Floor, ceiling and recent worker limit changes',
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -205,6 +234,7 @@ CREATE TABLE `project_maps` (
   `dependencies` json DEFAULT NULL COMMENT 'Key dependencies with versions',
   `architecture_type` varchar(100) COLLATE utf8mb4_unicode_ci DEFAULT NULL COMMENT 'MVC, microservices, monolith, etc',
   `design_patterns` json DEFAULT NULL COMMENT '["repository", "factory", "singleton"]',
+  `code_outline` mediumtext COLLATE utf8mb4_unicode_ci COMMENT 'Ranked outline of files, classes, functions and routes',
   `file_count` int DEFAULT '0',
   `total_size_kb` int DEFAULT '0',
   `primary_language` varchar(50) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
@@ -254,6 +284,9 @@ CREATE TABLE `projects` (
   `android_screen_size` enum('phone','phone_small','tablet_7','tablet_10') DEFAULT 'phone',
   `dotnet_port` int DEFAULT NULL,
   `git_enabled` tinyint(1) DEFAULT '1' COMMENT 'Whether Git is enabled for this project',
+  `parallel_tickets` int DEFAULT '1' COMMENT 'Tickets run concurrently; >1 runs each in its own git worktree',
+  `backup_exclude` text COMMENT 'Gitignore-style paths left out of backups and exports; ! re-includes',
+  `backup_gitignore` tinyint(1) DEFAULT '0' COMMENT 'Also leave .gitignore''d paths out of backups and exports',
   PRIMARY KEY (`id`),
   UNIQUE KEY `code` (`code`),
   KEY `idx_status` (`status`),
@@ -360,10 +393,13 @@ CREATE TABLE `tickets` (
   `total_tokens` int DEFAULT '0',
   `total_duration_seconds` int DEFAULT '0',
   `ai_model` enum('opus','sonnet','haiku') DEFAULT NULL,
+  `claimed_by` varchar(100) DEFAULT NULL COMMENT 'Daemon process (host:pid) holding the lease',
+  `lease_expires_at` timestamp NULL DEFAULT NULL COMMENT 'Claim is void after this; renewed by worker heartbeat',
   PRIMARY KEY (`id`),
   UNIQUE KEY `ticket_number` (`ticket_number`),
   KEY `idx_project_status` (`project_id`,`status`),
   KEY `idx_status` (`status`),
+  KEY `idx_lease` (`status`,`lease_expires_at`),
   CONSTRAINT `tickets_ibfk_1` FOREIGN KEY (`project_id`) REFERENCES `projects` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
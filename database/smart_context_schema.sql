@@ -113,6 +113,7 @@ CREATE TABLE IF NOT EXISTS project_maps (
     -- ═══ Architecture ═══
     architecture_type VARCHAR(100) COMMENT 'MVC, microservices, monolith, etc',
     design_patterns JSON COMMENT '["repository", "factory", "singleton"]',
+    code_outline MEDIUMTEXT COMMENT 'Ranked outline of files, classes, functions and routes',
 
     -- ═══ Project Stats ═══
     file_count INT DEFAULT 0,
@@ -222,6 +223,8 @@ CREATE TABLE IF NOT EXISTS conversation_extractions (
     -- ═══ Coverage Metadata ═══
     covers_msg_from_id INT COMMENT 'First message ID covered by this extraction',
     covers_msg_to_id INT COMMENT 'Last message ID covered by this extraction',
+    level TINYINT NOT NULL DEFAULT 0 COMMENT '0 = message chunk, 1-2 = merged extractions',
+    merged_into_id INT DEFAULT NULL COMMENT 'Higher-level extraction that replaced this one (NULL = active)',
     messages_summarized INT DEFAULT 0 COMMENT 'Number of messages compressed',
     tokens_before INT DEFAULT 0 COMMENT 'Tokens in original messages',
     tokens_after INT DEFAULT 0 COMMENT 'Tokens in extraction',
@@ -235,7 +238,8 @@ CREATE TABLE IF NOT EXISTS conversation_extractions (
 
     FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE,
     INDEX idx_ticket (ticket_id),
-    INDEX idx_coverage (ticket_id, covers_msg_to_id)
+    INDEX idx_coverage (ticket_id, covers_msg_to_id),
+    INDEX idx_active (ticket_id, merged_into_id, level)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 COMMENT='Extracted knowledge from older conversation messages';
 
@@ -0,0 +1,758 @@
+#!/usr/bin/env python3
+"""
+Backup Store - Deduplicating snapshot store for CodeHero project backups
+Shared by the daemon (pre-ticket backups) and the web app (manual, close,
+reopen and pre-restore backups, restore, list, download).
+
+Layout under BACKUP_DIR/<project_code>/store:
+- objects/ab/<sha256>[.gz]  File contents, stored once per distinct content.
+                            Already-compressed formats are kept raw.
+- snapshots/<name>.json     Manifest: root -> relative path -> hash, size,
+                            mtime and mode (or symlink target).
+- index.json                Source path -> (size, mtime_ns, hash), so files
+                            that did not change are not read again.
+- refs.json                 Object hash -> number of snapshots using it.
+                            Objects are deleted when their count drops to 0.
+
+A snapshot only writes objects that are not already in the store, so a
+backup of an unchanged project costs one directory walk and a manifest.
+Database dumps are streamed from mysqldump straight into objects (and
+back into mysql on restore), so memory use does not grow with the dump.
+Large files and streams are compressed by pigz on all cores when it is
+installed.
+
+Git checkpoints: when a root is a git repository with a commit, the
+snapshot records the HEAD commit (pinned under refs/codehero/backups/)
+instead of the files that match it, and stores only the files with
+uncommitted changes plus untracked and ignored paths. Callers pass a
+GitManager per root. .git itself is never stored nor touched by a
+restore, so checkpoint commits of other snapshots stay reachable.
+
+Excludes: callers pass a PathFilter per root (see path_filter.project_filter)
+so regenerable paths such as node_modules/ are not stored. The filter is
+recorded in the manifest and restore leaves those paths alone.
+"""
+
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from archive_writer import is_compressed_name, open_archive, SPOOL_MAX
+from path_filter import PathFilter
+
+
+STORE_DIRNAME = 'store'
+SNAPSHOT_EXT = '.snap'          # Suffix of snapshot names as shown by the backup list API
+HASH_CHUNK = 1024 * 1024
+GZIP_LEVEL = 6
+PARALLEL_GZIP_MIN = 8 * 1024 * 1024     # Use pigz (if installed) for files at least this big
+
+# mysqldump options for backups: no dump date, so an unchanged database dumps
+# identically; one consistent read instead of table locks while streaming
+BACKUP_SCHEMA_DUMP = ['--no-data', '--skip-dump-date']
+BACKUP_DATA_DUMP = ['--no-create-info', '--skip-dump-date', '--single-transaction']
+
+SCAN_WORKERS = min(8, os.cpu_count() or 2)    # Threads hashing/compressing changed files
+
+
+def snapshot_name(project_code: str, trigger: str, when: datetime = None) -> str:
+    """Backup name in the same {code}_{timestamp}_{trigger} form as the old zips"""
+    timestamp = (when or datetime.now()).strftime('%Y%m%d_%H%M%S')
+    return f"{project_code}_{timestamp}_{trigger}{SNAPSHOT_EXT}"
+
+
+def project_git(project: Dict, git_manager) -> Dict:
+    """Root name -> GitManager for the root holding the project's repository
+    (get_git_manager uses web_path when set, else app_path)"""
+    if not git_manager or not git_manager.is_initialized():
+        return {}
+    return {'web' if project.get('web_path') else 'app': git_manager}
+
+
+@contextmanager
+def _mysql_options_file(project: Dict):
+    """Client options file with the project's credentials, so the password
+    never appears on a command line"""
+    def quote(value):
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    fd, path = tempfile.mkstemp(prefix='codehero-my-', suffix='.cnf')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write("[client]\n")
+            f.write(f"host={quote(project.get('db_host') or 'localhost')}\n")
+            f.write(f"user={quote(project['db_user'])}\n")
+            f.write(f"password={quote(project['db_password'])}\n")
+        yield path
+    finally:
+        os.unlink(path)
+
+
+class DumpStream:
+    """mysqldump output as a readable binary stream.
+
+    Nothing is buffered beyond the pipe; after close(), ok tells whether
+    mysqldump finished successfully (a dump closed early is not ok).
+    """
+
+    def __init__(self, project: Dict, options: List[str]):
+        self._options = _mysql_options_file(project)
+        options_path = self._options.__enter__()
+        try:
+            self.proc = subprocess.Popen(
+                ['mysqldump', f'--defaults-extra-file={options_path}'] + list(options) + [project['db_name']],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+        except BaseException:
+            self._options.__exit__(None, None, None)
+            raise
+        self.ok = None
+
+    def read(self, size: int = -1) -> bytes:
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        if self.ok is None:
+            self.proc.stdout.close()
+            self.ok = self.proc.wait() == 0
+            self._options.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_sql(project: Dict, src) -> Tuple[bool, str]:
+    """Stream SQL from a readable binary file into the project's database"""
+    with _mysql_options_file(project) as options_path, tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(
+            ['mysql', f'--defaults-extra-file={options_path}', project['db_name']],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=errors
+        )
+        try:
+            shutil.copyfileobj(src, proc.stdin, HASH_CHUNK)
+        except BrokenPipeError:
+            pass    # mysql stopped reading (error) - reported below
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        if proc.wait() != 0:
+            errors.seek(0)
+            return False, errors.read().decode('utf-8', 'replace').strip()[:500] or "mysql failed"
+    return True, "OK"
+
+
+@contextmanager
+def _compressed_writer(raw, parallel: bool):
+    """Gzip writer over raw: pigz on all cores when parallel and installed,
+    else the gzip module"""
+    pigz = shutil.which('pigz') if parallel else None
+    if pigz:
+        proc = subprocess.Popen([pigz, f'-{GZIP_LEVEL}', '-c', '-n'],
+                                stdin=subprocess.PIPE, stdout=raw)
+        try:
+            yield proc.stdin
+        finally:
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise IOError("pigz failed")
+    else:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as out:
+            yield out
+
+
+class BackupStore:
+    """Content-addressed snapshot store for one project's backup directory"""
+
+    def __init__(self, backup_dir: str):
+        self.backup_dir = backup_dir
+        self.root = os.path.join(backup_dir, STORE_DIRNAME)
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.snapshots_dir = os.path.join(self.root, 'snapshots')
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.refs_path = os.path.join(self.root, 'refs.json')
+        self.lock_path = os.path.join(self.root, 'lock')
+
+    # ---------- locking / small json files ----------
+
+    def _ensure_dirs(self):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, exclusive: bool = True):
+        """Serialize writers (daemon and web app) and keep GC away from readers"""
+        self._ensure_dirs()
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_json(self, path: str, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def _write_json(self, path: str, data, indent=None):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=indent, separators=None if indent else (',', ':'))
+        os.replace(tmp, path)
+
+    # ---------- objects ----------
+
+    def _object_path(self, digest: str) -> Optional[str]:
+        base = os.path.join(self.objects_dir, digest[:2], digest)
+        for path in (base + '.gz', base):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def has_object(self, digest: str) -> bool:
+        return self._object_path(digest) is not None
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(HASH_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _write_object(self, src, name: str, parallel: bool) -> Tuple[str, int, str, bool]:
+        """Copy src into a temp file in the objects dir, hashing on the way.
+        Returns (hash, size, temp path, compressed)"""
+        compress = not is_compressed_name(name)
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.objects_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                with (_compressed_writer(raw, parallel) if compress else nullcontext(raw)) as out:
+                    while True:
+                        chunk = src.read(HASH_CHUNK)
+                        if not chunk:
+                            break
+                        h.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+            return h.hexdigest(), size, tmp, compress
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _commit_object(self, digest: str, tmp: str, compressed: bool) -> int:
+        """Move a written temp file into place unless the object exists. Returns bytes written"""
+        if self.has_object(digest):
+            os.unlink(tmp)
+            return 0
+        dest_dir = os.path.join(self.objects_dir, digest[:2])
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, digest + ('.gz' if compressed else ''))
+        os.replace(tmp, dest)
+        return os.path.getsize(dest)
+
+    def put_file(self, path: str, digest: str = None) -> Tuple[str, int]:
+        """Add a file's contents to the store. Returns (hash, bytes written)"""
+        digest = digest or self.hash_file(path)
+        if self.has_object(digest):
+            return digest, 0
+        with open(path, 'rb') as src:
+            _, _, tmp, compressed = self._write_object(src, path, os.fstat(src.fileno()).st_size >= PARALLEL_GZIP_MIN)
+        return digest, self._commit_object(digest, tmp, compressed)
+
+    def put_stream(self, src, name: str) -> Tuple[str, int, int]:
+        """Add a stream's contents to the store in one pass.
+        Returns (hash, size, bytes written)"""
+        digest, size, tmp, compressed = self._write_object(src, name, True)
+        return digest, size, self._commit_object(digest, tmp, compressed)
+
+    def open_object(self, digest: str):
+        """Open an object for reading its original contents"""
+        path = self._object_path(digest)
+        if not path:
+            raise FileNotFoundError(f"Backup object missing: {digest}")
+        return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+    # ---------- snapshot ----------
+
+    def _scan_root(self, root_name: str, src_root: str, index: Dict, new_index: Dict,
+                   stats: Dict, tracked: set = None, path_filter: PathFilter = None) -> Dict[str, Dict]:
+        """Walk one source directory, storing changed files. Returns its manifest entries.
+        .git is always left out, and with tracked (a git checkpoint) the tracked
+        paths too; paths excluded by path_filter are never visited.
+        Files not in the index are hashed and compressed on a thread pool."""
+        entries = {}
+        changed = []
+        for dirpath, rel_dir, dirnames, filenames in (path_filter or PathFilter()).walk(src_root):
+            if not rel_dir and '.git' in dirnames:
+                dirnames.remove('.git')
+            # os.walk lists symlinked dirs as dirs without entering them; keep them as links
+            names = filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+            if not names and not dirnames and rel_dir:
+                entries[rel_dir + '/'] = {'d': 1}
+            if tracked is not None:
+                names = [n for n in names if (os.path.join(rel_dir, n) if rel_dir else n) not in tracked]
+            for name in names:
+                full = os.path.join(dirpath, name)
+                rel = os.path.join(rel_dir, name) if rel_dir else name
+                try:
+                    st = os.lstat(full)
+                    if os.path.islink(full):
+                        entries[rel] = {'l': os.readlink(full)}
+                        continue
+                    if not os.path.isfile(full):
+                        continue
+                    key = f"{root_name}:{full}"
+                    cached = index.get(key)
+                    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns \
+                            and self.has_object(cached[2]):
+                        self._add_entry(entries, new_index, stats, key, rel, st, cached[2])
+                    else:
+                        changed.append((key, rel, full, st))
+                except OSError:
+                    # File vanished or unreadable mid-walk - same as copytree skipping it
+                    continue
+
+        if changed:
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+                futures = [(item, pool.submit(self.put_file, item[2])) for item in changed]
+                for (key, rel, full, st), future in futures:
+                    try:
+                        digest, written = future.result()
+                    except OSError:
+                        continue
+                    stats['hashed'] += 1
+                    if written:
+                        stats['new_files'] += 1
+                        stats['new_bytes'] += written
+                    self._add_entry(entries, new_index, stats, key, rel, st, digest)
+        return entries
+
+    @staticmethod
+    def _add_entry(entries: Dict, new_index: Dict, stats: Dict, key: str, rel: str,
+                   st: os.stat_result, digest: str):
+        new_index[key] = [st.st_size, st.st_mtime_ns, digest]
+        entries[rel] = {'h': digest, 's': st.st_size, 'm': st.st_mtime_ns, 'p': st.st_mode & 0o7777}
+        stats['files'] += 1
+        stats['bytes'] += st.st_size
+
+    def snapshot(self, name: str, roots: Dict[str, str], files: Dict[str, str] = None,
+                 info: Dict = None, git: Dict = None, skip_unchanged: bool = False,
+                 filters: Dict[str, PathFilter] = None) -> Dict:
+        """Record a new snapshot.
+
+        roots: root name ('web', 'app') -> source directory
+        files: 'root/relative/path' -> local file, or a callable returning a
+            readable stream (e.g. a DumpStream). Stored without mtime so
+            identical dumps compare equal
+        git: root name -> GitManager of that root, for git checkpoints
+        filters: root name -> PathFilter of paths to leave out
+        skip_unchanged: don't record a snapshot identical to the newest one
+            (the newest one's summary is returned with 'skipped': True)
+        Returns the snapshot summary (see list_snapshots).
+        """
+        checkpoints = {}
+        for root_name, gm in (git or {}).items():
+            checkpoint = gm.get_checkpoint() if gm and roots.get(root_name) else None
+            if checkpoint:
+                checkpoints[root_name] = checkpoint
+
+        with self._lock():
+            # Before any object is written: a refs rebuild sweeps unreferenced objects
+            refs = self._load_refs()
+            index = self._read_json(self.index_path, {})
+            new_index = {}
+            stats = {'files': 0, 'bytes': 0, 'hashed': 0, 'new_files': 0, 'new_bytes': 0}
+            manifest_roots = {}
+            manifest_excludes = {}
+
+            for root_name, src_root in roots.items():
+                if src_root and os.path.isdir(src_root):
+                    tracked = set(checkpoints[root_name]['tracked']) if root_name in checkpoints else None
+                    path_filter = (filters or {}).get(root_name)
+                    manifest_roots[root_name] = self._scan_root(root_name, src_root, index, new_index,
+                                                                stats, tracked, path_filter)
+                    if path_filter:
+                        manifest_excludes[root_name] = path_filter.spec()
+
+            for vpath, source in (files or {}).items():
+                root_name, _, rel = vpath.partition('/')
+                if callable(source):
+                    # Stream opener (e.g. a DumpStream): skipped if it reports failure
+                    src = source()
+                    try:
+                        digest, size, written = self.put_stream(src, rel)
+                    finally:
+                        src.close()
+                    if not getattr(src, 'ok', True):
+                        if written and digest not in refs:
+                            os.remove(self._object_path(digest))
+                        continue
+                else:
+                    size = os.path.getsize(source)
+                    digest, written = self.put_file(source)
+                stats['files'] += 1
+                stats['bytes'] += size
+                if written:
+                    stats['new_files'] += 1
+                    stats['new_bytes'] += written
+                manifest_roots.setdefault(root_name, {})[rel] = {
+                    'h': digest, 's': size, 'p': 0o644}
+
+            manifest_git = {root_name: {'commit': c['commit'], 'branch': c['branch'],
+                                        'tracked': len(c['tracked']), 'dirty': c['dirty']}
+                            for root_name, c in checkpoints.items()}
+
+            if skip_unchanged:
+                latest = self.list_snapshots()[:1]
+                previous = self.load(latest[0]['name']) if latest else None
+                if previous and previous.get('roots') == manifest_roots \
+                        and previous.get('git', {}) == manifest_git \
+                        and previous.get('excludes', {}) == manifest_excludes:
+                    self._write_json(self.index_path, new_index)
+                    return dict(self._summary(previous), skipped=True)
+
+            manifest = {
+                'name': name,
+                'created_at': datetime.now().isoformat(),
+                'info': info or {},
+                'stats': stats,
+                'roots': manifest_roots,
+                'git': manifest_git,
+                'excludes': manifest_excludes,
+            }
+            self._write_json(self._manifest_path(name), manifest)
+
+            for digest in self._manifest_hashes(manifest):
+                refs[digest] = refs.get(digest, 0) + 1
+            self._write_json(self.refs_path, refs)
+            self._write_json(self.index_path, new_index)
+
+        for root_name, checkpoint in checkpoints.items():
+            git[root_name].pin_backup_ref(self._stem(name), checkpoint['commit'])
+        return self._summary(manifest)
+
+    # ---------- manifests / listing ----------
+
+    @staticmethod
+    def _stem(name: str) -> str:
+        name = os.path.basename(name)
+        return name[:-len(SNAPSHOT_EXT)] if name.endswith(SNAPSHOT_EXT) else name
+
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.snapshots_dir, self._stem(name) + '.json')
+
+    @staticmethod
+    def _manifest_hashes(manifest: Dict) -> set:
+        return {e['h'] for entries in manifest.get('roots', {}).values()
+                for e in entries.values() if 'h' in e}
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._manifest_path(name))
+
+    def load(self, name: str) -> Optional[Dict]:
+        return self._read_json(self._manifest_path(name), None)
+
+    @staticmethod
+    def _summary(manifest: Dict) -> Dict:
+        stats = manifest.get('stats', {})
+        return {
+            'name': manifest['name'],
+            'created_at': manifest.get('created_at'),
+            'trigger': manifest.get('info', {}).get('trigger', 'unknown'),
+            'size': stats.get('bytes', 0),
+            'files': stats.get('files', 0),
+            'new_files': stats.get('new_files', 0),
+            'new_bytes': stats.get('new_bytes', 0),
+            'git': {root_name: c['commit'] for root_name, c in manifest.get('git', {}).items()},
+        }
+
+    def list_snapshots(self) -> List[Dict]:
+        """Snapshot summaries, newest first"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        result = []
+        for fname in os.listdir(self.snapshots_dir):
+            if fname.endswith('.json'):
+                manifest = self._read_json(os.path.join(self.snapshots_dir, fname), None)
+                if manifest and 'name' in manifest:
+                    result.append(self._summary(manifest))
+        result.sort(key=lambda s: s['created_at'] or '', reverse=True)
+        return result
+
+    # ---------- delete / prune ----------
+
+    def _load_refs(self) -> Dict[str, int]:
+        refs = self._read_json(self.refs_path, None)
+        if refs is None:
+            refs = self._rebuild_refs()
+        return refs
+
+    def _rebuild_refs(self) -> Dict[str, int]:
+        """Recount references from the manifests and drop unreferenced objects
+        (left behind by an interrupted snapshot or a lost refs.json)"""
+        refs = {}
+        if os.path.isdir(self.snapshots_dir):
+            for fname in os.listdir(self.snapshots_dir):
+                if fname.endswith('.json'):
+                    manifest = self._read_json(os.path.join(self.snapshots_dir, fname), {})
+                    for digest in self._manifest_hashes(manifest):
+                        refs[digest] = refs.get(digest, 0) + 1
+        if os.path.isdir(self.objects_dir):
+            for sub in os.listdir(self.objects_dir):
+                sub_dir = os.path.join(self.objects_dir, sub)
+                if not os.path.isdir(sub_dir):
+                    os.remove(sub_dir)      # Temp file of an interrupted write
+                    continue
+                for fname in os.listdir(sub_dir):
+                    if fname.split('.')[0] not in refs:
+                        os.remove(os.path.join(sub_dir, fname))
+        return refs
+
+    def _delete_locked(self, name: str, refs: Dict[str, int]) -> int:
+        """Remove a manifest and release its objects. Returns bytes freed"""
+        manifest = self.load(name)
+        if manifest is None:
+            return 0
+        freed = 0
+        for digest in self._manifest_hashes(manifest):
+            count = refs.get(digest, 0) - 1
+            if count > 0:
+                refs[digest] = count
+                continue
+            refs.pop(digest, None)
+            path = self._object_path(digest)
+            if path:
+                freed += os.path.getsize(path)
+                os.remove(path)
+        os.remove(self._manifest_path(name))
+        return freed
+
+    def _prune_git_refs(self, git: Dict):
+        """Unpin checkpoint commits of snapshots that are gone"""
+        names = {self._stem(snap['name']) for snap in self.list_snapshots()}
+        for gm in (git or {}).values():
+            if gm:
+                gm.prune_backup_refs(names)
+
+    def delete(self, name: str, git: Dict = None) -> bool:
+        """Delete one snapshot. Returns False if it does not exist"""
+        with self._lock():
+            if not self.exists(name):
+                return False
+            refs = self._load_refs()
+            self._delete_locked(name, refs)
+            self._write_json(self.refs_path, refs)
+            self._prune_git_refs(git)
+        return True
+
+    def prune(self, keep: int, git: Dict = None) -> int:
+        """Keep the newest `keep` snapshots. Returns the number deleted"""
+        with self._lock():
+            snapshots = self.list_snapshots()
+            old = snapshots[keep:]
+            if not old:
+                return 0
+            refs = self._load_refs()
+            for snap in old:
+                self._delete_locked(snap['name'], refs)
+            self._write_json(self.refs_path, refs)
+            self._prune_git_refs(git)
+        return len(old)
+
+    # ---------- restore / export ----------
+
+    def _write_entry(self, entry: Dict, dest: str):
+        parent = os.path.dirname(dest)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        if os.path.islink(dest) or (os.path.exists(dest) and not os.path.isfile(dest)):
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                shutil.rmtree(dest)
+            else:
+                os.remove(dest)
+        if 'l' in entry:
+            if os.path.lexists(dest):
+                os.remove(dest)
+            os.symlink(entry['l'], dest)
+            return
+        tmp = f"{dest}.restore-tmp"
+        with self.open_object(entry['h']) as src, open(tmp, 'wb') as out:
+            shutil.copyfileobj(src, out, HASH_CHUNK)
+        os.chmod(tmp, entry.get('p', 0o644))
+        os.replace(tmp, dest)
+        if 'm' in entry:
+            os.utime(dest, ns=(entry['m'], entry['m']))
+
+    def restore_root(self, manifest: Dict, root_name: str, target: str, tracked: set = None) -> Dict:
+        """Make target identical to one root of a snapshot.
+
+        Files whose size and mtime already match are left alone, the rest are
+        rewritten from the store, and anything not in the snapshot is removed
+        (except .git, the tracked paths of a git checkpoint, and the paths
+        the snapshot's exclude filter left out).
+        """
+        entries = manifest.get('roots', {}).get(root_name)
+        stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+        if entries is None:
+            return stats
+        # Older snapshots of dirty repositories stored .git; never write it back
+        entries = {rel: entry for rel, entry in entries.items()
+                   if rel.split('/', 1)[0] != '.git'}
+        os.makedirs(target, exist_ok=True)
+        tracked = tracked or set()
+
+        # Remove what the snapshot does not have (deepest first)
+        keep_dirs = set()
+        for rel in list(entries) + list(tracked):
+            parts = rel.rstrip('/').split('/')
+            for i in range(1, len(parts) + (1 if rel.endswith('/') else 0)):
+                keep_dirs.add('/'.join(parts[:i]))
+        path_filter = PathFilter.from_spec(manifest.get('excludes', {}).get(root_name)) or PathFilter()
+        # Children come before their parent in a reversed top-down walk
+        walk = []
+        for step in path_filter.walk(target):
+            if not step[1] and '.git' in step[2]:
+                step[2].remove('.git')
+            walk.append(step)
+        for dirpath, rel_dir, dirnames, filenames in reversed(walk):
+            if not rel_dir and '.git' in filenames:
+                filenames.remove('.git')        # Worktree/submodule pointer file
+            for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+                rel = os.path.join(rel_dir, name) if rel_dir else name
+                if rel not in entries and rel not in tracked:
+                    os.remove(os.path.join(dirpath, name))
+                    stats['removed'] += 1
+            if rel_dir and rel_dir not in keep_dirs and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+        for rel, entry in entries.items():
+            dest = os.path.join(target, rel)
+            if entry.get('d'):
+                os.makedirs(dest, exist_ok=True)
+                continue
+            if 'h' in entry:
+                try:
+                    st = os.lstat(dest)
+                    if not os.path.islink(dest) and os.path.isfile(dest) \
+                            and st.st_size == entry['s'] and st.st_mtime_ns == entry.get('m'):
+                        stats['unchanged'] += 1
+                        continue
+                except OSError:
+                    pass
+            elif os.path.islink(dest) and os.readlink(dest) == entry['l']:
+                stats['unchanged'] += 1
+                continue
+            self._write_entry(entry, dest)
+            stats['written'] += 1
+        return stats
+
+    def restore(self, name: str, targets: Dict[str, str], git: Dict = None) -> Dict:
+        """Restore the given roots of a snapshot. Returns the manifest.
+        Roots saved as git checkpoints need their GitManager in git."""
+        with self._lock(exclusive=False):
+            manifest = self.load(name)
+            if manifest is None:
+                raise FileNotFoundError(f"Snapshot not found: {name}")
+            for root_name, target in targets.items():
+                if not target:
+                    continue
+                tracked = None
+                checkpoint = manifest.get('git', {}).get(root_name)
+                if checkpoint:
+                    gm = (git or {}).get(root_name)
+                    if not gm:
+                        raise RuntimeError(f"Backup of {root_name} refers to git commit "
+                                           f"{checkpoint['commit'][:7]} but {target} is not a git repository")
+                    success, message = gm.restore_tracked_files(checkpoint['commit'])
+                    if not success:
+                        raise RuntimeError(message)
+                    # Files changed since the commit come from the snapshot (or are removed)
+                    tracked = set(gm.list_tracked_files() or []) - set(checkpoint.get('dirty', []))
+                self.restore_root(manifest, root_name, target, tracked)
+        return manifest
+
+    def open_entry(self, manifest: Dict, root_name: str, rel: str):
+        """Open one stored file of a snapshot for reading (None if not in it)"""
+        entry = manifest.get('roots', {}).get(root_name, {}).get(rel)
+        return self.open_object(entry['h']) if entry and 'h' in entry else None
+
+    def extract_root(self, manifest: Dict, root_name: str, dest_dir: str) -> List[str]:
+        """Write one root of a snapshot into dest_dir. Returns the relative paths written"""
+        written = []
+        for rel, entry in manifest.get('roots', {}).get(root_name, {}).items():
+            if 'h' in entry:
+                self._write_entry(entry, os.path.join(dest_dir, rel))
+                written.append(rel)
+        return written
+
+    def export(self, name: str, dest, fmt: str = 'zip', git: Dict = None) -> str:
+        """Write a snapshot to dest (a writable binary file) as an archive laid
+        out like the old backup zips. Tracked files of git checkpoints are read
+        with `git archive`. Returns the format written (zip if tar.zst is unavailable)"""
+        with self._lock(exclusive=False):
+            manifest = self.load(name)
+            if manifest is None:
+                raise FileNotFoundError(f"Snapshot not found: {name}")
+            with open_archive(dest, fmt) as archive:
+                archive.add_bytes('backup_info.json', json.dumps(
+                    dict(manifest.get('info', {}), created_at=manifest.get('created_at'),
+                         git=manifest.get('git', {})), indent=2).encode('utf-8'))
+                for root_name, checkpoint in manifest.get('git', {}).items():
+                    gm = (git or {}).get(root_name)
+                    if gm:
+                        self._archive_git_tree(archive, root_name, gm, checkpoint['commit'],
+                                               set(checkpoint.get('dirty', [])))
+                created = datetime.fromisoformat(manifest['created_at']).timestamp()
+                for root_name, entries in manifest.get('roots', {}).items():
+                    for rel, entry in entries.items():
+                        if 'h' in entry:
+                            archive.add(f"{root_name}/{rel}", lambda digest=entry['h']: self.open_object(digest),
+                                        entry.get('p', 0o644), entry['m'] / 1e9 if 'm' in entry else created)
+            return archive.format
+
+    @staticmethod
+    def _archive_git_tree(archive, root_name: str, gm, commit_hash: str, skip: set = frozenset()):
+        """Copy the files of a commit into the archive under root_name/
+        (except skip: paths the snapshot stores itself or that were deleted)"""
+        proc = gm.open_archive(commit_hash)
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                for member in tar:
+                    if not member.isfile() or member.name in skip:
+                        continue
+                    arcname = f"{root_name}/{member.name}"
+                    with tar.extractfile(member) as src:
+                        if member.size <= SPOOL_MAX:
+                            # Small files are compressed on the writer's pool
+                            archive.add_bytes(arcname, src.read(), member.mode, member.mtime)
+                        else:
+                            archive.add_stream(arcname, src, member.mode, member.mtime)
+        finally:
+            proc.stdout.close()
+            proc.wait()
@@ -4,11 +4,14 @@ CodeHero CLI - Command line tool for managing projects and tickets
 """
 
 import argparse
+import json
 import sys
 import os
+import socket
 import mysql.connector
 
 CONFIG_FILE = "/etc/codehero/system.conf"
+DAEMON_COMMAND_SOCKET = "/var/run/codehero/commands.sock"
 
 def load_config():
     config = {}
@@ -30,6 +33,18 @@ def get_db():
         database=config.get('DB_NAME', 'claude_knowledge')
     )
 
+def notify_daemon(ticket_id):
+    """Tell the daemon about a new ticket so it is picked up right away (best effort)"""
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.sendto(json.dumps({'ticket_id': int(ticket_id)}).encode('utf-8'), DAEMON_COMMAND_SOCKET)
+        finally:
+            sock.close()
+    except Exception:
+        pass
+
 def generate_ticket_number(project_code, conn):
     cursor = conn.cursor()
     cursor.execute("""
@@ -174,6 +189,7 @@ def ticket_add(args):
         ticket_id = cursor.lastrowid
         cursor.close()
         conn.close()
+        notify_daemon(ticket_id)
         
         print(f"✅ Ticket created: {ticket_number}")
         print(f"   Title: {args.title}")
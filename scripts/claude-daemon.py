@@ -10,6 +10,7 @@ Claude Code Daemon v3 - Multi-worker with project isolation
 import subprocess
 import time
 import json
+import re
 import os
 import sys
 
@@ -23,15 +24,21 @@ import smtplib
 import threading
 import urllib.request
 import urllib.error
-import shutil
-import zipfile
-import tempfile
 import select
+import queue
+import socket
+import hashlib
+from collections import OrderedDict, Counter, deque
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import mysql.connector
 from mysql.connector import pooling
+from token_counter import count_tokens, count_message_tokens, configure_tokenizer
+from backup_store import (BackupStore, DumpStream, snapshot_name, project_git,
+                          BACKUP_SCHEMA_DUMP, BACKUP_DATA_DUMP)
+from path_filter import project_filter
+from project_watcher import ProjectWatcher
 
 # Import Smart Context Manager
 try:
@@ -54,16 +61,73 @@ except ImportError:
 BACKUP_DIR = "/var/backups/codehero"
 MAX_BACKUPS = 30
 
-# Web app URL for broadcasting messages
+# Web app URL for broadcasting messages (fallback when the broadcast socket is down)
 WEB_APP_URL = "http://127.0.0.1:5000"
+# Long-lived daemon -> web event stream (newline-delimited JSON)
+BROADCAST_SOCKET = "/var/run/codehero/broadcast.sock"
+BROADCAST_QUEUE_SIZE = 2000     # Producers block briefly (then drop) when this many events are pending
+BROADCAST_RECONNECT_DELAY = 5   # Seconds between reconnect attempts; HTTP is used meanwhile
 
 CONFIG_FILE = "/etc/codehero/system.conf"
 PID_FILE = "/var/run/codehero/daemon.pid"
+# Unix datagram socket the web app uses to wake workers on /skip, /stop, /done and new messages
+COMMAND_SOCKET = "/var/run/codehero/commands.sock"
 LOG_FILE = "/var/log/codehero/daemon.log"
 GLOBAL_CONTEXT_FILE = "/etc/codehero/global-context.md"
 STUCK_TIMEOUT_MINUTES = 30
 POLL_INTERVAL = 3
+# The main loop sleeps until a ticket event (command socket, worker exit) arrives;
+# these timers cover housekeeping and changes made without notifying the daemon
+DISPATCH_FALLBACK_INTERVAL = 30     # Rescan the ready queue at least this often
+WORKER_CLEANUP_INTERVAL = 60        # Drop dead workers, reset orphaned in_progress tickets
+REVIEW_CHECK_INTERVAL = 600         # Auto-close expired awaiting_input reviews
+
+# Ticket leases: a claimed ticket belongs to one daemon process until its lease expires
+LEASE_SECONDS = 600                 # Lease length granted by a claim or heartbeat
+LEASE_HEARTBEAT_INTERVAL = 60       # How often a running worker renews its lease
+CLAIM_CANDIDATES = 5                # Ranked tickets tried per claim (others may be locked by other daemons)
+
+# Cluster: daemon nodes sharing the database split projects by consistent hashing
+NODE_HEARTBEAT_INTERVAL = 20        # Seconds between daemon_nodes heartbeats
+NODE_TIMEOUT = 90                   # A node without heartbeat for this long is considered dead
+RING_VNODES = 64                    # Virtual points per node on the hash ring
 MAX_PARALLEL_PROJECTS = 3
+# Parallel tickets: each extra ticket of a project runs in its own git worktree
+WORKTREE_ROOT = "/var/lib/codehero/worktrees"
+MAX_PARALLEL_TICKETS = 8
+
+# Global ticket scheduler
+PRIORITY_LEVELS = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+SCHEDULER_AGING_MINUTES = 10    # A waiting ticket moves up one priority level per this many minutes
+CRITICAL_RESERVED_SLOTS = 1     # Extra workers only critical tickets may use when all slots are busy
+CRITICAL_START_TARGET = 60      # Seconds; waits above this are logged as warnings
+SCHEDULER_WAIT_SAMPLES = 500    # Time-to-start samples kept per priority
+SCHEDULER_STATS_INTERVAL = 15   # Seconds between daemon_status.scheduler_stats updates
+
+# Adaptive concurrency (ADAPTIVE_CONCURRENCY, PARALLEL_FLOOR, PARALLEL_CEILING in system.conf)
+CONCURRENCY_ADJUST_INTERVAL = 60    # Seconds between regular adjustments
+CONCURRENCY_WINDOW = 300            # Seconds of rate-limit/throughput history considered
+RATE_LIMIT_COOLDOWN = 600           # No increases for this long after a rate-limit error
+RATE_LIMIT_MIN_GAP = 30             # Minimum seconds between two rate-limit decreases
+CPU_BUSY_HIGH, CPU_BUSY_LOW = 0.90, 0.60
+LOAD_PER_CORE_HIGH, LOAD_PER_CORE_LOW = 1.5, 0.7
+MEM_AVAILABLE_LOW, MEM_AVAILABLE_OK = 0.10, 0.25
+CONCURRENCY_HISTORY = 50            # Changes kept in daemon_status.concurrency_log
+# API error types, or a 429/529 reported as a status ("API Error: 529 {...}", "HTTP 429") -
+# not the words in free text, where Claude may well be writing about rate limits
+RATE_LIMIT_PATTERN = re.compile(
+    r'\b(?:rate_limit_error|overloaded_error)\b'
+    r'|\b(?:API Error|HTTP(?:/[\d.]+)?|status(?:[ _]code)?)["\':=\s]{0,3}(?:429|529)\b', re.IGNORECASE)
+
+# Write-behind batching for conversation_messages / execution_logs
+WRITE_BATCH_SIZE = 50           # Flush when this many rows are queued
+WRITE_BATCH_INTERVAL = 0.2      # ...or when the oldest queued row is this old (seconds)
+
+# Fallback DB poll for user_messages while Claude runs (normally woken via COMMAND_SOCKET)
+USER_COMMAND_POLL_INTERVAL = 10
+
+# Cached static prompt prefixes, one per (project, ticket)
+PROMPT_CACHE_SIZE = 64
 
 # Telegram notification settings (loaded from config)
 TELEGRAM_BOT_TOKEN = ""
@@ -188,20 +252,782 @@ def notify(event_type, title, message, project_name=None, ticket_number=None):
 
     send_telegram(text)
 
+class BroadcastChannel(threading.Thread):
+    """Single multiplexed event stream from all workers to the web app.
+
+    Events are written as JSON lines over one persistent Unix socket
+    connection. The bounded queue applies backpressure to producers, and
+    queued status events for the same ticket are coalesced to the latest.
+    If the socket is unavailable, events fall back to the HTTP endpoint.
+    """
+
+    def __init__(self, daemon):
+        super().__init__(daemon=True)
+        self.daemon_ref = daemon
+        self.queue = queue.Queue(maxsize=BROADCAST_QUEUE_SIZE)
+        self.running = True
+        self.sock = None
+        self.last_connect_attempt = 0
+
+    def log(self, message, level="INFO"):
+        self.daemon_ref.log(f"[Broadcast] {message}", level)
+
+    def send(self, event):
+        try:
+            self.queue.put(event, timeout=1)
+        except queue.Full:
+            self.log(f"Queue full, dropping {event.get('type')} event", "WARNING")
+
+    def run(self):
+        while self.running or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            while len(batch) < 500:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._deliver(self._coalesce(batch))
+        self._close()
+
+    def stop(self):
+        self.running = False
+
+    def _coalesce(self, batch):
+        """Keep only the latest status event per ticket, preserving order"""
+        last_status = {}
+        for i, event in enumerate(batch):
+            if event.get('type') == 'status':
+                last_status[event.get('ticket_id')] = i
+        return [e for i, e in enumerate(batch)
+                if e.get('type') != 'status' or last_status.get(e.get('ticket_id')) == i]
+
+    def _connect(self):
+        if self.sock:
+            return True
+        if time.time() - self.last_connect_attempt < BROADCAST_RECONNECT_DELAY:
+            return False
+        self.last_connect_attempt = time.time()
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(BROADCAST_SOCKET)
+            self.sock = sock
+            self.log(f"Connected to {BROADCAST_SOCKET}")
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _deliver(self, events):
+        if self._connect():
+            try:
+                payload = ''.join(json.dumps(e, default=str) + '\n' for e in events)
+                self.sock.sendall(payload.encode('utf-8'))
+                return
+            except Exception as e:
+                self.log(f"Stream write failed, reconnecting later: {e}", "WARNING")
+                self._close()
+        for event in events:
+            self._post_http(event)
+
+    def _post_http(self, event):
+        try:
+            req = urllib.request.Request(
+                f"{WEB_APP_URL}/api/internal/broadcast",
+                data=json.dumps(event, default=str).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            urllib.request.urlopen(req, timeout=2)
+        except Exception:
+            pass  # Silent fail - not critical
+
+
+class MessageWriter(threading.Thread):
+    """Write-behind queue for conversation_messages and execution_logs rows.
+
+    The stdout reader only enqueues rows; this thread groups them into
+    multi-row INSERTs inside one transaction and broadcasts the saved
+    messages (with their ids) afterwards.
+    """
+
+    def __init__(self, worker):
+        super().__init__(daemon=True)
+        self.worker = worker
+        self.queue = queue.Queue()
+        self.running = True
+        self.id_step = None     # @@auto_increment_increment (above 1 on multi-primary/Galera)
+
+    def put_message(self, row):
+        self.queue.put(('message', row))
+
+    def put_log(self, row):
+        self.queue.put(('log', row))
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far has been written"""
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(('flush', done))
+        done.wait(timeout)
+
+    def stop(self):
+        self.running = False
+        self.queue.put(('flush', None))
+
+    def run(self):
+        while self.running or not self.queue.empty():
+            messages, logs, waiters = self._collect_batch()
+            if messages or logs:
+                self._write_batch(messages, logs)
+            for done in waiters:
+                if done:
+                    done.set()
+
+    def _collect_batch(self):
+        messages, logs, waiters = [], [], []
+        try:
+            item = self.queue.get(timeout=1.0)
+        except queue.Empty:
+            return messages, logs, waiters
+
+        deadline = time.time() + WRITE_BATCH_INTERVAL
+        while True:
+            kind, payload = item
+            if kind == 'message':
+                messages.append(payload)
+            elif kind == 'log':
+                logs.append(payload)
+            else:
+                # Flush marker - write what we have right away
+                waiters.append(payload)
+                break
+
+            if len(messages) + len(logs) >= WRITE_BATCH_SIZE:
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return messages, logs, waiters
+
+    def _write_batch(self, messages, logs):
+        try:
+            ids = self._insert(messages, logs)
+        except Exception as e:
+            self.worker.log(f"Error saving {len(messages)} message(s), {len(logs)} log(s): {e} - retrying", "WARNING")
+            try:
+                ids = self._insert(messages, logs)
+            except Exception as e:
+                # One bad row must not take the whole batch with it
+                self.worker.log(f"Batch insert failed again ({e}) - saving rows one by one", "WARNING")
+                self._write_rows(messages, logs)
+                return
+        self._broadcast(messages, ids)
+
+    def _write_rows(self, messages, logs):
+        for m in messages:
+            try:
+                self._broadcast([m], self._insert([m], []))
+            except Exception as e:
+                self.worker.log(f"Error saving message for ticket {m['ticket_id']}: {e}", "ERROR")
+        for l in logs:
+            try:
+                self._insert([], [l])
+            except Exception as e:
+                self.worker.log(f"Error saving log for session {l['session_id']}: {e}", "ERROR")
+
+    def _insert(self, messages, logs):
+        """Insert messages and logs in one transaction; returns the message ids"""
+        ids = []
+        conn = self.worker.get_db()
+        try:
+            cursor = conn.cursor()
+            if messages and self.id_step is None:
+                cursor.execute("SELECT @@auto_increment_increment")
+                self.id_step = int(cursor.fetchone()[0] or 1)
+            if messages:
+                placeholders = ','.join(['(%s, %s, %s, %s, %s, %s, %s, %s, NOW())'] * len(messages))
+                params = []
+                for m in messages:
+                    params.extend((m['ticket_id'], m['session_id'], m['role'], m['content'],
+                                   m['tool_name'], m['tool_input'], m['tokens_used'], m['token_count']))
+                cursor.execute(f"""
+                    INSERT INTO conversation_messages
+                    (ticket_id, session_id, role, content, tool_name, tool_input, tokens_used, token_count, created_at)
+                    VALUES {placeholders}
+                """, params)
+                # InnoDB hands out one block of ids to a single multi-row INSERT,
+                # auto_increment_increment apart
+                if cursor.lastrowid:
+                    ids = [cursor.lastrowid + i * self.id_step for i in range(len(messages))]
+            if logs:
+                placeholders = ','.join(['(%s, %s, %s, NOW())'] * len(logs))
+                params = []
+                for l in logs:
+                    params.extend((l['session_id'], l['log_type'], l['message']))
+                cursor.execute(f"""
+                    INSERT INTO execution_logs (session_id, log_type, message, created_at)
+                    VALUES {placeholders}
+                """, params)
+            conn.commit()
+            cursor.close()
+            return ids
+        finally:
+            # Back to the pool even on error (an uncommitted batch is rolled back there)
+            try: conn.close()
+            except: pass
+
+    def _broadcast(self, messages, ids):
+        """Send saved messages to the web app for real-time updates"""
+        for i, m in enumerate(messages):
+            self.worker.broadcast_message({
+                'id': ids[i] if i < len(ids) else None,
+                'ticket_id': m['ticket_id'],
+                'ticket_number': m['ticket_number'],
+                'role': m['role'],
+                'content': m['content'],
+                'tool_name': m['tool_name'],
+                'tool_input': m['tool_input'],
+                'created_at': m['created_at']
+            }, ticket_id=m['ticket_id'])
+
+
+class PromptCache:
+    """Static prompt prefixes per (project_id, ticket_id), shared by all workers.
+
+    A prefix is reused while its fingerprint (ticket fields, project map and
+    knowledge versions, git HEAD) is unchanged, so resumed tickets send
+    byte-identical leading text and Claude's prompt cache can serve it.
+    """
+
+    def __init__(self, max_entries=PROMPT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (project_id, ticket_id) -> (fingerprint, prefix)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fingerprint):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == fingerprint:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, fingerprint, prefix):
+        with self.lock:
+            self.entries[key] = (fingerprint, prefix)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, project_id=None, ticket_id=None):
+        """Drop cached prefixes for a ticket, a whole project, or everything"""
+        with self.lock:
+            for key in list(self.entries):
+                if (project_id is None or key[0] == project_id) and (ticket_id is None or key[1] == ticket_id):
+                    del self.entries[key]
+
+
+class TicketScheduler:
+    """Global ready queue over the open tickets of all active projects.
+
+    Tickets are ranked by aged priority (one level up per SCHEDULER_AGING_MINUTES
+    waited), then by weighted fair queuing between projects (a project's virtual
+    time advances by 1/parallel_tickets per started ticket), then by wait time.
+    Workers take their next ticket from here at every ticket boundary and give
+    up their slot when a better-ranked ticket elsewhere has no worker to run it.
+    """
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.lock = threading.Lock()
+        self.claimed = set()  # Ticket ids handed to a worker and not yet released
+        self.vtime = {}       # project_id -> virtual time
+        self.wait_samples = {p: deque(maxlen=SCHEDULER_WAIT_SAMPLES) for p in PRIORITY_LEVELS}
+        self.ready = []       # Unclaimed ready tickets from the last ranking
+        self.ready_at = None
+        self.waiting = 0      # Tickets the last plan() held back because all slots were busy
+
+    def load_ready(self):
+        conn = self.daemon.get_db()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT t.id, t.project_id, t.priority,
+                   TIMESTAMPDIFF(SECOND, COALESCE(t.updated_at, t.created_at), NOW()) as waited,
+                   p.name as project_name, COALESCE(p.web_path, p.app_path) as work_path, p.parallel_tickets
+            FROM tickets t
+            JOIN projects p ON t.project_id = p.id
+            WHERE t.status IN ('open', 'new', 'pending') AND p.status = 'active'
+        """)
+        tickets = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        # Other nodes schedule the projects they own
+        return [t for t in tickets if self.daemon.nodes.owns(t['project_id'])]
+
+    def level(self, ticket):
+        """Priority level after aging (0 = critical)"""
+        base = PRIORITY_LEVELS.get(ticket['priority'], PRIORITY_LEVELS['medium'])
+        return max(0, base - int(ticket['waited'] or 0) // (SCHEDULER_AGING_MINUTES * 60))
+
+    def rank(self):
+        """Reload the ready queue and return the unclaimed tickets best first (call under self.lock)"""
+        tickets = [t for t in self.load_ready() if t['id'] not in self.claimed]
+        # A project that was idle rejoins at the current virtual time instead
+        # of cashing in the credit it accumulated while it had nothing to run
+        backlogged = {t['project_id'] for t in tickets}
+        known = [self.vtime[pid] for pid in backlogged if pid in self.vtime]
+        floor = min(known) if known else 0.0
+        for pid in backlogged:
+            self.vtime[pid] = max(self.vtime.get(pid, floor), floor)
+
+        tickets.sort(key=lambda t: (self.level(t), self.vtime[t['project_id']], -(t['waited'] or 0), t['id']))
+        self.ready = tickets
+        self.ready_at = time.time()
+        return tickets
+
+    def running_counts(self):
+        with self.daemon.workers_lock:
+            return Counter(w.project_id for w in self.daemon.workers.values() if w.is_alive())
+
+    def plan(self):
+        """Ready tickets that should get a new worker now, best first"""
+        running = self.running_counts()
+        active = sum(running.values())
+        with self.lock:
+            ranked = self.rank()
+
+        starts = []
+        waiting = 0
+        for ticket in ranked:
+            if running[ticket['project_id']] >= self.daemon.get_ticket_lanes(ticket):
+                continue
+            limit = self.daemon.max_parallel
+            if ticket['priority'] == 'critical':
+                limit += CRITICAL_RESERVED_SLOTS
+            if active >= limit:
+                waiting += 1
+                continue
+            starts.append(ticket)
+            running[ticket['project_id']] += 1
+            active += 1
+        self.waiting = waiting
+        return starts
+
+    def next_ticket(self, worker):
+        """
+        Claim the best ready ticket of the worker's project.
+
+        Returns:
+            Tuple of (ticket_id, preempted) - ticket_id is None when the project
+            has nothing to run or (preempted=True) the slot should go elsewhere
+        """
+        running = self.running_counts()
+        active = sum(running.values())
+        with self.lock:
+            ranked = self.rank()
+            candidates = [t for t in ranked if t['project_id'] == worker.project_id]
+            if not candidates:
+                return None, False
+            own = candidates[0]
+
+            if active > self.daemon.max_parallel and own['priority'] != 'critical':
+                return None, True  # Hand the reserved critical slot back
+            if active >= self.daemon.max_parallel:
+                for t in ranked:
+                    if t is own:
+                        break
+                    if t['project_id'] != worker.project_id and running[t['project_id']] < self.daemon.get_ticket_lanes(t):
+                        return None, True
+
+            # Atomic claim in the database - another daemon may hold some of them
+            claimed_id = self.daemon.claim_ticket([t['id'] for t in candidates[:CLAIM_CANDIDATES]],
+                                                  {t['id']: self.daemon.get_ticket_lanes(t)
+                                                   for t in candidates[:CLAIM_CANDIDATES]})
+            if not claimed_id:
+                return None, False
+            own = next(t for t in candidates if t['id'] == claimed_id)
+            self.claimed.add(own['id'])
+            self.ready = [t for t in self.ready if t['id'] != own['id']]
+            weight = max(1, int(own.get('parallel_tickets') or 1))
+            self.vtime[own['project_id']] = self.vtime.get(own['project_id'], 0.0) + 1.0 / weight
+            self.wait_samples[own['priority']].append(int(own['waited'] or 0))
+
+        if own['priority'] == 'critical' and (own['waited'] or 0) > CRITICAL_START_TARGET:
+            self.daemon.log(f"Critical ticket {own['id']} waited {own['waited']}s to start", "WARNING")
+        return own['id'], False
+
+    def release(self, ticket_id):
+        with self.lock:
+            self.claimed.discard(ticket_id)
+
+    def stats(self):
+        """Queue depth, oldest wait and time-to-start percentiles per priority"""
+        with self.lock:
+            ready = list(self.ready)
+            samples = {p: sorted(s) for p, s in self.wait_samples.items()}
+            updated = self.ready_at
+
+        result = {'updated_at': updated, 'priorities': {}}
+        for priority in PRIORITY_LEVELS:
+            waiting = [int(t['waited'] or 0) for t in ready if t['priority'] == priority]
+            started = samples[priority]
+            result['priorities'][priority] = {
+                'queued': len(waiting),
+                'oldest_wait': max(waiting) if waiting else 0,
+                'started': len(started),
+                'wait_p50': started[len(started) // 2] if started else None,
+                'wait_p95': started[min(len(started) - 1, int(len(started) * 0.95))] if started else None,
+            }
+        result['queued'] = len(ready)
+        return result
+
+
+class NodeRegistry:
+    """Membership of this daemon in daemon_nodes and project ownership.
+
+    Every daemon registers a row and heartbeats it. Live nodes are placed on
+    a consistent hash ring (RING_VNODES points each); a project belongs to the
+    first node clockwise from its hash. When a node joins or stops
+    heartbeating only the projects next to its points move; tickets it was
+    running come back through lease expiry.
+    """
+
+    def __init__(self, daemon, node_id):
+        self.daemon = daemon
+        self.node_id = node_id
+        self.lock = threading.Lock()
+        self.ring = []          # sorted (point, node_id)
+        self.nodes = [node_id]  # live node ids
+        self.last_heartbeat = 0
+
+    @staticmethod
+    def hash_point(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def build_ring(self, nodes):
+        ring = sorted((self.hash_point(f"{node}#{i}"), node) for node in nodes for i in range(RING_VNODES))
+        with self.lock:
+            self.nodes = nodes
+            self.ring = ring
+        self.daemon.log(f"Cluster nodes: {', '.join(nodes)}")
+
+    def owner(self, project_id):
+        with self.lock:
+            ring = self.ring
+        if not ring:
+            return self.node_id
+        point = self.hash_point(f"project:{project_id}")
+        # First ring point at or after the project's point (wrapping around)
+        lo, hi = 0, len(ring)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ring[mid][0] < point:
+                lo = mid + 1
+            else:
+                hi = mid
+        return ring[lo % len(ring)][1]
+
+    def owns(self, project_id):
+        return self.owner(project_id) == self.node_id
+
+    def heartbeat(self, force=False):
+        """Update our daemon_nodes row and rebuild the ring from the live nodes (throttled)"""
+        if not force and time.time() - self.last_heartbeat < NODE_HEARTBEAT_INTERVAL:
+            return
+        self.last_heartbeat = time.time()
+        daemon = self.daemon
+        with daemon.workers_lock:
+            tickets = [w.current_ticket_number for w in daemon.workers.values()
+                       if w.is_alive() and w.current_ticket_number]
+        try:
+            conn = daemon.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO daemon_nodes (node_id, hostname, pid, status, started_at, last_heartbeat,
+                                          max_parallel, active_workers, active_tickets, scheduler_stats)
+                VALUES (%s, %s, %s, 'running', NOW(), NOW(), %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    hostname = VALUES(hostname),
+                    started_at = IF(pid = VALUES(pid) AND status = 'running', started_at, NOW()),
+                    pid = VALUES(pid), status = 'running', last_heartbeat = NOW(),
+                    max_parallel = VALUES(max_parallel), active_workers = VALUES(active_workers),
+                    active_tickets = VALUES(active_tickets), scheduler_stats = VALUES(scheduler_stats)
+            """, (self.node_id, socket.gethostname(), os.getpid(), daemon.max_parallel, len(tickets),
+                  json.dumps(tickets), json.dumps(daemon.scheduler.stats())))
+            conn.commit()
+            cursor.execute("""
+                SELECT node_id, last_heartbeat > DATE_SUB(NOW(), INTERVAL %s SECOND) FROM daemon_nodes
+                WHERE status = 'running'
+                ORDER BY node_id
+            """, (NODE_TIMEOUT,))
+            rows = cursor.fetchall()
+            nodes = [node for node, alive in rows if alive]
+            dead = [node for node, alive in rows if not alive]
+            if dead:
+                self.bury(cursor, dead)
+                conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            daemon.log(f"Node heartbeat failed: {e}", "WARNING")
+            return
+
+        if self.node_id not in nodes:
+            nodes = sorted(nodes + [self.node_id])
+        if nodes != self.nodes:
+            self.build_ring(nodes)
+            daemon.wake_scheduler()  # Ownership changed
+
+    def bury(self, cursor, dead_nodes):
+        """Mark nodes that stopped heartbeating as dead and reopen the tickets they held"""
+        placeholders = ','.join(['%s'] * len(dead_nodes))
+        cursor.execute(f"""
+            UPDATE daemon_nodes SET status = 'dead', active_workers = 0
+            WHERE node_id IN ({placeholders}) AND status = 'running'
+            AND last_heartbeat <= DATE_SUB(NOW(), INTERVAL %s SECOND)
+        """, dead_nodes + [NODE_TIMEOUT])
+        if cursor.rowcount == 0:
+            return  # Another node got there first
+        owner_clause = ' OR '.join(['claimed_by LIKE %s'] * len(dead_nodes))
+        cursor.execute(f"""
+            SELECT DISTINCT claimed_by FROM tickets
+            WHERE status = 'in_progress' AND ({owner_clause})
+        """, [f"{node}:%" for node in dead_nodes])
+        owners = [row[0] for row in cursor.fetchall()]
+        if owners:
+            self.daemon.reclaim_expired_leases(cursor, owners)
+        self.daemon.log(f"Node(s) {', '.join(dead_nodes)} stopped heartbeating; "
+                        f"reopened their tickets", "WARNING")
+
+    def leave(self):
+        try:
+            conn = self.daemon.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE daemon_nodes SET status = 'stopped', active_workers = 0, active_tickets = NULL
+                WHERE node_id = %s
+            """, (self.node_id,))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.daemon.log(f"Error leaving cluster: {e}", "WARNING")
+
+
+def default_parallel_ceiling(max_parallel):
+    """PARALLEL_CEILING when not configured: room to scale up on idle hosts
+    (up to twice MAX_PARALLEL_PROJECTS, bounded by the CPU count)"""
+    return max(max_parallel + 1, min(os.cpu_count() or 1, max_parallel * 2))
+
+
+def is_rate_limit_error(text):
+    """True for API rate-limit / overload errors (HTTP 429/529)"""
+    return bool(text and RATE_LIMIT_PATTERN.search(text))
+
+
+class ConcurrencyController:
+    """Adjusts daemon.max_parallel between a floor and a ceiling.
+
+    Additive increase while tickets are waiting for a slot, the host has
+    headroom (CPU, load average, memory) and token throughput keeps up;
+    one step down when the host is overloaded or throughput fell after the
+    last increase; halving on API rate-limit/overload errors, followed by
+    a cooldown. Lowering the limit never interrupts a ticket - workers over
+    the limit stop at their next ticket boundary.
+    """
+
+    def __init__(self, daemon, floor, ceiling):
+        self.daemon = daemon
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.lock = threading.Lock()
+        self.rate_limits = deque()  # timestamps of rate-limit errors
+        self.tokens = deque()       # (timestamp, tokens)
+        self.last_adjust = time.time()
+        self.last_decrease = 0
+        self.cooldown_until = 0
+        self.last_increase = None   # throughput (tokens/min) before the last increase
+        self.prev_cpu = self.read_cpu_times()
+        self.changes = deque(maxlen=CONCURRENCY_HISTORY)
+
+    def record_rate_limit(self, message=''):
+        with self.lock:
+            self.rate_limits.append(time.time())
+        self.daemon.log(f"API rate limit/overload: {message[:200]}", "WARNING")
+        self.daemon.wake_scheduler()
+
+    def record_tokens(self, count):
+        if count > 0:
+            with self.lock:
+                self.tokens.append((time.time(), count))
+
+    def _trim(self, now):
+        while self.rate_limits and self.rate_limits[0] < now - CONCURRENCY_WINDOW:
+            self.rate_limits.popleft()
+        while self.tokens and self.tokens[0][0] < now - CONCURRENCY_WINDOW:
+            self.tokens.popleft()
+
+    def throughput(self):
+        """Tokens per minute over the window"""
+        with self.lock:
+            self._trim(time.time())
+            return sum(n for _, n in self.tokens) * 60 / CONCURRENCY_WINDOW
+
+    def read_cpu_times(self):
+        """(busy, total) jiffies from /proc/stat"""
+        try:
+            with open('/proc/stat', 'r') as f:
+                values = [int(v) for v in f.readline().split()[1:]]
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            return sum(values) - idle, sum(values)
+        except Exception:
+            return None
+
+    def host_load(self):
+        """CPU busy fraction, load average per core and available memory fraction (None if unknown)"""
+        signals = {'cpu': None, 'load_per_core': None, 'mem_available': None}
+        cpu = self.read_cpu_times()
+        if cpu and self.prev_cpu and cpu[1] > self.prev_cpu[1]:
+            signals['cpu'] = round((cpu[0] - self.prev_cpu[0]) / (cpu[1] - self.prev_cpu[1]), 2)
+        self.prev_cpu = cpu
+        try:
+            signals['load_per_core'] = round(os.getloadavg()[0] / (os.cpu_count() or 1), 2)
+        except OSError:
+            pass
+        try:
+            meminfo = {}
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    key, value = line.split(':', 1)
+                    meminfo[key] = int(value.split()[0])
+            signals['mem_available'] = round(meminfo['MemAvailable'] / meminfo['MemTotal'], 2)
+        except Exception:
+            pass
+        return signals
+
+    def adjust(self, waiting):
+        """Called from the main loop; waiting = ready tickets held back by the limit"""
+        now = time.time()
+        with self.lock:
+            self._trim(now)
+            new_rate_limits = sum(1 for t in self.rate_limits if t > self.last_decrease)
+        limit = self.daemon.max_parallel
+
+        # Rate limits react immediately (but not to every error of the same storm)
+        if new_rate_limits and now - self.last_decrease >= RATE_LIMIT_MIN_GAP:
+            self.cooldown_until = now + RATE_LIMIT_COOLDOWN
+            self.last_decrease = now
+            self.set_limit(max(self.floor, limit // 2),
+                           f"{new_rate_limits} rate-limit error(s)", {'rate_limits': new_rate_limits})
+            return
+
+        if now - self.last_adjust < CONCURRENCY_ADJUST_INTERVAL:
+            return
+        self.last_adjust = now
+
+        signals = self.host_load()
+        signals['tokens_per_min'] = round(self.throughput())
+        signals['waiting'] = waiting
+
+        overloaded = [name for name, value, bad in (
+            ('cpu', signals['cpu'], lambda v: v >= CPU_BUSY_HIGH),
+            ('load', signals['load_per_core'], lambda v: v >= LOAD_PER_CORE_HIGH),
+            ('memory', signals['mem_available'], lambda v: v <= MEM_AVAILABLE_LOW),
+        ) if value is not None and bad(value)]
+        if overloaded:
+            self.last_decrease = now
+            self.set_limit(max(self.floor, limit - 1), f"host overloaded ({', '.join(overloaded)})", signals)
+            return
+
+        if self.last_increase is not None:
+            before, self.last_increase = self.last_increase, None
+            if signals['tokens_per_min'] < before * 0.9:
+                # The extra worker didn't add throughput - the API is the bottleneck
+                self.cooldown_until = now + RATE_LIMIT_COOLDOWN
+                self.set_limit(max(self.floor, limit - 1), "throughput dropped after increase", signals)
+                return
+
+        headroom = all((
+            signals['cpu'] is None or signals['cpu'] < CPU_BUSY_LOW,
+            signals['load_per_core'] is None or signals['load_per_core'] < LOAD_PER_CORE_LOW,
+            signals['mem_available'] is None or signals['mem_available'] > MEM_AVAILABLE_OK,
+        ))
+        if waiting and headroom and now >= self.cooldown_until and limit < self.ceiling:
+            self.last_increase = signals['tokens_per_min']
+            self.set_limit(limit + 1, f"{waiting} ticket(s) waiting, host has headroom", signals)
+
+    def set_limit(self, new_limit, reason, signals=None):
+        old_limit = self.daemon.max_parallel
+        new_limit = max(self.floor, min(self.ceiling, new_limit))
+        if new_limit == old_limit:
+            return
+        self.daemon.max_parallel = new_limit
+        self.changes.append({
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'from': old_limit, 'to': new_limit,
+            'reason': reason, 'signals': signals or {}
+        })
+        self.daemon.log(f"Concurrency {old_limit} -> {new_limit}: {reason}")
+        self.save()
+
+    def save(self):
+        """Record the current limit and recent changes in daemon_status"""
+        try:
+            conn = self.daemon.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE daemon_status SET max_parallel = %s, concurrency_log = %s WHERE id = 1
+            """, (self.daemon.max_parallel, json.dumps({
+                'floor': self.floor, 'ceiling': self.ceiling, 'changes': list(self.changes)
+            })))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.daemon.log(f"Error saving concurrency change: {e}", "WARNING")
+
+
 class ProjectWorker(threading.Thread):
     """Worker thread for a specific project"""
 
-    def __init__(self, daemon, project_id, project_name, work_path, global_context="", context_manager=None):
+    def __init__(self, daemon, project_id, project_name, work_path, global_context="", context_manager=None,
+                 lane=0, use_worktrees=False):
         super().__init__(daemon=True)
         self.daemon_ref = daemon
         self.project_id = project_id
         self.project_name = project_name
         self.work_path = work_path
+        self.lane = lane                    # Index among this project's concurrent workers
+        self.use_worktrees = use_worktrees  # Run each ticket in its own git worktree
+        self.worktree = None                # {path, branch, repo_path, base_branch} of the current ticket
+        self.preempted = False              # Scheduler gave this worker's slot to another project
+        self.lease_renewed_at = 0
         self.global_context = global_context
         self.context_manager = context_manager  # SmartContextManager instance
         self.running = True
         self.current_ticket_id = None
+        self.current_ticket_number = None
         self.current_session_id = None
+        self.context_snapshot = None  # ContextSnapshot from the last get_conversation_history
         self.last_activity = None
         # Token tracking
         self.session_start_time = None
@@ -210,100 +1036,109 @@ class ProjectWorker(threading.Thread):
         self.session_cache_read_tokens = 0
         self.session_cache_creation_tokens = 0
         self.session_api_calls = 0
-        
+        # Batched persistence of messages/logs (started in run())
+        self.writer = MessageWriter(self)
+        # Self-pipe woken by CommandListener when user commands arrive for our ticket
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
     def log(self, message, level="INFO"):
-        self.daemon_ref.log(f"[{self.project_name}] {message}", level)
+        name = f"{self.project_name}#{self.lane + 1}" if self.lane else self.project_name
+        self.daemon_ref.log(f"[{name}] {message}", level)
     
     def get_db(self):
         return self.daemon_ref.get_db()
-    
-    def broadcast_message(self, msg_data):
-        """Send message to web app for WebSocket broadcast"""
+
+    def wake(self):
+        """Signal run_claude that new user_messages are waiting"""
         try:
-            data = json.dumps({
-                'type': 'message',
-                'ticket_id': self.current_ticket_id,
-                'message': msg_data
-            }).encode('utf-8')
-            req = urllib.request.Request(
-                f"{WEB_APP_URL}/api/internal/broadcast",
-                data=data,
-                headers={'Content-Type': 'application/json'}
-            )
-            urllib.request.urlopen(req, timeout=2)
-        except Exception as e:
-            self.log(f"Broadcast failed: {e}", "ERROR")
+            os.write(self.wake_w, b'!')
+        except (BlockingIOError, OSError):
+            pass  # Pipe full (already signalled) or closed
+
+    def drain_wake(self):
+        try:
+            while os.read(self.wake_r, 1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def broadcast_message(self, msg_data, ticket_id=None):
+        """Send message to web app for WebSocket broadcast"""
+        self.daemon_ref.broadcaster.send({
+            'type': 'message',
+            'ticket_id': ticket_id or self.current_ticket_id,
+            'message': msg_data
+        })
 
     def save_message(self, role, content, tool_name=None, tool_input=None, tokens=0):
+        """Queue a conversation message; MessageWriter persists and broadcasts it"""
         if not self.current_ticket_id:
             return
         try:
             # Use actual token count from API if provided, otherwise estimate
-            if tokens > 0:
-                # Actual count from Claude API response
-                token_count = tokens
-            elif content:
-                # Estimate: ~4 chars per token for English/code
-                token_count = len(content.encode('utf-8')) // 4
-            elif tool_input:
-                # For tool_use messages, estimate tokens from tool_input
-                tool_input_str = json.dumps(tool_input) if isinstance(tool_input, dict) else str(tool_input)
-                token_count = len(tool_input_str.encode('utf-8')) // 4
-            else:
-                token_count = 0
-
-            conn = self.get_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO conversation_messages
-                (ticket_id, session_id, role, content, tool_name, tool_input, tokens_used, token_count, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-            """, (
-                self.current_ticket_id,
-                self.current_session_id,
-                role,
-                content[:50000] if content else None,
-                tool_name,
-                json.dumps(tool_input) if tool_input else None,
-                tokens,
-                token_count
-            ))
-            msg_id = cursor.lastrowid
-            conn.commit()
-            cursor.close()
-            conn.close()
-            self.last_activity = datetime.now()
+            token_count = tokens if tokens > 0 else count_message_tokens(content, tool_input)
 
-            # Broadcast to web app for real-time updates
-            self.broadcast_message({
-                'id': msg_id,
+            self.writer.put_message({
                 'ticket_id': self.current_ticket_id,
+                'ticket_number': self.current_ticket_number,
+                'session_id': self.current_session_id,
                 'role': role,
                 'content': content[:50000] if content else None,
                 'tool_name': tool_name,
                 'tool_input': json.dumps(tool_input) if tool_input else None,
+                'tokens_used': tokens,
+                'token_count': token_count,
                 'created_at': datetime.now().isoformat() + 'Z'
             })
+            self.last_activity = datetime.now()
         except Exception as e:
             self.log(f"Error saving message: {e}", "ERROR")
-    
+
     def save_log(self, log_type, message):
         if not self.current_session_id:
             return
+        try:
+            self.writer.put_log({
+                'session_id': self.current_session_id,
+                'log_type': log_type,
+                'message': message[:10000]
+            })
+        except: pass
+
+    def renew_lease(self, ticket_id, force=False):
+        """Heartbeat: extend our lease on the ticket. False if another daemon owns it now."""
+        if not force and time.time() - self.lease_renewed_at < LEASE_HEARTBEAT_INTERVAL:
+            return True
         try:
             conn = self.get_db()
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO execution_logs (session_id, log_type, message, created_at)
-                VALUES (%s, %s, %s, NOW())
-            """, (self.current_session_id, log_type, message[:10000]))
+                UPDATE tickets SET lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND),
+                updated_at = updated_at
+                WHERE id = %s AND claimed_by = %s
+            """, (LEASE_SECONDS, ticket_id, self.daemon_ref.owner_id))
+            owned = cursor.rowcount > 0
             conn.commit()
             cursor.close()
             conn.close()
-        except: pass
-    
+            self.lease_renewed_at = time.time()
+            if not owned:
+                self.log(f"Lost lease on ticket {ticket_id}", "WARNING")
+            return owned
+        except Exception as e:
+            # Keep working; the lease is long enough to survive a DB hiccup
+            self.log(f"Lease heartbeat failed: {e}", "WARNING")
+            return True
+
     def get_next_ticket(self):
+        """Next ticket of this project chosen (and claimed) by the global scheduler"""
+        ticket_id = None
         try:
+            ticket_id, self.preempted = self.daemon_ref.scheduler.next_ticket(self)
+            if not ticket_id:
+                return None
             conn = self.get_db()
             cursor = conn.cursor(dictionary=True)
             cursor.execute("""
@@ -315,28 +1150,33 @@ class ProjectWorker(threading.Thread):
                        p.dotnet_port
                 FROM tickets t
                 JOIN projects p ON t.project_id = p.id
-                WHERE t.project_id = %s AND t.status IN ('open', 'new', 'pending')
-                ORDER BY
-                    CASE t.priority
-                        WHEN 'critical' THEN 1 WHEN 'high' THEN 2
-                        WHEN 'medium' THEN 3 WHEN 'low' THEN 4
-                    END,
-                    t.created_at ASC
-                LIMIT 1
-            """, (self.project_id,))
+                WHERE t.id = %s AND t.claimed_by = %s
+            """, (ticket_id, self.daemon_ref.owner_id))
             ticket = cursor.fetchone()
             cursor.close()
             conn.close()
+            if not ticket:
+                self.daemon_ref.release_claim(ticket_id)
+            else:
+                self.lease_renewed_at = time.time()
             return ticket
         except Exception as e:
+            if ticket_id:
+                self.daemon_ref.release_claim(ticket_id)
             self.log(f"Error getting ticket: {e}", "ERROR")
             return None
     
     def get_conversation_history(self, ticket_id):
-        # Use smart history if context manager is available
+        # Make sure queued messages are in the DB before reading them back
+        self.writer.flush()
+
+        # Use smart history if context manager is available. The snapshot also
+        # carries the extraction, so build_prompt doesn't load (or create) it again
+        self.context_snapshot = None
         if self.context_manager:
             try:
-                return self.context_manager.get_smart_history(ticket_id)
+                self.context_snapshot = self.context_manager.load_context_snapshot(ticket_id)
+                return self.context_snapshot.history
             except Exception as e:
                 self.log(f"Smart history failed, falling back to basic: {e}", "WARNING")
 
@@ -375,7 +1215,10 @@ class ProjectWorker(threading.Thread):
         except:
             return []
     
-    def update_ticket(self, ticket_id, status, result=None):
+    def update_ticket(self, ticket_id, status, result=None, merge=True):
+        # Persist/broadcast pending messages before the status change.
+        # merge=False keeps a worktree's branch unmerged (work paused by /stop).
+        self.writer.flush()
         try:
             conn = self.get_db()
             cursor = conn.cursor(dictionary=True)
@@ -431,8 +1274,9 @@ class ProjectWorker(threading.Thread):
                         git_path = project_info.get('web_path') or project_info.get('app_path')
 
                         if git_path and os.path.exists(git_path):
+                            # Parallel tickets commit on their own branch; records stay on the project repo
                             gm = GitManager(
-                                git_path,
+                                self.worktree['path'] if self.worktree else git_path,
                                 project_info.get('project_type', 'web'),
                                 project_info.get('tech_stack', '')
                             )
@@ -498,6 +1342,9 @@ class ProjectWorker(threading.Thread):
                                     self.log(f"Git auto-commit created: {commit_hash[:7]}", "INFO")
                                 elif not success:
                                     self.log(f"Git auto-commit skipped: {msg}", "DEBUG")
+
+                            if self.worktree and merge:
+                                self.merge_worktree(ticket_id)
                 except Exception as e:
                     self.log(f"Git auto-commit error: {e}", "WARNING")
 
@@ -523,22 +1370,87 @@ class ProjectWorker(threading.Thread):
         except Exception as e:
             self.log(f"Error updating ticket: {e}", "ERROR")
 
-    def broadcast_status(self, ticket_id, status):
-        """Broadcast ticket status change to web app"""
+    def enter_worktree(self, ticket):
+        """
+        Give the ticket its own git worktree (branch codehero/<ticket_number>).
+        Returns a copy of the ticket whose project path points at the worktree,
+        or the ticket unchanged if no worktree could be set up.
+        """
+        git_path = self.get_git_path(ticket)
+        if not git_path:
+            return ticket
+
+        branch = f"codehero/{ticket['ticket_number']}"
+        path = os.path.join(WORKTREE_ROOT, ticket.get('project_code') or str(self.project_id),
+                            ticket['ticket_number'])
+        gm = GitManager(git_path)
+        base_branch = gm.get_current_branch()
+        with self.daemon_ref.merge_lock:
+            success, msg, created = gm.add_worktree(path, branch)
+        if not success:
+            self.log(f"Worktree unavailable, using project directory: {msg}", "WARNING")
+            return ticket
+
+        if not created and base_branch:
+            # Resumed ticket: bring in what other tickets merged meanwhile.
+            # Conflicts stay in the worktree for Claude to resolve.
+            ok, merge_msg, conflicts = GitManager(path).merge_branch(base_branch, abort_on_conflict=False)
+            if conflicts:
+                self.save_message('system', f"[GIT] Merging {base_branch} into {branch} left conflicts in: "
+                                            f"{', '.join(conflicts)}. Resolve the conflict markers first.")
+            elif not ok:
+                self.log(f"Could not update {branch} from {base_branch}: {merge_msg}", "WARNING")
+
+        self.worktree = {'path': path, 'branch': branch, 'repo_path': git_path, 'base_branch': base_branch}
+        self.log(f"Working in {path} ({branch})")
+
+        ticket = dict(ticket)
+        path_key = 'web_path' if ticket.get('web_path') == git_path else 'app_path'
+        ticket[path_key] = path
+        return ticket
+
+    def merge_worktree(self, ticket_id):
+        """
+        Merge the ticket branch back into the project repository. On success the
+        worktree and branch are removed; on conflict both are kept and the
+        ticket stays in awaiting_input until the user replies.
+        """
+        wt = self.worktree
+        gm = GitManager(wt['repo_path'])
+        with self.daemon_ref.merge_lock:
+            success, msg, conflicts = gm.merge_branch(wt['branch'])
+            if success:
+                gm.remove_worktree(wt['path'], wt['branch'])
+
+        if success:
+            self.log(f"Merged {wt['branch']} into {wt['base_branch'] or 'HEAD'}")
+            self.worktree = None
+            return True
+
+        detail = f"Conflicting files: {', '.join(conflicts)}" if conflicts else msg
+        self.log(f"Merge of {wt['branch']} failed: {detail}", "WARNING")
+        self.save_message('system', f"[GIT] Could not merge {wt['branch']} into {wt['base_branch'] or 'the project'}. "
+                                    f"{detail}. Reply to this ticket to have the conflicts resolved.")
+        self.writer.flush()
         try:
-            data = json.dumps({
-                'type': 'status',
-                'ticket_id': ticket_id,
-                'status': status
-            }).encode('utf-8')
-            req = urllib.request.Request(
-                f"{WEB_APP_URL}/api/internal/broadcast",
-                data=data,
-                headers={'Content-Type': 'application/json'}
-            )
-            urllib.request.urlopen(req, timeout=2)
+            # Don't auto-close a ticket whose work isn't in the project yet
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE tickets SET review_deadline = NULL WHERE id = %s", (ticket_id,))
+            conn.commit()
+            cursor.close()
+            conn.close()
         except Exception as e:
-            pass  # Silent fail - not critical
+            self.log(f"Error clearing review deadline: {e}", "WARNING")
+        return False
+
+    def broadcast_status(self, ticket_id, status):
+        """Broadcast ticket status change to web app"""
+        self.daemon_ref.broadcaster.send({
+            'type': 'status',
+            'ticket_id': ticket_id,
+            'status': status
+        })
 
     def create_backup(self, ticket_id):
         """Create automatic backup before processing ticket"""
@@ -559,80 +1471,60 @@ class ProjectWorker(threading.Thread):
                 return
 
             project_code = project['code']
-            backup_subdir = os.path.join(BACKUP_DIR, project_code)
-            os.makedirs(backup_subdir, exist_ok=True)
-
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_name = f"{project_code}_{timestamp}_auto.zip"
-            backup_path = os.path.join(backup_subdir, backup_name)
-
-            temp_dir = tempfile.mkdtemp()
-            temp_backup = os.path.join(temp_dir, 'backup')
-            os.makedirs(temp_backup)
-
-            try:
-                # Copy web folder
-                if project.get('web_path') and os.path.exists(project['web_path']):
-                    shutil.copytree(project['web_path'], os.path.join(temp_backup, 'web'), dirs_exist_ok=True)
-
-                # Copy app folder
-                if project.get('app_path') and os.path.exists(project['app_path']):
-                    shutil.copytree(project['app_path'], os.path.join(temp_backup, 'app'), dirs_exist_ok=True)
-
-                # Export database
-                if project.get('db_name') and project.get('db_user') and project.get('db_password'):
-                    db_dir = os.path.join(temp_backup, 'database')
-                    os.makedirs(db_dir, exist_ok=True)
-
-                    db_host = project.get('db_host', 'localhost')
-                    db_name = project['db_name']
-                    db_user = project['db_user']
-                    db_pass = project['db_password']
-
-                    # Schema
-                    schema_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-data {db_name} 2>/dev/null"
-                    result = subprocess.run(schema_cmd, shell=True, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        with open(os.path.join(db_dir, 'schema.sql'), 'w') as f:
-                            f.write(result.stdout)
-
-                    # Data
-                    data_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-create-info {db_name} 2>/dev/null"
-                    result = subprocess.run(data_cmd, shell=True, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        with open(os.path.join(db_dir, 'data.sql'), 'w') as f:
-                            f.write(result.stdout)
-
-                # Create zip
-                with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, dirs, files in os.walk(temp_backup):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arc_name = os.path.relpath(file_path, temp_backup)
-                            zipf.write(file_path, arc_name)
-
-                # Cleanup old backups
-                backups = sorted(
-                    [f for f in os.listdir(backup_subdir) if f.endswith('.zip')],
-                    key=lambda x: os.path.getmtime(os.path.join(backup_subdir, x)),
-                    reverse=True
-                )
-                for old_backup in backups[MAX_BACKUPS:]:
-                    os.remove(os.path.join(backup_subdir, old_backup))
+            store = BackupStore(os.path.join(BACKUP_DIR, project_code))
+            backup_name = snapshot_name(project_code, 'auto')
+
+            # Database dumps are streamed from mysqldump into the store, never held in memory
+            db_files = {}
+            if project.get('db_name') and project.get('db_user') and project.get('db_password'):
+                db_files['database/schema.sql'] = lambda: DumpStream(project, BACKUP_SCHEMA_DUMP)
+                db_files['database/data.sql'] = lambda: DumpStream(project, BACKUP_DATA_DUMP)
+
+            # Snapshot web/app folders: only files changed since the last backup are stored.
+            # A clean git repo is recorded as its HEAD commit plus untracked/ignored files,
+            # and nothing is recorded if that matches the previous backup exactly.
+            # Regenerable paths (node_modules/ etc.) and the project's backup_exclude are left out
+            git = project_git(project, get_git_manager(project)) if GIT_ENABLED else {}
+            path_filter = project_filter(project)
+            summary = store.snapshot(
+                backup_name,
+                {'web': project.get('web_path'), 'app': project.get('app_path')},
+                files=db_files,
+                info={
+                    'project_id': project['id'],
+                    'project_code': project_code,
+                    'project_name': project['name'],
+                    'trigger': 'auto',
+                    'ticket_id': ticket_id,
+                    'web_path': project.get('web_path'),
+                    'app_path': project.get('app_path'),
+                    'db_name': project.get('db_name')
+                },
+                git=git,
+                skip_unchanged=True,
+                filters={'web': path_filter, 'app': path_filter})
+
+            if summary.get('skipped'):
+                self.log(f"Backup skipped: nothing changed since {summary['name']}")
+                self.save_log('info', f"Auto-backup skipped: nothing changed since {summary['name']}")
+                return
 
-                self.log(f"Backup created: {backup_name}")
-                self.save_log('info', f'Auto-backup created: {backup_name}')
+            store.prune(MAX_BACKUPS, git=git)
 
-                # Notify user in UI
-                self.broadcast_message({
-                    'role': 'system',
-                    'content': f'📦 Backup created: {backup_name}',
-                    'created_at': datetime.now().isoformat(),
-                    'ticket_id': ticket_id
-                })
+            detail = f"{summary['new_files']} of {summary['files']} files changed"
+            if summary['git']:
+                commits = ', '.join(c[:7] for c in summary['git'].values())
+                detail = f"git checkpoint {commits} + {summary['new_files']} untracked files changed"
+            self.log(f"Backup created: {backup_name} ({detail})")
+            self.save_log('info', f'Auto-backup created: {backup_name} ({detail})')
 
-            finally:
-                shutil.rmtree(temp_dir, ignore_errors=True)
+            # Notify user in UI
+            self.broadcast_message({
+                'role': 'system',
+                'content': f'📦 Backup created: {backup_name}',
+                'created_at': datetime.now().isoformat(),
+                'ticket_id': ticket_id
+            })
 
         except Exception as e:
             self.log(f"Backup error: {e}", "WARNING")
@@ -757,6 +1649,8 @@ class ProjectWorker(threading.Thread):
             pass  # Don't log errors for real-time updates to avoid spam
 
     def end_session(self, session_id, status, tokens=0):
+        self.writer.flush()
+
         # Save usage stats before ending session
         self.save_usage_stats()
 
@@ -776,6 +1670,77 @@ class ProjectWorker(threading.Thread):
             self.log(f"Error ending session: {e}", "ERROR")
     
     def build_prompt(self, ticket, history):
+        """Cached static prefix + freshly built tail (extraction, git changes, history)"""
+        cache = self.daemon_ref.prompt_cache
+        key = (ticket.get('project_id'), ticket['id'])
+        fingerprint = self.prompt_fingerprint(ticket)
+        system = cache.get(key, fingerprint)
+        if system is None:
+            system = self.build_static_prompt(ticket)
+            # Building may have (re)generated the project map - store under the new version
+            cache.put(key, self.prompt_fingerprint(ticket), system)
+        else:
+            self.log(f"Reusing cached prompt prefix for {ticket['ticket_number']}", "DEBUG")
+
+        prompt_parts = [system]
+
+        # Conversation extraction, from the snapshot loaded with the history
+        snapshot = self.context_snapshot
+        if snapshot and snapshot.ticket_id == ticket['id'] and snapshot.extraction_context:
+            prompt_parts.append(snapshot.extraction_context)
+
+        # Uncommitted changes (committed history is part of the cached prefix)
+        git_path = self.get_git_path(ticket)
+        if git_path:
+            try:
+                changes = GitManager(git_path).get_changes_context()
+                if changes:
+                    prompt_parts.append(f"\n=== GIT WORKING TREE ===\n{changes}\n==========================")
+            except Exception as e:
+                self.log(f"Error getting Git changes: {e}", "DEBUG")
+
+        prompt_parts.append("\n--- Conversation History ---\n")
+
+        for msg in history:
+            if msg['role'] == 'user':
+                prompt_parts.append(f"\nUser: {msg['content']}")
+            elif msg['role'] == 'assistant':
+                prompt_parts.append(f"\nAssistant: {msg['content']}")
+            elif msg['role'] == 'tool_use':
+                prompt_parts.append(f"\n[Used tool: {msg['tool_name']}]")
+            elif msg['role'] == 'tool_result':
+                result = msg['content'] or ''
+                prompt_parts.append(f"\n[Result: {result[:200]}...]" if len(result) > 200 else f"\n[Result: {result}]")
+
+        prompt_parts.append("\n\nContinue working on this task:")
+        return '\n'.join(prompt_parts)
+
+    def get_git_path(self, ticket):
+        """Project repository path, or None if Git is unavailable/not initialized"""
+        if not GIT_ENABLED:
+            return None
+        git_path = ticket.get('web_path') or ticket.get('app_path')
+        # .git is a file inside worktrees
+        if git_path and os.path.exists(os.path.join(git_path, '.git')):
+            return git_path
+        return None
+
+    def prompt_fingerprint(self, ticket):
+        """Everything the static prompt prefix depends on"""
+        fields = ('project_name', 'web_path', 'app_path', 'tech_stack', 'project_type',
+                  'db_host', 'db_name', 'db_user', 'db_password', 'project_context',
+                  'ticket_context', 'ticket_number', 'title', 'description')
+        ticket_hash = hashlib.sha1(
+            json.dumps([ticket.get(f) for f in fields], default=str).encode('utf-8')
+        ).hexdigest()
+        context_version = None
+        if self.context_manager:
+            context_version = self.context_manager.get_context_version(ticket.get('project_id'))
+        git_path = self.get_git_path(ticket)
+        git_head = GitManager(git_path).get_head_ref() if git_path else None
+        return (ticket_hash, hash(self.global_context), context_version, git_head)
+
+    def build_static_prompt(self, ticket):
         # Determine working paths
         paths_info = []
         if ticket.get('web_path'):
@@ -800,13 +1765,11 @@ class ProjectWorker(threading.Thread):
 ==========================
 """
 
-        # Smart context from context manager (user prefs, project map, knowledge, extraction)
+        # Smart context from context manager (user prefs, project map, knowledge)
         smart_context_str = ""
         if self.context_manager:
             try:
-                smart_ctx = self.context_manager.build_full_context(ticket)
-                if smart_ctx.get('system_context'):
-                    smart_context_str = smart_ctx['system_context']
+                smart_context_str = self.context_manager.build_static_context(ticket)
             except Exception as e:
                 self.log(f"Error building smart context: {e}", "WARNING")
 
@@ -852,7 +1815,7 @@ Password: {ticket['db_password']}
                         ticket.get('tech_stack', '')
                     )
                     if gm.is_initialized():
-                        git_info = gm.get_context_for_claude(max_commits=5)
+                        git_info = gm.get_context_for_claude(max_commits=5, include_changes=False)
                         if git_info:
                             git_context = f"""
 === GIT VERSION CONTROL ===
@@ -880,23 +1843,8 @@ Description:
 {ticket['description']}
 
 Complete this task. When finished, say "TASK COMPLETED" with a summary."""
+        return system
 
-        prompt_parts = [system, "\n--- Conversation History ---\n"]
-
-        for msg in history:
-            if msg['role'] == 'user':
-                prompt_parts.append(f"\nUser: {msg['content']}")
-            elif msg['role'] == 'assistant':
-                prompt_parts.append(f"\nAssistant: {msg['content']}")
-            elif msg['role'] == 'tool_use':
-                prompt_parts.append(f"\n[Used tool: {msg['tool_name']}]")
-            elif msg['role'] == 'tool_result':
-                result = msg['content'] or ''
-                prompt_parts.append(f"\n[Result: {result[:200]}...]" if len(result) > 200 else f"\n[Result: {result}]")
-
-        prompt_parts.append("\n\nContinue working on this task:")
-        return '\n'.join(prompt_parts)
-    
     def parse_claude_output(self, line):
         try:
             data = json.loads(line)
@@ -909,6 +1857,9 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
 
                 # Accumulate incremental token counts for real-time tracking
                 if usage:
+                    if self.daemon_ref.concurrency:
+                        self.daemon_ref.concurrency.record_tokens(
+                            usage.get('input_tokens', 0) + usage.get('output_tokens', 0))
                     self.session_input_tokens += usage.get('input_tokens', 0)
                     self.session_output_tokens += usage.get('output_tokens', 0)
                     self.session_cache_read_tokens += usage.get('cache_read_input_tokens', 0)
@@ -948,10 +1899,16 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
                 result = data.get('result', '')
                 if isinstance(result, dict):
                     result = json.dumps(result)
+                if data.get('is_error') and is_rate_limit_error(str(result)) and self.daemon_ref.concurrency:
+                    self.daemon_ref.concurrency.record_rate_limit(str(result))
                 self.save_message('tool_result', str(result)[:5000])
 
             elif msg_type == 'error':
-                error = data.get('error', {}).get('message', 'Unknown error')
+                error_info = data.get('error', {})
+                error = error_info.get('message', 'Unknown error')
+                if self.daemon_ref.concurrency and (
+                        is_rate_limit_error(error) or is_rate_limit_error(str(error_info.get('type', '')))):
+                    self.daemon_ref.concurrency.record_rate_limit(error)
                 self.save_message('system', f"Error: {error}")
                 self.save_log('error', error)
 
@@ -1019,9 +1976,16 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
             )
             
             result = None
+            check_commands = True
+            last_command_check = 0
             while True:
-                # Check for user commands (non-blocking)
-                new_msgs = self.get_pending_user_messages(ticket['id'])
+                # Check for user commands only when woken (or on the slow fallback poll)
+                if check_commands or time.time() - last_command_check >= USER_COMMAND_POLL_INTERVAL:
+                    check_commands = False
+                    last_command_check = time.time()
+                    new_msgs = self.get_pending_user_messages(ticket['id'])
+                else:
+                    new_msgs = []
                 for msg in new_msgs:
                     content = msg['content'].strip()
                     if content == '/skip':
@@ -1044,10 +2008,18 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
                     process.terminate()
                     return 'stopped'
 
+                if not self.renew_lease(ticket['id']):
+                    process.terminate()
+                    return 'lease_lost'
+
                 # Use select with timeout to avoid blocking
-                ready, _, _ = select.select([process.stdout], [], [], 1.0)
+                ready, _, _ = select.select([process.stdout, self.wake_r], [], [], 1.0)
+
+                if self.wake_r in ready:
+                    self.drain_wake()
+                    check_commands = True
 
-                if ready:
+                if process.stdout in ready:
                     line = process.stdout.readline()
                     if not line and process.poll() is not None:
                         break
@@ -1078,6 +2050,7 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
     
     def process_ticket(self, ticket):
         self.current_ticket_id = ticket['id']
+        self.current_ticket_number = ticket['ticket_number']
         self.current_session_id = self.create_session(ticket['id'])
         self.last_activity = datetime.now()
 
@@ -1086,6 +2059,9 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
         # Create automatic backup before starting
         self.create_backup(ticket['id'])
 
+        if self.use_worktrees:
+            ticket = self.enter_worktree(ticket)
+
         self.update_ticket(ticket['id'], 'in_progress')
         self.save_log('info', f"Starting: {ticket['ticket_number']}")
 
@@ -1098,7 +2074,8 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
         # Loop to handle interruptions and pending messages
         while True:
             prompt = self.build_prompt(ticket, history)
-            result = self.run_claude(ticket, prompt)
+            # Backup and prompt building can take a while - renew before starting Claude
+            result = self.run_claude(ticket, prompt) if self.renew_lease(ticket['id'], force=True) else 'lease_lost'
 
             if result == 'interrupted':
                 # User sent /stop - check for new instructions
@@ -1115,8 +2092,9 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
                     self.log(f"Continuing with user feedback...")
                     continue
                 else:
-                    # No messages yet, wait for user to add instructions
-                    self.update_ticket(ticket['id'], 'awaiting_input')
+                    # No messages yet, wait for user to add instructions.
+                    # The work is unfinished: commit it on the ticket branch, don't merge it
+                    self.update_ticket(ticket['id'], 'awaiting_input', merge=False)
                     self.end_session(self.current_session_id, 'stopped')
                     self.log(f"⏸️ Stopped: {ticket['ticket_number']} - waiting for user input")
                     break
@@ -1137,12 +2115,14 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
 
                 self.update_ticket(ticket['id'], 'done', 'Completed successfully')
                 self.end_session(self.current_session_id, 'completed')
+                self.daemon_ref.prompt_cache.invalidate(ticket_id=ticket['id'])
                 self.log(f"✅ Completed: {ticket['ticket_number']}")
                 break
 
             elif result == 'skipped':
                 self.update_ticket(ticket['id'], 'skipped')
                 self.end_session(self.current_session_id, 'skipped')
+                self.daemon_ref.prompt_cache.invalidate(ticket_id=ticket['id'])
                 self.log(f"⏭️ Skipped: {ticket['ticket_number']}")
                 break
 
@@ -1156,6 +2136,12 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
                 self.end_session(self.current_session_id, 'stopped')
                 break
 
+            elif result == 'lease_lost':
+                # Another daemon recovered the ticket - leave its status alone
+                self.end_session(self.current_session_id, 'stopped')
+                self.log(f"Lease lost: {ticket['ticket_number']} - stopped", "WARNING")
+                break
+
             elif result == 'success':
                 # Claude finished without explicit TASK COMPLETED - waiting for user
                 pending = self.get_pending_user_messages(ticket['id'])
@@ -1181,27 +2167,44 @@ Complete this task. When finished, say "TASK COMPLETED" with a summary."""
                 break
 
         self.current_ticket_id = None
+        self.current_ticket_number = None
         self.current_session_id = None
+        self.context_snapshot = None
+        # Unmerged worktrees (skipped, failed, conflicts) are kept for the next run
+        self.worktree = None
     
     def run(self):
         self.log(f"Worker started")
-        
+        self.writer.start()
+
         while self.running and self.daemon_ref.running:
+            ticket = None
             try:
                 ticket = self.get_next_ticket()
-                if ticket:
-                    self.process_ticket(ticket)
-                else:
-                    time.sleep(POLL_INTERVAL)
-                    ticket = self.get_next_ticket()
-                    if not ticket:
+                if not ticket:
+                    if self.preempted:
+                        self.log("Yielding to higher-ranked tickets, worker stopping")
+                    else:
                         self.log("No more tickets, worker stopping")
-                        break
+                    break
+                self.process_ticket(ticket)
             except Exception as e:
                 self.log(f"Error: {e}", "ERROR")
                 time.sleep(POLL_INTERVAL)
-        
+            finally:
+                if ticket:
+                    self.daemon_ref.release_claim(ticket['id'])
+
+        self.writer.stop()
+        self.writer.join(timeout=5)
+        for fd in (self.wake_r, self.wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
         self.log(f"Worker stopped")
+        # Our slot is free - let the scheduler hand it out now
+        self.daemon_ref.wake_scheduler()
     
     def stop(self):
         self.running = False
@@ -1368,9 +2371,9 @@ Your response:"""
             # Add system message explaining why
             stuck_message = f"[WATCHDOG] Ticket marked as stuck: {reason}\n\nThe AI appears to be in an unproductive loop. Human intervention may be required."
             cursor.execute("""
-                INSERT INTO conversation_messages (ticket_id, role, content, created_at)
-                VALUES (%s, 'system', %s, NOW())
-            """, (ticket['id'], stuck_message))
+                INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
+                VALUES (%s, 'system', %s, %s, NOW())
+            """, (ticket['id'], stuck_message, count_tokens(stuck_message)))
 
             # Stop any running sessions for this ticket
             cursor.execute("""
@@ -1398,20 +2401,11 @@ Your response:"""
                    ticket.get('project_name'), ticket.get('ticket_number'))
 
             # Broadcast to web UI
-            try:
-                data = json.dumps({
-                    'type': 'ticket_stuck',
-                    'ticket_id': ticket['id'],
-                    'reason': reason
-                }).encode('utf-8')
-                req = urllib.request.Request(
-                    f"{WEB_APP_URL}/api/internal/broadcast",
-                    data=data,
-                    headers={'Content-Type': 'application/json'}
-                )
-                urllib.request.urlopen(req, timeout=2)
-            except:
-                pass
+            self.daemon_ref.broadcaster.send({
+                'type': 'ticket_stuck',
+                'ticket_id': ticket['id'],
+                'reason': reason
+            })
 
         except Exception as e:
             self.log(f"Error marking ticket stuck: {e}", "ERROR")
@@ -1451,6 +2445,66 @@ class TelegramPoller(threading.Thread):
         self.running = False
 
 
+class CommandListener(threading.Thread):
+    """Background thread receiving wake-up notifications from the web app,
+    the MCP server and the CLI.
+
+    Datagrams are JSON like {"ticket_id": 12}, or {"project_id": 3} when only
+    the ready queue changed. The tickets/user_messages rows stay the source of
+    truth; the notification only tells the worker running the ticket to look
+    now and the scheduler to re-read the ready queue.
+    """
+
+    def __init__(self, daemon):
+        super().__init__(daemon=True)
+        self.daemon_ref = daemon
+        self.running = True
+        self.sock = None
+
+    def log(self, message, level="INFO"):
+        self.daemon_ref.log(f"[CommandListener] {message}", level)
+
+    def run(self):
+        try:
+            os.makedirs(os.path.dirname(COMMAND_SOCKET), exist_ok=True)
+            if os.path.exists(COMMAND_SOCKET):
+                os.remove(COMMAND_SOCKET)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(COMMAND_SOCKET)
+            os.chmod(COMMAND_SOCKET, 0o660)
+            self.sock.settimeout(1.0)
+        except Exception as e:
+            self.log(f"Could not open {COMMAND_SOCKET}: {e} - falling back to DB polling", "WARNING")
+            return
+
+        self.log(f"Listening for user commands on {COMMAND_SOCKET}")
+        while self.running:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                self.log(f"Error: {e}", "ERROR")
+                time.sleep(1)
+                continue
+            try:
+                ticket_id = int(json.loads(data.decode('utf-8')).get('ticket_id') or 0)
+            except Exception:
+                continue
+            if ticket_id:
+                self.daemon_ref.notify_ticket(ticket_id)
+            self.daemon_ref.wake_scheduler()
+
+        try:
+            self.sock.close()
+            os.remove(COMMAND_SOCKET)
+        except OSError:
+            pass
+
+    def stop(self):
+        self.running = False
+
+
 class ClaudeDaemon:
     """Main daemon - manages project workers"""
 
@@ -1458,9 +2512,27 @@ class ClaudeDaemon:
         self.running = True
         self.config = self.load_config()
         self.db_pool = self.create_db_pool()
-        self.workers = {}
+        self.workers = {}  # (project_id, lane) -> ProjectWorker
         self.workers_lock = threading.Lock()
+        # Set when the ready queue may have changed; the main loop waits on it
+        self.queue_event = threading.Event()
+        # Cluster node (NODE_ID defaults to the hostname) and lease owner id (tickets.claimed_by)
+        self.node_id = self.config.get('NODE_ID') or socket.gethostname()
+        self.owner_id = f"{self.node_id}:{os.getpid()}"
+        self.nodes = NodeRegistry(self, self.node_id)
+        # Serializes worktree creation and merges into project repositories
+        self.merge_lock = threading.Lock()
         self.max_parallel = int(self.config.get('MAX_PARALLEL_PROJECTS', MAX_PARALLEL_PROJECTS))
+        # Adaptive concurrency moves max_parallel between PARALLEL_FLOOR and PARALLEL_CEILING
+        self.concurrency = None
+        if self.config.get('ADAPTIVE_CONCURRENCY', 'yes').lower() == 'yes':
+            ceiling = int(self.config.get('PARALLEL_CEILING') or default_parallel_ceiling(self.max_parallel))
+            if ceiling <= self.max_parallel:
+                self.log(f"PARALLEL_CEILING={ceiling} is not above MAX_PARALLEL_PROJECTS={self.max_parallel}: "
+                         f"adaptive concurrency can only lower the worker count", "WARNING")
+            self.concurrency = ConcurrencyController(
+                self, int(self.config.get('PARALLEL_FLOOR') or 1), ceiling)
+        configure_tokenizer(self.config.get('TOKENIZER', 'approx'))
 
         # Load Telegram notification settings
         global TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, NOTIFY_SETTINGS
@@ -1487,6 +2559,40 @@ class ClaudeDaemon:
         self.watchdog = None
         # Initialize Telegram Poller (will be started in run())
         self.telegram_poller = None
+        # Initialize user command listener (will be started in run())
+        self.command_listener = None
+        # Project folder change watcher (started in run() when PROJECT_WATCHER=yes)
+        self.watcher = None
+        # Shared daemon -> web event stream (started in run(), events queue up before that)
+        self.broadcaster = BroadcastChannel(self)
+        # Static prompt prefixes reused across ProjectWorker restarts
+        self.prompt_cache = PromptCache()
+        # Decides which tickets get a worker
+        self.scheduler = TicketScheduler(self)
+        self.last_stats_write = 0
+
+    def load_watched_projects(self):
+        """Active projects owned by this node (for the project watcher)"""
+        conn = self.get_db()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, web_path, app_path, project_type, tech_stack
+            FROM projects WHERE status = 'active'
+        """)
+        projects = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return [p for p in projects if self.nodes.owns(p['id'])]
+
+    def on_project_change(self, event):
+        """Project watcher event. File index and git status are refreshed by the
+        watcher itself; a new map changes the prompt cache fingerprint."""
+        if event['type'] != 'change' or not self.context_manager:
+            return
+        if event['structural']:
+            self.context_manager.invalidate_project_map(event['project_id'])
+        else:
+            self.context_manager.refresh_code_index(event['project_id'], event['root'], event['paths'])
 
     def load_global_context(self):
         """Load global context that applies to all projects"""
@@ -1576,10 +2682,11 @@ class ClaudeDaemon:
                         continue
 
                     # Normal flow - add message to conversation
+                    telegram_msg = f"[Via Telegram from {from_user}]\n{message}"
                     cursor.execute("""
-                        INSERT INTO conversation_messages (ticket_id, role, content, created_at)
-                        VALUES (%s, 'user', %s, NOW())
-                    """, (ticket['id'], f"[Via Telegram from {from_user}]\n{message}"))
+                        INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
+                        VALUES (%s, 'user', %s, %s, NOW())
+                    """, (ticket['id'], telegram_msg, count_tokens(telegram_msg)))
 
                     # If ticket is awaiting_input, reopen it
                     if ticket['status'] == 'awaiting_input':
@@ -1588,6 +2695,7 @@ class ClaudeDaemon:
                             WHERE id = %s
                         """, (ticket['id'],))
                         self.log(f"Telegram reply reopened ticket {ticket_number}")
+                        self.wake_scheduler()
 
                         # Send confirmation
                         send_telegram(f"✅ Message received for {ticket_number}\nTicket reopened - Claude will continue.")
@@ -1726,71 +2834,200 @@ Answer briefly:"""
         except Exception as e:
             self.log(f"Email error: {e}", "ERROR")
     
-    def get_projects_with_open_tickets(self):
+    def claim_ticket(self, candidate_ids, lanes=None):
+        """
+        Atomically claim the first claimable ticket among the candidates: it
+        becomes in_progress, owned by this process, with a fresh lease.
+        Rows locked by another daemon's claim are skipped, not waited for.
+
+        lanes maps a candidate id to its project's lane limit (default 1). A
+        candidate is skipped while that many tickets of its project hold a
+        valid lease, whichever daemon owns them: after the ring moves a
+        project, the old owner may still be mid-ticket in the same folder.
+
+        Returns:
+            The claimed ticket id, or None
+        """
+        conn = self.get_db()
+        cursor = conn.cursor()
+        try:
+            for ticket_id in candidate_ids:
+                conn.start_transaction()
+                # Project row lock serializes claims of the same project across daemons
+                cursor.execute("""
+                    SELECT p.id FROM projects p JOIN tickets t ON t.project_id = p.id
+                    WHERE t.id = %s FOR UPDATE OF p
+                """, (ticket_id,))
+                project = cursor.fetchone()
+                cursor.execute("""
+                    SELECT id FROM tickets
+                    WHERE id = %s AND status IN ('open', 'new', 'pending')
+                    AND (claimed_by IS NULL OR lease_expires_at IS NULL OR lease_expires_at < NOW())
+                    FOR UPDATE SKIP LOCKED
+                """, (ticket_id,))
+                claimable = cursor.fetchone()
+                if claimable and project:
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM tickets
+                        WHERE project_id = %s AND status = 'in_progress' AND id != %s
+                        AND lease_expires_at > NOW()
+                    """, (project[0], ticket_id))
+                    if cursor.fetchone()[0] >= (lanes or {}).get(ticket_id, 1):
+                        claimable = None
+                if claimable:
+                    cursor.execute("""
+                        UPDATE tickets SET status = 'in_progress', claimed_by = %s,
+                        lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND), updated_at = NOW()
+                        WHERE id = %s
+                    """, (self.owner_id, LEASE_SECONDS, ticket_id))
+                    conn.commit()
+                    return ticket_id
+                conn.rollback()
+            return None
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def release_claim(self, ticket_id):
+        """Give up our lease; a ticket still in_progress (worker error) goes back to open"""
+        self.scheduler.release(ticket_id)
         try:
             conn = self.get_db()
-            cursor = conn.cursor(dictionary=True)
+            cursor = conn.cursor()
             cursor.execute("""
-                SELECT DISTINCT p.id, p.name, p.code, COALESCE(p.web_path, p.app_path) as work_path,
-                       (SELECT COUNT(*) FROM tickets WHERE project_id = p.id AND status IN ('open', 'new', 'pending')) as open_count
-                FROM projects p
-                JOIN tickets t ON t.project_id = p.id
-                WHERE t.status IN ('open', 'new', 'pending')
-                AND p.status = 'active'
-                ORDER BY 
-                    (SELECT MIN(CASE priority WHEN 'critical' THEN 1 WHEN 'high' THEN 2 WHEN 'medium' THEN 3 ELSE 4 END) 
-                     FROM tickets WHERE project_id = p.id AND status IN ('open', 'new', 'pending')) ASC
-            """)
-            projects = cursor.fetchall()
+                UPDATE tickets
+                SET updated_at = IF(status = 'in_progress', NOW(), updated_at),
+                    status = IF(status = 'in_progress', 'open', status),
+                    claimed_by = NULL, lease_expires_at = NULL
+                WHERE id = %s AND claimed_by = %s
+            """, (ticket_id, self.owner_id))
+            released = cursor.rowcount > 0
+            conn.commit()
             cursor.close()
             conn.close()
-            return projects
+            if released:
+                self.wake_scheduler()  # It may have been reopened meanwhile
         except Exception as e:
-            self.log(f"Error getting projects: {e}", "ERROR")
-            return []
-    
+            self.log(f"Error releasing ticket {ticket_id}: {e}", "WARNING")
+
+    def reclaim_expired_leases(self, cursor, dead_owners=()):
+        """Put in_progress tickets whose lease expired (or whose owner is dead) back to open.
+        Returns the number of tickets reset; the caller commits."""
+        owner_clause = ""
+        if dead_owners:
+            owner_clause = f"OR claimed_by IN ({','.join(['%s'] * len(dead_owners))})"
+        cursor.execute(f"""
+            SELECT id, ticket_number, claimed_by FROM tickets
+            WHERE status = 'in_progress'
+            AND (lease_expires_at IS NULL OR lease_expires_at < NOW() {owner_clause})
+            FOR UPDATE SKIP LOCKED
+        """, list(dead_owners))
+        expired = cursor.fetchall()
+        if not expired:
+            return 0
+
+        ids = [t[0] for t in expired]
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            UPDATE tickets SET status = 'open', claimed_by = NULL, lease_expires_at = NULL, updated_at = NOW()
+            WHERE id IN ({placeholders})
+        """, ids)
+        # Their sessions will never be ended by the lost worker
+        cursor.execute(f"""
+            UPDATE execution_sessions SET status = 'stuck', ended_at = NOW()
+            WHERE status = 'running' AND ticket_id IN ({placeholders})
+        """, ids)
+        for ticket_id, ticket_number, owner in expired:
+            self.log(f"Reclaimed ticket {ticket_number} (lease of {owner or 'unknown owner'} expired)")
+        return len(ids)
+
+    def wake_scheduler(self):
+        """Make the main loop dispatch now instead of at its next timer"""
+        self.queue_event.set()
+
+    def request_stop(self):
+        self.running = False
+        self.queue_event.set()
+
+    def notify_ticket(self, ticket_id):
+        """Wake the worker currently running this ticket, if any"""
+        with self.workers_lock:
+            for worker in self.workers.values():
+                if worker.current_ticket_id == ticket_id:
+                    worker.wake()
+
+    def get_ticket_lanes(self, project):
+        """How many tickets of the project may run at once (worktrees need a Git repo)"""
+        lanes = max(1, min(int(project.get('parallel_tickets') or 1), MAX_PARALLEL_TICKETS))
+        if lanes > 1 and not (GIT_ENABLED and project.get('work_path')
+                              and os.path.exists(os.path.join(project['work_path'], '.git'))):
+            return 1
+        return lanes
+
+    def write_scheduler_stats(self):
+        """Publish queue depth and wait-time metrics to daemon_status (throttled)"""
+        if time.time() - self.last_stats_write < SCHEDULER_STATS_INTERVAL:
+            return
+        self.last_stats_write = time.time()
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE daemon_status SET scheduler_stats = %s, last_heartbeat = NOW() WHERE id = 1",
+                           (json.dumps(self.scheduler.stats()),))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.log(f"Error writing scheduler stats: {e}", "DEBUG")
+
+    def start_worker(self, ticket):
+        """Start a worker on a free lane of the ticket's project (call under workers_lock)"""
+        lanes = self.get_ticket_lanes(ticket)
+        for lane in range(lanes):
+            key = (ticket['project_id'], lane)
+            if key in self.workers and self.workers[key].is_alive():
+                continue
+            worker = ProjectWorker(
+                self,
+                ticket['project_id'],
+                ticket['project_name'],
+                ticket['work_path'],
+                self.global_context,
+                self.context_manager,  # Pass Smart Context Manager
+                lane=lane,
+                use_worktrees=lanes > 1
+            )
+            worker.start()
+            self.workers[key] = worker
+            self.log(f"Started worker for {ticket['project_name']} ({ticket['priority']} ticket waiting {ticket['waited']}s)"
+                     + (f", lane {lane + 1}/{lanes}" if lanes > 1 else ""))
+            return worker
+        return None
+
     def cleanup_dead_workers(self):
         with self.workers_lock:
-            dead = [pid for pid, w in self.workers.items() if not w.is_alive()]
-            for pid in dead:
-                del self.workers[pid]
+            dead = [key for key, w in self.workers.items() if not w.is_alive()]
+            for key in dead:
+                del self.workers[key]
 
         # Also reset orphaned in_progress tickets (no active worker)
         self.reset_orphaned_tickets()
 
     def reset_orphaned_tickets(self):
-        """Reset in_progress tickets that have no active worker"""
+        """Reset in_progress tickets whose lease expired (owner crashed or hung)"""
         try:
             conn = self.get_db()
-            cursor = conn.cursor(dictionary=True)
-
-            # Get all in_progress tickets
-            cursor.execute("""
-                SELECT t.id, t.ticket_number, t.project_id
-                FROM tickets t
-                WHERE t.status = 'in_progress'
-            """)
-            in_progress = cursor.fetchall()
-
-            # Check which ones have no active worker
-            with self.workers_lock:
-                active_project_ids = set(self.workers.keys())
-
-            orphaned = [t for t in in_progress if t['project_id'] not in active_project_ids]
-
-            if orphaned:
-                orphan_ids = [t['id'] for t in orphaned]
-                cursor.execute(f"""
-                    UPDATE tickets
-                    SET status = 'open', updated_at = NOW()
-                    WHERE id IN ({','.join(['%s']*len(orphan_ids))})
-                """, orphan_ids)
-                conn.commit()
-                for t in orphaned:
-                    self.log(f"Reset orphaned ticket {t['ticket_number']} to open")
-
+            cursor = conn.cursor()
+            conn.start_transaction()
+            reset = self.reclaim_expired_leases(cursor)
+            conn.commit()
             cursor.close()
             conn.close()
+            if reset:
+                self.wake_scheduler()
         except Exception as e:
             self.log(f"Error resetting orphaned tickets: {e}", "ERROR")
 
@@ -1820,8 +3057,31 @@ Answer briefly:"""
         except Exception as e:
             self.log(f"Error auto-closing tickets: {e}", "ERROR")
 
+    def get_dead_local_owners(self, cursor):
+        """Lease owners of this node whose daemon process no longer exists"""
+        cursor.execute("""
+            SELECT DISTINCT claimed_by FROM tickets
+            WHERE status = 'in_progress' AND claimed_by LIKE %s
+        """, (f"{self.node_id}:%",))
+        dead = []
+        for (owner,) in cursor.fetchall():
+            try:
+                pid = int(owner.rsplit(':', 1)[1])
+            except (ValueError, IndexError):
+                continue
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead.append(owner)
+            except PermissionError:
+                pass  # Alive, owned by another user
+        return dead
+
     def recover_orphaned_tickets(self):
-        """Reset tickets that were left in_progress from a previous daemon run (e.g., after reboot)"""
+        """Reset tickets left in_progress by a previous run on this host (e.g., after reboot)
+        and any whose lease expired. Tickets leased by other live daemons are left alone."""
         self.log("Checking for orphaned tickets from previous run...")
 
         # Retry up to 5 times in case MySQL isn't ready yet
@@ -1830,13 +3090,8 @@ Answer briefly:"""
                 conn = self.get_db()
                 cursor = conn.cursor()
 
-                # Reset in_progress tickets back to open
-                cursor.execute("""
-                    UPDATE tickets
-                    SET status='open', updated_at=NOW()
-                    WHERE status='in_progress'
-                """)
-                reset_tickets = cursor.rowcount
+                conn.start_transaction()
+                reset_tickets = self.reclaim_expired_leases(cursor, self.get_dead_local_owners(cursor))
 
                 # Also reset failed tickets back to open (from interrupted runs)
                 cursor.execute("""
@@ -1847,20 +3102,12 @@ Answer briefly:"""
                 """)
                 reset_failed = cursor.rowcount
 
-                # Mark orphaned running sessions as stuck
-                cursor.execute("""
-                    UPDATE execution_sessions
-                    SET status='stuck', ended_at=NOW()
-                    WHERE status='running'
-                """)
-                stuck_sessions = cursor.rowcount
-
                 conn.commit()
                 cursor.close()
                 conn.close()
 
-                if reset_tickets > 0 or reset_failed > 0 or stuck_sessions > 0:
-                    self.log(f"Startup recovery: reset {reset_tickets} in_progress, {reset_failed} recently failed ticket(s), marked {stuck_sessions} session(s) as stuck")
+                if reset_tickets > 0 or reset_failed > 0:
+                    self.log(f"Startup recovery: reset {reset_tickets} in_progress, {reset_failed} recently failed ticket(s)")
                 else:
                     self.log("Startup recovery: no orphaned tickets found")
                 return
@@ -1874,7 +3121,8 @@ Answer briefly:"""
 
     def run(self):
         self.log(f"Claude Daemon v3 started (user: {os.getenv('USER', 'unknown')})")
-        self.log(f"Max parallel projects: {self.max_parallel}")
+        self.log(f"Max parallel projects: {self.max_parallel}"
+                 + (f" (adaptive {self.concurrency.floor}-{self.concurrency.ceiling})" if self.concurrency else ""))
         
         os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
         with open(PID_FILE, 'w') as f:
@@ -1888,6 +3136,12 @@ Answer briefly:"""
             cursor.close()
             conn.close()
         except: pass
+        if self.concurrency:
+            self.concurrency.save()
+
+        # Join the cluster before scheduling so we only take our share of projects
+        self.nodes.heartbeat(force=True)
+        self.log(f"Node {self.node_id} ({len(self.nodes.nodes)} live node(s))")
 
         # Recover any orphaned tickets from previous run
         self.recover_orphaned_tickets()
@@ -1901,35 +3155,47 @@ Answer briefly:"""
         self.telegram_poller = TelegramPoller(self)
         self.telegram_poller.start()
 
+        # Start user command listener thread
+        self.command_listener = CommandListener(self)
+        self.command_listener.start()
+
+        # Start broadcast channel to the web app
+        self.broadcaster.start()
+
+        # Start project change watcher: keeps file index, project maps and git status current
+        if self.config.get('PROJECT_WATCHER', 'yes').lower() == 'yes':
+            self.watcher = ProjectWatcher(self.load_watched_projects, self.log)
+            self.watcher.subscribe(self.on_project_change)
+            if self.context_manager:
+                self.context_manager.watcher = self.watcher
+            self.watcher.start()
+
+        next_cleanup = next_review_check = 0
         while self.running:
             try:
-                self.cleanup_dead_workers()
-                self.auto_close_expired_reviews()
-                projects = self.get_projects_with_open_tickets()
-                
-                with self.workers_lock:
-                    active_count = len([w for w in self.workers.values() if w.is_alive()])
-                
-                for project in projects:
-                    if active_count >= self.max_parallel:
-                        break
-                    
+                now = time.time()
+                if now >= next_cleanup:
+                    self.cleanup_dead_workers()
+                    next_cleanup = now + WORKER_CLEANUP_INTERVAL
+                if now >= next_review_check:
+                    self.auto_close_expired_reviews()
+                    next_review_check = now + REVIEW_CHECK_INTERVAL
+
+                self.nodes.heartbeat()
+                self.queue_event.clear()
+                for ticket in self.scheduler.plan():
                     with self.workers_lock:
-                        if project['id'] not in self.workers or not self.workers[project['id']].is_alive():
-                            worker = ProjectWorker(
-                                self,
-                                project['id'],
-                                project['name'],
-                                project['work_path'],
-                                self.global_context,
-                                self.context_manager  # Pass Smart Context Manager
-                            )
-                            worker.start()
-                            self.workers[project['id']] = worker
-                            active_count += 1
-                            self.log(f"Started worker for {project['name']} ({project['open_count']} tickets)")
-                
-                time.sleep(POLL_INTERVAL)
+                        self.start_worker(ticket)
+                if self.concurrency:
+                    self.concurrency.adjust(self.scheduler.waiting)
+                self.write_scheduler_stats()
+
+                # Sleep until something changes; wake for the next timer at the latest
+                timeout = min(DISPATCH_FALLBACK_INTERVAL, NODE_HEARTBEAT_INTERVAL,
+                              max(0, next_cleanup - time.time()))
+                if self.concurrency:
+                    timeout = min(timeout, CONCURRENCY_ADJUST_INTERVAL)
+                self.queue_event.wait(timeout)
                 
             except KeyboardInterrupt:
                 break
@@ -1947,6 +3213,14 @@ Answer briefly:"""
             self.log("Stopping Telegram Poller...")
             self.telegram_poller.stop()
 
+        # Stop command listener
+        if self.command_listener:
+            self.command_listener.stop()
+
+        # Stop project watcher
+        if self.watcher:
+            self.watcher.stop()
+
         self.log("Stopping all workers...")
         with self.workers_lock:
             for worker in self.workers.values():
@@ -1954,7 +3228,16 @@ Answer briefly:"""
 
         for worker in self.workers.values():
             worker.join(timeout=5)
-        
+
+        # Drain remaining broadcast events
+        self.broadcaster.stop()
+        self.broadcaster.join(timeout=5)
+
+        if self.context_manager:
+            self.context_manager.shutdown()
+
+        self.nodes.leave()
+
         try:
             conn = self.get_db()
             cursor = conn.cursor()
@@ -1971,6 +3254,6 @@ Answer briefly:"""
 
 if __name__ == '__main__':
     daemon = ClaudeDaemon()
-    signal.signal(signal.SIGTERM, lambda s, f: setattr(daemon, 'running', False))
-    signal.signal(signal.SIGINT, lambda s, f: setattr(daemon, 'running', False))
+    signal.signal(signal.SIGTERM, lambda s, f: daemon.request_stop())
+    signal.signal(signal.SIGINT, lambda s, f: daemon.request_stop())
     daemon.run()
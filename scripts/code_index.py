@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+Code Index - Persistent symbol index of CodeHero project sources
+Feeds the project map with an outline of the code (modules, classes,
+functions, routes) so Claude starts a ticket knowing where things are
+instead of spending tool calls exploring the tree.
+
+Per source file the index keeps its size/mtime, line count, the first line
+of its module docstring, its symbols and its imports. Python is parsed with
+the stdlib ast; other languages with line-based regexes (classes, functions,
+methods by indentation, imports, and route declarations of the common web
+frameworks: Flask/FastAPI/Django, Express, Laravel, Spring, ASP.NET, Go
+muxes, Rails). Unparseable Python falls back to the regexes.
+
+The index lives in CODE_INDEX_DIR as one JSON file per project root and is
+updated incrementally: update() reparses only files whose size or mtime
+changed (from a project_analyzer scan, or a list of changed paths from the
+project watcher), within a time budget; files left over are parsed on the
+next update.
+
+outline() ranks files by how often other files import them, their routes,
+entry points and symbol count, and renders the best ones within a token budget.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from file_index import LANGUAGES
+from token_counter import count_tokens
+
+
+CODE_INDEX_DIR = "/var/lib/codehero/code-index"
+CODE_INDEX_VERSION = 1
+MAX_INDEXES = 16                # Project roots kept in memory
+MAX_PARSE_SIZE = 256 * 1024     # Larger files are listed without symbols
+PARSE_TIME_BUDGET = 10.0        # Seconds of parsing per update (the rest waits for the next one)
+MAX_SYMBOLS_PER_FILE = 300
+OUTLINE_TOKENS = 3000           # Default outline budget
+
+# Per file in the outline
+OUTLINE_ROUTES = 8
+OUTLINE_CLASSES = 6
+OUTLINE_METHODS = 8
+OUTLINE_FUNCTIONS = 10
+
+# Class name suffix -> design pattern
+PATTERN_SUFFIXES = {
+    'Repository': 'repository', 'Factory': 'factory', 'Service': 'service layer',
+    'Controller': 'controllers', 'Middleware': 'middleware', 'Observer': 'observer',
+    'Listener': 'observer', 'Adapter': 'adapter', 'Builder': 'builder',
+    'Strategy': 'strategy', 'Provider': 'provider', 'ViewModel': 'MVVM',
+    'Singleton': 'singleton', 'Command': 'command', 'Handler': 'handlers',
+}
+
+_NOT_NAMES = {'if', 'for', 'while', 'switch', 'catch', 'return', 'function', 'new', 'else',
+              'elif', 'do', 'try', 'with', 'sizeof', 'typeof', 'await', 'throw', 'super', 'this'}
+
+
+def _rx(pattern: str):
+    return re.compile(pattern)
+
+
+# language -> {'symbols': [(kind, regex)], 'imports': [regex], 'routes': [regex]}
+# Symbol regexes match at line start and capture name (and optionally detail / parent);
+# kind 'method' only counts when indented inside a class seen before, else it is a function.
+_JS = {
+    'symbols': [
+        ('class', _rx(r'^\s*(?:export\s+(?:default\s+)?)?(?:abstract\s+)?class\s+(?P<name>\w+)(?:\s+extends\s+(?P<detail>[\w.]+))?')),
+        ('function', _rx(r'^(?:export\s+(?:default\s+)?)?(?:async\s+)?function\s*\*?\s*(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ('function', _rx(r'^(?:export\s+)?(?:const|let|var)\s+(?P<name>\w+)\s*(?::[^=]+)?=\s*(?:async\s+)?(?:function\b\s*(?P<detail>\([^)]*\))?|(?P<detail2>\([^)]*\)|\w+)\s*(?::[^=]+)?=>)')),
+        ('type', _rx(r'^(?:export\s+)?(?:declare\s+)?(?:interface|type|enum)\s+(?P<name>\w+)')),
+        ('method', _rx(r'^\s+(?:(?:public|private|protected|static|async|get|set|readonly)\s+)*(?P<name>[A-Za-z_$][\w$]*)\s*(?P<detail>\([^)]*\))\s*(?::[^{]+)?\{')),
+    ],
+    'imports': [_rx(r'''^\s*import\s+(?:[^'"]*?\s+from\s+)?['"](?P<name>[^'"]+)['"]'''),
+                _rx(r'''^.*?\brequire\(\s*['"](?P<name>[^'"]+)['"]\s*\)''')],
+    'routes': [_rx(r'''\b(?:app|router|server|api|route)\.(?P<method>get|post|put|patch|delete|all)\(\s*['"`](?P<path>/[^'"`]*)''')],
+}
+
+PATTERNS = {
+    'JavaScript': _JS, 'TypeScript': _JS, 'React': _JS, 'React/TypeScript': _JS, 'Vue': _JS,
+    'Python': {
+        'symbols': [
+            ('class', _rx(r'^\s*class\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))?')),
+            ('method', _rx(r'^\s+(?:async\s+)?def\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\)?)')),
+            ('function', _rx(r'^(?:async\s+)?def\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\)?)')),
+        ],
+        'imports': [_rx(r'^\s*(?:from\s+(?P<name>[\w.]+)\s+import|import\s+(?P<name2>[\w.]+))')],
+        'routes': [_rx(r'''^\s*@\w+\.(?P<method>route|get|post|put|patch|delete)\(\s*['"](?P<path>/[^'"]*)''')],
+    },
+    'PHP': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:(?:abstract|final|readonly)\s+)*(?:class|interface|trait|enum)\s+(?P<name>\w+)(?:\s+extends\s+(?P<detail>[\w\\]+))?')),
+            ('method', _rx(r'^\s+(?:(?:public|protected|private|static|abstract|final)\s+)*function\s+&?(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+            ('function', _rx(r'^function\s+&?(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*use\s+(?P<name>[\w\\]+)'),
+                    _rx(r'''^\s*(?:require|include)(?:_once)?\s*\(?\s*(?:__DIR__\s*\.\s*)?['"](?P<name>[^'"]+)''')],
+        'routes': [_rx(r'''Route::(?P<method>get|post|put|patch|delete|any|match|resource|apiResource)\(\s*['"](?P<path>[^'"]*)''')],
+    },
+    'Java': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:(?:public|private|protected|abstract|final|static|sealed)\s+)*(?:class|interface|enum|record|@interface)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s+(?:@\w+\s+)*(?:(?:public|private|protected|static|final|abstract|synchronized|native|default)\s+)+[\w<>\[\], ?.]+\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*import\s+(?:static\s+)?(?P<name>[\w.]+)')],
+        'routes': [_rx(r'''@(?P<method>Get|Post|Put|Patch|Delete|Request)Mapping\(\s*(?:(?:value|path)\s*=\s*)?["'](?P<path>[^"']*)'''),
+                   _rx(r'''@(?P<method>GET|POST|PUT|PATCH|DELETE)\(\s*"(?P<path>[^"]*)''')],
+    },
+    'Kotlin': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:(?:public|private|protected|internal|abstract|final|open|sealed|data|enum|annotation|inner)\s+)*(?:class|interface|object)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s*(?:(?:public|private|protected|internal|override|open|suspend|inline|abstract|operator|infix)\s+)*fun\s+(?:<[^>]+>\s*)?(?:[\w.]+\.)?(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*import\s+(?P<name>[\w.]+)')],
+        'routes': [_rx(r'''@(?P<method>GET|POST|PUT|PATCH|DELETE)\(\s*"(?P<path>[^"]*)'''),
+                   _rx(r'''@(?P<method>Get|Post|Put|Patch|Delete|Request)Mapping\(\s*(?:(?:value|path)\s*=\s*)?["'](?P<path>[^"']*)''')],
+    },
+    'Go': {
+        'symbols': [
+            ('class', _rx(r'^type\s+(?P<name>\w+)\s+(?P<detail>struct|interface)')),
+            ('method', _rx(r'^func\s+\(\s*\w*\s*\*?(?P<parent>\w+)[^)]*\)\s*(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+            ('function', _rx(r'^func\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*(?:import\s+)?(?:\w+\s+)?"(?P<name>[\w.\-/]+)"\s*$')],
+        'routes': [_rx(r'''\.(?P<method>HandleFunc|Handle|GET|POST|PUT|PATCH|DELETE|Get|Post|Put|Patch|Delete)\(\s*"(?P<path>/[^"]*)''')],
+    },
+    'C#': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:(?:public|private|protected|internal|static|abstract|sealed|partial)\s+)*(?:class|interface|struct|record|enum)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s+(?:(?:public|private|protected|internal|static|virtual|override|async|abstract|sealed|new)\s+)+[\w<>\[\],.? ]+\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*using\s+(?:static\s+)?(?P<name>[\w.]+)\s*;')],
+        'routes': [_rx(r'''\[(?:Http(?P<method>Get|Post|Put|Patch|Delete)|Route)\(\s*"(?P<path>[^"]*)'''),
+                   _rx(r'''\.Map(?P<method>Get|Post|Put|Patch|Delete)\(\s*"(?P<path>[^"]*)''')],
+    },
+    'Rust': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s+(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+(?P<name>\w+)\s*(?:<[^>]*>)?\s*(?P<detail>\([^)]*\))')),
+            ('function', _rx(r'^(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+(?P<name>\w+)\s*(?:<[^>]*>)?\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*(?:pub\s+)?use\s+(?P<name>[\w:]+)'), _rx(r'^\s*mod\s+(?P<name>\w+)\s*;')],
+        'routes': [_rx(r'''#\[(?P<method>get|post|put|patch|delete)\(\s*"(?P<path>[^"]*)''')],
+    },
+    'Ruby': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:class|module)\s+(?P<name>[\w:]+)(?:\s*<\s*(?P<detail>[\w:]+))?')),
+            ('method', _rx(r'^\s+def\s+(?:self\.)?(?P<name>[\w?!=]+)\s*(?P<detail>\([^)]*\))?')),
+            ('function', _rx(r'^def\s+(?:self\.)?(?P<name>[\w?!=]+)\s*(?P<detail>\([^)]*\))?')),
+        ],
+        'imports': [_rx(r'''^\s*require(?:_relative)?\s+['"](?P<name>[^'"]+)''')],
+        'routes': [_rx(r'''^\s*(?P<method>get|post|put|patch|delete|resources|resource)\s+['":](?P<path>[^'",\s]+)''')],
+    },
+    'Dart': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:abstract\s+)?(?:class|mixin|enum|extension)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s+(?:static\s+|@override\s+)?(?:Future<[^>]*>|[\w<>?]+)\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))\s*(?:async\s*)?\{')),
+            ('function', _rx(r'^(?:Future<[^>]*>|[\w<>?]+)\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))\s*(?:async\s*)?\{')),
+        ],
+        'imports': [_rx(r'''^\s*import\s+['"](?P<name>[^'"]+)''')],
+        'routes': [],
+    },
+    'Swift': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:(?:public|private|internal|open|final|fileprivate)\s+)*(?:class|struct|protocol|enum|actor|extension)\s+(?P<name>\w+)')),
+            ('method', _rx(r'^\s*(?:(?:public|private|internal|open|final|fileprivate|static|override|mutating|@\w+)\s+)*func\s+(?P<name>\w+)\s*(?P<detail>\([^)]*\))')),
+        ],
+        'imports': [_rx(r'^\s*import\s+(?P<name>\w+)')],
+        'routes': [],
+    },
+    'C': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:typedef\s+)?struct\s+(?P<name>\w+)\s*\{')),
+            ('function', _rx(r'^(?:(?:static|inline|extern|const|unsigned|signed)\s+)*[\w*]+\s+\**(?P<name>\w+)\s*(?P<detail>\([^;]*\))\s*\{?\s*$')),
+        ],
+        'imports': [_rx(r'^\s*#include\s+"(?P<name>[^"]+)"')],
+        'routes': [],
+    },
+    'C++': {
+        'symbols': [
+            ('class', _rx(r'^\s*(?:class|struct)\s+(?P<name>\w+)\s*(?::[^{]*)?\{?\s*$')),
+            ('function', _rx(r'^(?:(?:static|inline|extern|virtual|const|unsigned)\s+)*[\w*&:<>]+\s+[*&]*(?P<name>[\w:~]+)\s*(?P<detail>\([^;]*\))\s*(?:const\s*)?\{?\s*$')),
+        ],
+        'imports': [_rx(r'^\s*#include\s+"(?P<name>[^"]+)"')],
+        'routes': [],
+    },
+    'Shell': {
+        'symbols': [
+            ('function', _rx(r'^\s*(?:function\s+)?(?P<name>[\w-]+)\s*\(\)\s*\{?')),
+            ('function', _rx(r'^\s*function\s+(?P<name>[\w-]+)\s*\{?')),
+        ],
+        'imports': [_rx(r'''^\s*(?:source|\.)\s+['"]?(?P<name>[^\s'";]+)''')],
+        'routes': [],
+    },
+}
+
+
+# ---------- parsing ----------
+
+def _clip(text: Optional[str], limit: int = 80) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def _py_args(node) -> str:
+    args = node.args
+    names = [a.arg for a in args.posonlyargs + args.args]
+    if names and names[0] in ('self', 'cls'):
+        names = names[1:]
+    if args.vararg:
+        names.append('*' + args.vararg.arg)
+    elif args.kwonlyargs:
+        names.append('*')
+    names += [a.arg for a in args.kwonlyargs]
+    if args.kwarg:
+        names.append('**' + args.kwarg.arg)
+    return _clip('(' + ', '.join(names) + ')')
+
+
+def _py_routes(node) -> List[str]:
+    """Routes of a view function's decorators (@app.route('/x', methods=[...]), @router.get('/x'))"""
+    routes = []
+    for dec in node.decorator_list:
+        if not (isinstance(dec, ast.Call) and isinstance(dec.func, ast.Attribute) and dec.args):
+            continue
+        first = dec.args[0]
+        if not (isinstance(first, ast.Constant) and isinstance(first.value, str) and first.value.startswith('/')):
+            continue
+        attr = dec.func.attr
+        if attr in ('get', 'post', 'put', 'patch', 'delete', 'websocket'):
+            methods = attr.upper()
+        elif attr in ('route', 'api_route'):
+            methods = 'GET'
+            for kw in dec.keywords:
+                if kw.arg == 'methods' and isinstance(kw.value, (ast.List, ast.Tuple)):
+                    methods = ','.join(str(e.value).upper() for e in kw.value.elts if isinstance(e, ast.Constant))
+        else:
+            continue
+        routes.append(f"{methods} {first.value}")
+    return routes
+
+
+def _py_urlpatterns(node) -> List[Tuple[str, int, str]]:
+    """Django urlpatterns entries: [(route, line, view)]"""
+    routes = []
+    if isinstance(node.value, (ast.List, ast.Tuple)):
+        for call in node.value.elts:
+            if (isinstance(call, ast.Call) and isinstance(call.func, ast.Name)
+                    and call.func.id in ('path', 're_path', 'url') and call.args
+                    and isinstance(call.args[0], ast.Constant) and isinstance(call.args[0].value, str)):
+                view = ast.unparse(call.args[1]) if len(call.args) > 1 and hasattr(ast, 'unparse') else ''
+                routes.append(('ANY /' + call.args[0].value.lstrip('^/'), call.lineno, _clip(view, 60)))
+    return routes
+
+
+def parse_python(text: str) -> Tuple[str, List[list], List[str]]:
+    """(doc, symbols, imports) of Python source via ast"""
+    tree = ast.parse(text)
+    doc = (ast.get_docstring(tree) or '').strip().split('\n')[0]
+    symbols, imports = [], []
+
+    def add_function(node, parent=None):
+        name = f"{parent}.{node.name}" if parent else node.name
+        symbols.append(['method' if parent else 'function', name, node.lineno, _py_args(node)])
+        for route in _py_routes(node):
+            symbols.append(['route', route, node.lineno, name])
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            if node.module:
+                imports.append('.' * node.level + node.module)
+            else:
+                imports += ['.' * node.level + alias.name for alias in node.names]
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            add_function(node)
+        elif isinstance(node, ast.ClassDef):
+            bases = ', '.join(ast.unparse(b) for b in node.bases) if hasattr(ast, 'unparse') else ''
+            symbols.append(['class', node.name, node.lineno, _clip(f"({bases})" if bases else '')])
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    add_function(item, node.name)
+        elif isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'urlpatterns'
+                                                  for t in node.targets):
+            symbols += [['route', route, line, view] for route, line, view in _py_urlpatterns(node)]
+    return doc, symbols, imports
+
+
+def parse_regex(language: str, text: str) -> Tuple[str, List[list], List[str]]:
+    """(doc, symbols, imports) using the PATTERNS of a language"""
+    spec = PATTERNS.get(language)
+    if not spec:
+        return '', [], []
+    symbols, imports = [], []
+    current = None          # (class name, indent) that indented methods belong to
+    for lineno, line in enumerate(text.splitlines(), 1):
+        if len(line) > 400:
+            continue        # Minified or generated
+        stripped = line.lstrip()
+        if not stripped or stripped.startswith(('//', '/*', '* ', '--')):
+            continue
+        indent = len(line) - len(stripped)
+        for regex in spec['imports']:
+            m = regex.match(line)
+            if m:
+                imports.append(m.group('name') or m.groupdict().get('name2'))
+                break
+        for regex in spec['routes']:
+            m = regex.search(line)
+            if m:
+                method = (m.group('method') or 'ANY').upper()
+                if method in ('HANDLEFUNC', 'HANDLE', 'REQUEST'):
+                    method = 'ANY'
+                symbols.append(['route', f"{method} {m.group('path') or '/'}", lineno, ''])
+                break
+        for kind, regex in spec['symbols']:
+            m = regex.match(line)
+            if not m or m.group('name') in _NOT_NAMES:
+                continue
+            groups = m.groupdict()
+            detail = _clip(groups.get('detail') or groups.get('detail2') or '')
+            name = m.group('name')
+            if kind == 'class':
+                current = (name, indent)
+            elif groups.get('parent'):
+                name = f"{groups['parent']}.{name}"
+            elif kind == 'method':
+                if not current or indent <= current[1]:
+                    if indent:
+                        continue        # Nested helper, not a method
+                    kind = 'function'
+                else:
+                    name = f"{current[0]}.{name}"
+            elif indent == 0:
+                current = None
+            symbols.append([kind, name, lineno, detail])
+            break
+    return '', symbols, imports
+
+
+def parse_source(language: str, text: str) -> Tuple[str, List[list], List[str]]:
+    if language == 'Python':
+        try:
+            return parse_python(text)
+        except (SyntaxError, ValueError, RecursionError):
+            pass
+    return parse_regex(language, text)
+
+
+# ---------- index ----------
+
+def _shape(record: Dict) -> tuple:
+    """What the outline shows of a file record (symbols without line numbers, imports, doc)"""
+    return [(s[0], s[1], s[3]) for s in record['y']], record['i'], record['d']
+
+
+class CodeIndex:
+    """Symbols of the source files under one project root.
+
+    files maps a relative path to a record:
+    {'m': mtime_ns, 's': size, 'l': language, 'n': lines, 'd': doc,
+     'y': [[kind, name, line, detail], ...], 'i': [import, ...]}
+    """
+
+    def __init__(self, root: str, store_dir: str = CODE_INDEX_DIR):
+        self.root = os.path.abspath(root)
+        key = hashlib.sha1(self.root.encode()).hexdigest()[:16]
+        self.path = os.path.join(store_dir, f"{key}.json") if store_dir else None
+        self.lock = threading.RLock()
+        self.files: Dict[str, Dict] = {}
+        self.complete = False       # Last full update parsed everything
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == CODE_INDEX_VERSION and data.get('root') == self.root:
+            self.files = data.get('files', {})
+            self.complete = data.get('complete', False)
+
+    def save(self) -> bool:
+        """Write the index to disk (False if the store is not writable)"""
+        if not self.path:
+            return False
+        with self.lock:
+            data = {'version': CODE_INDEX_VERSION, 'root': self.root,
+                    'complete': self.complete, 'files': self.files}
+            tmp = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp, 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(tmp, self.path)
+            except OSError:
+                return False
+        return True
+
+    def _parse(self, rel: str, language: str, size: int, mtime_ns: int) -> Dict:
+        record = {'m': mtime_ns, 's': size, 'l': language, 'n': 0, 'd': '', 'y': [], 'i': []}
+        if size > MAX_PARSE_SIZE:
+            return record
+        try:
+            with open(os.path.join(self.root, rel), 'rb') as f:
+                text = f.read(MAX_PARSE_SIZE).decode('utf-8', errors='replace')
+        except OSError:
+            return record
+        doc, symbols, imports = parse_source(language, text)
+        record.update(n=text.count('\n') + 1, d=_clip(doc, 120),
+                      y=symbols[:MAX_SYMBOLS_PER_FILE], i=sorted(set(i for i in imports if i)))
+        return record
+
+    def _update_file(self, rel: str, language: str, size: int, mtime_ns: int) -> bool:
+        """Reparse one file if its size/mtime changed; True if its symbols or imports changed"""
+        old = self.files.get(rel)
+        if old and old['s'] == size and old['m'] == mtime_ns:
+            return False
+        record = self._parse(rel, language, size, mtime_ns)
+        self.files[rel] = record
+        return not old or _shape(old) != _shape(record)
+
+    def update(self, analysis=None, paths: Iterable[str] = None,
+               time_budget: float = PARSE_TIME_BUDGET) -> bool:
+        """Bring the index up to date; True if any outline-relevant content changed.
+
+        With an analysis (project_analyzer.ProjectAnalysis), every scanned source
+        file is checked and files no longer present are dropped (unless the scan
+        was truncated). With paths (relative, from the project watcher), only
+        those are checked.
+        """
+        deadline = time.monotonic() + time_budget
+        changed = False
+        with self.lock:
+            if analysis is not None:
+                seen = set()
+                complete = True
+                for rel_dir, (_, files) in analysis.dirs.items():
+                    prefix = rel_dir + '/' if rel_dir else ''
+                    for entry in files:
+                        language = entry.language
+                        if not language:
+                            continue
+                        rel = prefix + entry.name
+                        seen.add(rel)
+                        if time.monotonic() >= deadline:
+                            complete = False
+                            continue
+                        changed |= self._update_file(rel, language, entry.size, entry.mtime_ns)
+                if not analysis.truncated:
+                    for rel in [r for r in self.files if r not in seen]:
+                        del self.files[rel]
+                        changed = True
+                self.complete = complete and not analysis.truncated
+            for rel in paths or ():
+                rel = rel.strip('/')
+                try:
+                    st = os.stat(os.path.join(self.root, rel))
+                except OSError:
+                    st = None
+                if st is None or os.path.isdir(os.path.join(self.root, rel)):
+                    prefix = rel + '/'
+                    for gone in [r for r in self.files if r == rel or (st is None and r.startswith(prefix))]:
+                        del self.files[gone]
+                        changed = True
+                    continue
+                language = LANGUAGES.get(os.path.splitext(rel)[1].lower())
+                if language and time.monotonic() < deadline:
+                    changed |= self._update_file(rel, language, st.st_size, st.st_mtime_ns)
+        return changed
+
+    # ---------- queries ----------
+
+    def _inbound(self) -> Counter:
+        """Number of other files importing each file (resolved by path suffix, then by stem)"""
+        by_stem = {}
+        for rel in self.files:
+            by_stem.setdefault(os.path.splitext(os.path.basename(rel))[0], []).append(rel)
+        inbound = Counter()
+        for rel, record in self.files.items():
+            targets = set()
+            for name in record['i']:
+                path = re.sub(r'^(?:\.{1,2}/)+|^[@~]/', '', name).lstrip('.')
+                path = re.sub(r'\.(?:py|js|jsx|ts|tsx|vue|php|rb|dart)$', '', path)
+                path = re.sub(r'[.\\]|::', '/', path) if '/' not in path else path
+                stem = path.rstrip('/').rpartition('/')[2]
+                candidates = by_stem.get(stem, [])
+                if len(candidates) > 1:
+                    exact = [c for c in candidates if os.path.splitext(c)[0].endswith(path)]
+                    candidates = exact or candidates
+                targets.update(c for c in candidates if c != rel)
+            inbound.update(targets)
+        return inbound
+
+    def ranked(self, entry_points: Iterable[str] = ()) -> List[Tuple[float, str]]:
+        """(score, path) of files with symbols, best first"""
+        entry_points = set(entry_points)
+        inbound = self._inbound()
+        scored = []
+        for rel, record in self.files.items():
+            symbols = record['y']
+            if not symbols:
+                continue
+            routes = sum(1 for s in symbols if s[0] == 'route')
+            public = sum(1 for s in symbols if s[0] != 'route' and not s[1].rpartition('.')[2].startswith('_'))
+            score = 3 * min(inbound[rel], 15) + 2 * min(routes, 15) + 0.5 * min(public, 20) \
+                + (10 if rel in entry_points else 0) - rel.count('/')
+            if re.search(r'(?:^|/)(?:tests?|spec|__tests__)(?:/|$)|(?:^|/)test_|[._]test\.|\.spec\.', rel):
+                score *= 0.3
+            scored.append((score, rel))
+        scored.sort(key=lambda s: (-s[0], s[1]))
+        return scored
+
+    def _render_file(self, rel: str) -> str:
+        record = self.files[rel]
+        head = f"{rel} ({record['l']}, {record['n']} lines)"
+        if record['d']:
+            head += f": {record['d']}"
+        lines = [head]
+        symbols = record['y']
+        routes = [s[1] for s in symbols if s[0] == 'route']
+        if routes:
+            more = f" (+{len(routes) - OUTLINE_ROUTES})" if len(routes) > OUTLINE_ROUTES else ''
+            lines.append(f"  routes: {', '.join(routes[:OUTLINE_ROUTES])}{more}")
+        methods = {}
+        for kind, name, _, _ in symbols:
+            if kind == 'method':
+                cls, _, method = name.rpartition('.')
+                if not method.startswith('_'):
+                    methods.setdefault(cls, []).append(method)
+        classes = [s for s in symbols if s[0] in ('class', 'type') and not s[1].startswith('_')]
+        for kind, name, _, detail in classes[:OUTLINE_CLASSES]:
+            names = methods.get(name, [])
+            line = f"  {'class' if kind == 'class' else 'type'} {name}{detail}"
+            if names:
+                more = f" (+{len(names) - OUTLINE_METHODS})" if len(names) > OUTLINE_METHODS else ''
+                line += f": {', '.join(names[:OUTLINE_METHODS])}{more}"
+            lines.append(line)
+        if len(classes) > OUTLINE_CLASSES:
+            lines.append(f"  ... {len(classes) - OUTLINE_CLASSES} more classes")
+        functions = [f"{s[1]}{s[3]}" for s in symbols if s[0] == 'function' and not s[1].startswith('_')]
+        if functions:
+            more = f" (+{len(functions) - OUTLINE_FUNCTIONS})" if len(functions) > OUTLINE_FUNCTIONS else ''
+            lines.append(f"  functions: {', '.join(functions[:OUTLINE_FUNCTIONS])}{more}")
+        return '\n'.join(lines)
+
+    def outline(self, max_tokens: int = OUTLINE_TOKENS, entry_points: Iterable[str] = ()) -> str:
+        """Outline of the highest ranked files that fits in max_tokens"""
+        with self.lock:
+            ranked = self.ranked(entry_points)
+            blocks, used = [], 0
+            for _, rel in ranked:
+                block = self._render_file(rel)
+                tokens = count_tokens(block) + 1
+                if used + tokens > max_tokens:
+                    continue        # A smaller block further down may still fit
+                blocks.append(block)
+                used += tokens
+            left = len(ranked) - len(blocks)
+        if left:
+            blocks.append(f"... {left} more source files with symbols not shown")
+        return '\n'.join(blocks)
+
+    def design_patterns(self) -> List[str]:
+        """Patterns suggested by class names (UserRepository -> repository)"""
+        found = Counter()
+        with self.lock:
+            for record in self.files.values():
+                for kind, name, _, _ in record['y']:
+                    if kind == 'class':
+                        for suffix, pattern in PATTERN_SUFFIXES.items():
+                            if name.endswith(suffix) and name != suffix:
+                                found[pattern] += 1
+        return [pattern for pattern, _ in found.most_common()]
+
+    def architecture_type(self) -> Optional[str]:
+        """Rough architecture from folder names and symbols (None if nothing stands out)"""
+        with self.lock:
+            dirs = {part.lower() for rel in self.files for part in rel.split('/')[:-1]}
+            routes = sum(1 for record in self.files.values() for s in record['y'] if s[0] == 'route')
+
+        def has(*names):
+            return any(n in dirs for n in names)
+
+        if has('controllers', 'controller') and has('models', 'model', 'entities'):
+            return 'MVC'
+        if has('viewmodels', 'viewmodel'):
+            return 'MVVM'
+        if has('services', 'service') and has('repositories', 'repository', 'dao'):
+            return 'Layered (services/repositories)'
+        if routes:
+            return 'Web app with route handlers'
+        return None
+
+
+_indexes: 'OrderedDict[str, CodeIndex]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_code_index(root: str) -> CodeIndex:
+    """The shared code index of a project root (loaded from disk on first use)"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.pop(root, None) or CodeIndex(root)
+        _indexes[root] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+File Index - Cached, incremental listings of CodeHero project trees
+Shared by the editor tree, the file manager and the project map, so a
+project folder is read once instead of walked again on every request.
+
+The index keeps one listing per directory (name, type, size, mtime, and a
+content hash computed on first use). A listing is read with os.scandir when
+first needed, and read again only when:
+- the directory's mtime changed (an entry was added, removed or renamed),
+- it is older than INDEX_STAT_TTL (so file sizes and mtimes stay fresh), or
+- it was invalidated (see invalidate()). When a change watcher feeds
+  invalidate(), the index is given the watcher's filter (watched) and
+  listings of watched directories are trusted until invalidated; directories
+  the watcher skips (node_modules/, build/, ...) keep the checks above.
+
+Nothing is read up front: the editor tree only lists the directories it
+shows, and walks (stats, language histogram) skip filtered paths without
+entering them.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from path_filter import PathFilter
+
+
+INDEX_STAT_TTL = 30         # Seconds before a listing is read again (sooner if its directory changes)
+MAX_INDEXES = 32            # Project roots kept in memory (least recently used dropped)
+HASH_CHUNK = 1024 * 1024
+TREE_PAGE = 500             # Default entries per directory in tree()
+TREE_MAX_DEPTH = 8          # Deepest tree() answers in one request
+
+# Extension -> language, for source files only (markup and data files are not counted)
+LANGUAGES = {
+    '.py': 'Python', '.js': 'JavaScript', '.mjs': 'JavaScript', '.ts': 'TypeScript',
+    '.jsx': 'React', '.tsx': 'React/TypeScript', '.vue': 'Vue', '.php': 'PHP',
+    '.java': 'Java', '.kt': 'Kotlin', '.kts': 'Kotlin', '.go': 'Go', '.rs': 'Rust',
+    '.rb': 'Ruby', '.cs': 'C#', '.fs': 'F#', '.dart': 'Dart', '.swift': 'Swift',
+    '.c': 'C', '.h': 'C', '.cpp': 'C++', '.hpp': 'C++', '.sh': 'Shell',
+}
+
+
+class FileEntry:
+    """One directory entry (is_dir is True for symlinks to directories too)"""
+
+    __slots__ = ('name', 'is_dir', 'is_link', 'size', 'mtime_ns', 'digest')
+
+    def __init__(self, name: str, is_dir: bool, is_link: bool, size: int, mtime_ns: int):
+        self.name = name
+        self.is_dir = is_dir
+        self.is_link = is_link
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = None
+
+    @property
+    def language(self) -> Optional[str]:
+        return None if self.is_dir else LANGUAGES.get(os.path.splitext(self.name)[1].lower())
+
+
+class _Listing:
+    __slots__ = ('mtime_ns', 'read_at', 'entries')
+
+    def __init__(self, mtime_ns: int, read_at: float, entries: List[FileEntry]):
+        self.mtime_ns = mtime_ns
+        self.read_at = read_at
+        self.entries = entries
+
+
+class FileIndex:
+    """Cached directory listings of one project root. Paths are relative to
+    the root with '/' separators; '' is the root itself."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.watched: Optional[PathFilter] = None      # Set while a watcher invalidates this root
+        self.generation = 0         # Bumped by invalidate(), for callers caching derived data
+        self.lock = threading.RLock()
+        self.listings: Dict[str, _Listing] = {}
+
+    def _path(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else self.root
+
+    # ---------- listings ----------
+
+    def listdir(self, rel_dir: str = '') -> Optional[List[FileEntry]]:
+        """Entries of a directory, directories first then by name (None if it is not one)"""
+        with self.lock:
+            listing = self.listings.get(rel_dir)
+        if listing:
+            watched = self.watched
+            if watched is not None and not watched.excluded(rel_dir, True):
+                return listing.entries
+            if time.monotonic() - listing.read_at < INDEX_STAT_TTL:
+                try:
+                    if os.stat(self._path(rel_dir)).st_mtime_ns == listing.mtime_ns:
+                        return listing.entries
+                except OSError:
+                    pass
+        return self._read(rel_dir, listing)
+
+    def _read(self, rel_dir: str, previous: Optional[_Listing]) -> Optional[List[FileEntry]]:
+        path = self._path(rel_dir)
+        try:
+            # Directory mtime first: a change during the scan shows up on the next check
+            mtime_ns = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                dir_entries = list(it)
+        except OSError:
+            with self.lock:
+                self.listings.pop(rel_dir, None)
+            return None
+
+        known = {e.name: e for e in previous.entries} if previous else {}
+        entries = []
+        for de in dir_entries:
+            try:
+                is_link = de.is_symlink()
+                try:
+                    st = de.stat()
+                except OSError:
+                    st = de.stat(follow_symlinks=False)     # Broken symlink
+                is_dir = de.is_dir()
+            except OSError:
+                continue        # Vanished mid-scan
+            entry = FileEntry(de.name, is_dir, is_link, st.st_size, st.st_mtime_ns)
+            old = known.get(de.name)
+            if old and old.size == entry.size and old.mtime_ns == entry.mtime_ns:
+                entry.digest = old.digest
+            entries.append(entry)
+        entries.sort(key=lambda e: (not e.is_dir, e.name.lower()))
+
+        with self.lock:
+            self.listings[rel_dir] = _Listing(mtime_ns, time.monotonic(), entries)
+        return entries
+
+    def invalidate(self, paths: List[str] = None):
+        """Forget changed paths (relative to the root), or everything with None.
+        The listing of each path's directory and, for a directory, everything
+        below it is read again on next use."""
+        with self.lock:
+            self.generation += 1
+            if paths is None:
+                self.listings.clear()
+                return
+            for rel in paths:
+                rel = rel.strip('/')
+                self.listings.pop(os.path.dirname(rel), None)
+                if not rel:
+                    self.listings.clear()
+                    return
+                prefix = rel + '/'
+                for key in [k for k in self.listings if k == rel or k.startswith(prefix)]:
+                    del self.listings[key]
+
+    # ---------- queries ----------
+
+    def visible(self, rel_dir: str, path_filter: Optional[PathFilter],
+                 hidden: bool) -> Tuple[Optional[List[FileEntry]], Optional[PathFilter]]:
+        """Entries of a directory left after path_filter (and dotfiles unless hidden),
+        and the filter that applies below it"""
+        entries = self.listdir(rel_dir)
+        if entries is None:
+            return None, path_filter
+        if path_filter:
+            path_filter = path_filter.enter(self._path(rel_dir), rel_dir,
+                                            [e.name for e in entries if not e.is_dir])
+        prefix = rel_dir + '/' if rel_dir else ''
+        visible = [e for e in entries
+                   if (hidden or not e.name.startswith('.'))
+                   and not (path_filter and path_filter.match(prefix + e.name, e.is_dir))]
+        return visible, path_filter
+
+    def _filter_at(self, rel_dir: str, path_filter: Optional[PathFilter]) -> Optional[PathFilter]:
+        """path_filter with the .gitignore files of rel_dir's parents applied"""
+        if not path_filter or not path_filter.read_gitignore or not rel_dir:
+            return path_filter
+        parts = rel_dir.split('/')
+        for i in range(len(parts)):
+            _, path_filter = self.visible('/'.join(parts[:i]), path_filter, True)
+        return path_filter
+
+    def walk(self, path_filter: PathFilter = None,
+             hidden: bool = True) -> Iterator[Tuple[str, List[FileEntry], List[FileEntry]]]:
+        """Yield (rel_dir, dirs, files) for every directory not excluded by
+        path_filter, top-down. Symlinked directories are listed, not entered."""
+        stack = [('', path_filter)]
+        while stack:
+            rel_dir, filt = stack.pop()
+            visible, filt = self.visible(rel_dir, filt, hidden)
+            if visible is None:
+                continue
+            dirs = [e for e in visible if e.is_dir]
+            yield rel_dir, dirs, [e for e in visible if not e.is_dir]
+            prefix = rel_dir + '/' if rel_dir else ''
+            for entry in reversed(dirs):
+                if not entry.is_link:
+                    stack.append((prefix + entry.name, filt))
+
+    def stats(self, path_filter: PathFilter = None) -> Tuple[int, int]:
+        """(file count, total bytes) of the files not excluded by path_filter"""
+        count = size = 0
+        for _, _, files in self.walk(path_filter):
+            count += len(files)
+            size += sum(e.size for e in files)
+        return count, size
+
+    def languages(self, path_filter: PathFilter = None) -> Counter:
+        """Number of source files per language (see LANGUAGES)"""
+        histogram = Counter()
+        for _, _, files in self.walk(path_filter):
+            histogram.update(lang for lang in (e.language for e in files) if lang)
+        return histogram
+
+    def tree(self, rel_dir: str = '', depth: int = 1, offset: int = 0, limit: int = TREE_PAGE,
+             path_filter: PathFilter = None, hidden: bool = True) -> Optional[Dict]:
+        """One page of a directory, with subdirectories expanded depth - 1 levels.
+
+        Returns {'items', 'total', 'offset', 'next_offset'} (None if rel_dir is
+        not a directory). Expanded subdirectories carry their first `limit`
+        entries as 'children' plus 'total'; the rest is fetched with another
+        call for that path.
+        """
+        depth = max(1, min(depth, TREE_MAX_DEPTH))
+        return self._tree_level(rel_dir.strip('/'), self._filter_at(rel_dir.strip('/'), path_filter),
+                                depth, max(0, offset), max(1, limit), hidden)
+
+    def _tree_level(self, rel_dir: str, path_filter: Optional[PathFilter], depth: int,
+                    offset: int, limit: int, hidden: bool) -> Optional[Dict]:
+        visible, path_filter = self.visible(rel_dir, path_filter, hidden)
+        if visible is None:
+            return None
+        page = visible[offset:offset + limit]
+        prefix = rel_dir + '/' if rel_dir else ''
+        items = []
+        for entry in page:
+            rel = prefix + entry.name
+            if entry.is_dir:
+                item = {'name': entry.name, 'path': rel, 'type': 'dir'}
+                if depth > 1:
+                    sub = self._tree_level(rel, path_filter, depth - 1, 0, limit, hidden)
+                    if sub is not None:
+                        item['children'] = sub['items']
+                        item['total'] = sub['total']
+                items.append(item)
+            else:
+                items.append({'name': entry.name, 'path': rel, 'type': 'file', 'size': entry.size})
+        end = offset + len(page)
+        return {'items': items, 'total': len(visible), 'offset': offset,
+                'next_offset': end if end < len(visible) else None}
+
+    def entry(self, rel: str) -> Optional[FileEntry]:
+        """The entry of one path (None if missing)"""
+        rel = rel.strip('/')
+        if not rel:
+            return None
+        parent, _, name = rel.rpartition('/')
+        for entry in self.listdir(parent) or []:
+            if entry.name == name:
+                return entry
+        return None
+
+    def digest(self, rel: str) -> Optional[str]:
+        """SHA-256 of a file, computed once per size/mtime"""
+        entry = self.entry(rel)
+        if entry is None or entry.is_dir:
+            return None
+        if entry.digest is None:
+            h = hashlib.sha256()
+            try:
+                with open(self._path(rel), 'rb') as f:
+                    for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                        h.update(chunk)
+            except OSError:
+                return None
+            entry.digest = h.hexdigest()
+        return entry.digest
+
+
+_indexes: 'OrderedDict[str, FileIndex]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_file_index(root: str) -> FileIndex:
+    """The shared index of a project root (created on first use)"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.pop(root, None) or FileIndex(root)
+        _indexes[root] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+def invalidate_file_index(root: str, paths: List[str] = None):
+    """Drop changed paths (relative to root) from the index of root, if it has one"""
+    with _indexes_lock:
+        index = _indexes.get(os.path.abspath(root))
+    if index:
+        index.invalidate(paths)
@@ -7,10 +7,22 @@ Manages Git repositories for project version control with auto-commit support.
 import subprocess
 import os
 import re
+import threading
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
 
+# Refs that keep backup checkpoint commits from being garbage collected
+BACKUP_REF_PREFIX = 'refs/codehero/backups/'
+
+# Git subcommands that never change the repository (results may be cached, see watch_repo)
+READ_ONLY_COMMANDS = {'status', 'log', 'show', 'diff', 'rev-parse', 'rev-list', 'ls-files',
+                      'ls-tree', 'cat-file', 'archive', 'for-each-ref'}
+
+# Repositories under a change watcher: path -> {'gen', 'values'} of cached query results
+_query_cache: Dict[str, Dict] = {}
+_query_cache_lock = threading.Lock()
+
 # .gitignore patterns by project type
 GITIGNORE_PATTERNS = {
     'common': [
@@ -107,6 +119,57 @@ GITIGNORE_PATTERNS = {
 }
 
 
+def watch_repo(repo_path: str, watched: bool = True):
+    """
+    Start (or stop) caching read-only query results of a repository.
+    Only for repositories whose changes call invalidate_repo (a project watcher).
+    """
+    key = os.path.abspath(repo_path)
+    with _query_cache_lock:
+        if watched:
+            _query_cache.setdefault(key, {'gen': 0, 'values': {}})
+        else:
+            _query_cache.pop(key, None)
+
+
+def invalidate_repo(repo_path: str):
+    """Drop cached query results of a repository (its files or state changed)"""
+    with _query_cache_lock:
+        entry = _query_cache.get(os.path.abspath(repo_path))
+        if entry:
+            entry['gen'] += 1
+            entry['values'] = {}
+
+
+def gitignore_patterns(project_type: str, tech_stack: str) -> List[str]:
+    """
+    .gitignore lines for a project type and tech stack.
+
+    Args:
+        project_type: Type of project (web, app, php, python, etc.)
+        tech_stack: Technology stack string (matched by substring)
+
+    Returns:
+        List of lines, including comments and blank separators
+    """
+    tech_stack = tech_stack.lower() if tech_stack else ''
+
+    # Start with common patterns
+    patterns = GITIGNORE_PATTERNS['common'].copy()
+
+    # Add patterns based on project type
+    if project_type in GITIGNORE_PATTERNS:
+        patterns.extend(['', f'# {project_type.title()} specific'])
+        patterns.extend(GITIGNORE_PATTERNS[project_type])
+
+    # Add patterns based on tech stack
+    for tech, tech_patterns in GITIGNORE_PATTERNS.items():
+        if tech != 'common' and tech in tech_stack:
+            patterns.extend(['', f'# {tech.title()}'])
+            patterns.extend(tech_patterns)
+    return patterns
+
+
 class GitManager:
     """Manages Git operations for a project repository."""
 
@@ -125,8 +188,8 @@ class GitManager:
         self.git_dir = os.path.join(repo_path, '.git')
 
     def is_initialized(self) -> bool:
-        """Check if Git repository is already initialized."""
-        return os.path.isdir(self.git_dir)
+        """Check if Git repository is already initialized (a linked worktree has a .git file)."""
+        return os.path.exists(self.git_dir)
 
     def init_repo(self) -> Tuple[bool, str]:
         """
@@ -173,19 +236,7 @@ class GitManager:
         """
         gitignore_path = os.path.join(self.repo_path, '.gitignore')
 
-        # Start with common patterns
-        patterns = GITIGNORE_PATTERNS['common'].copy()
-
-        # Add patterns based on project type
-        if self.project_type in GITIGNORE_PATTERNS:
-            patterns.extend(['', f'# {self.project_type.title()} specific'])
-            patterns.extend(GITIGNORE_PATTERNS[self.project_type])
-
-        # Add patterns based on tech stack
-        for tech, tech_patterns in GITIGNORE_PATTERNS.items():
-            if tech != 'common' and tech in self.tech_stack:
-                patterns.extend(['', f'# {tech.title()}'])
-                patterns.extend(tech_patterns)
+        patterns = gitignore_patterns(self.project_type, self.tech_stack)
 
         # Write gitignore
         try:
@@ -451,26 +502,13 @@ class GitManager:
             branch = branch_result[1].strip() if branch_result[0] == 0 else 'unknown'
 
             # Get status
-            status_result = self._run_git(['status', '--porcelain'])
+            status_result = self._run_git_cached(['status', '--porcelain'])
 
-            modified = []
-            added = []
-            deleted = []
-            untracked = []
-
-            if status_result[0] == 0 and status_result[1]:
-                for line in status_result[1].strip().split('\n'):
-                    if len(line) >= 3:
-                        status = line[:2]
-                        filepath = line[3:]
-                        if status == '??':
-                            untracked.append(filepath)
-                        elif 'M' in status:
-                            modified.append(filepath)
-                        elif 'A' in status:
-                            added.append(filepath)
-                        elif 'D' in status:
-                            deleted.append(filepath)
+            changes = self._parse_porcelain(status_result[1] if status_result[0] == 0 else '')
+            modified = changes['modified']
+            added = changes['added']
+            deleted = changes['deleted']
+            untracked = changes['untracked']
 
             # Get last commit
             last_commit = None
@@ -548,12 +586,14 @@ class GitManager:
         except Exception as e:
             return False, f"Error during rollback: {str(e)}"
 
-    def get_context_for_claude(self, max_commits: int = 5) -> str:
+    def get_context_for_claude(self, max_commits: int = 5, include_changes: bool = True) -> str:
         """
         Generate Git context string to include in Claude's prompt.
 
         Args:
             max_commits: Maximum number of recent commits to show
+            include_changes: Include uncommitted changes. Without them the
+                context only changes when HEAD moves (see get_head_ref)
 
         Returns:
             Formatted context string
@@ -578,17 +618,9 @@ class GitManager:
                 lines.append(f"Last commit: {lc['short_hash']} - {lc['message']}")
 
             # Uncommitted changes
-            if status.get('has_changes'):
+            if include_changes and status.get('has_changes'):
                 lines.append("")
-                lines.append("Uncommitted changes:")
-                for f in status.get('modified', [])[:10]:
-                    lines.append(f"  M {f}")
-                for f in status.get('added', [])[:10]:
-                    lines.append(f"  A {f}")
-                for f in status.get('deleted', [])[:10]:
-                    lines.append(f"  D {f}")
-                for f in status.get('untracked', [])[:10]:
-                    lines.append(f"  ? {f}")
+                lines.extend(self._format_changes(status))
 
             # Recent commits
             commits = self.get_commits(max_commits)
@@ -605,6 +637,319 @@ class GitManager:
             print(f"[Git] Error getting context: {e}")
             return ""
 
+    def get_changes_context(self) -> str:
+        """
+        Uncommitted changes in the same format as get_context_for_claude,
+        using a single git call.
+
+        Returns:
+            Formatted changes string, empty if the worktree is clean
+        """
+        if not self.is_initialized():
+            return ""
+
+        result = self._run_git_cached(['status', '--porcelain'])
+        if result[0] != 0:
+            return ""
+        changes = self._parse_porcelain(result[1])
+        if not any(changes.values()):
+            return ""
+        return '\n'.join(self._format_changes(changes))
+
+    def get_head_ref(self) -> Optional[str]:
+        """
+        Identify the current HEAD by reading .git directly (no subprocess).
+
+        Returns:
+            "<ref>@<commit hash>" (or the hash alone when detached), None if unknown
+        """
+        try:
+            git_dir, common_dir = self._resolve_git_dirs()
+            with open(os.path.join(git_dir, 'HEAD'), 'r') as f:
+                head = f.read().strip()
+            if not head.startswith('ref: '):
+                return head
+
+            ref = head[5:]
+            ref_file = os.path.join(common_dir, ref)
+            if os.path.isfile(ref_file):
+                with open(ref_file, 'r') as f:
+                    return f"{ref}@{f.read().strip()}"
+
+            packed = os.path.join(common_dir, 'packed-refs')
+            if os.path.isfile(packed):
+                with open(packed, 'r') as f:
+                    for line in f:
+                        parts = line.strip().split(' ', 1)
+                        if len(parts) == 2 and parts[1] == ref:
+                            return f"{ref}@{parts[0]}"
+
+            # Branch without commits yet
+            return f"{ref}@"
+        except Exception:
+            return None
+
+    def _resolve_git_dirs(self) -> Tuple[str, str]:
+        """
+        Locate the git directory and the common directory (refs, objects).
+        They differ in a linked worktree, where .git is a file pointing to
+        <main>/.git/worktrees/<name>.
+
+        Returns:
+            Tuple of (git_dir, common_dir)
+        """
+        git_dir = self.git_dir
+        if os.path.isfile(git_dir):
+            with open(git_dir, 'r') as f:
+                content = f.read().strip()
+            if content.startswith('gitdir: '):
+                git_dir = os.path.normpath(os.path.join(self.repo_path, content[8:]))
+
+        common_dir = git_dir
+        commondir_file = os.path.join(git_dir, 'commondir')
+        if os.path.isfile(commondir_file):
+            with open(commondir_file, 'r') as f:
+                common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+        return git_dir, common_dir
+
+    # =========================================================================
+    # WORKTREES (parallel tickets)
+    # =========================================================================
+
+    def get_current_branch(self) -> Optional[str]:
+        """Get the checked out branch name (None if detached or unknown)."""
+        result = self._run_git(['branch', '--show-current'])
+        branch = result[1].strip() if result[0] == 0 else ''
+        return branch or None
+
+    def branch_exists(self, branch: str) -> bool:
+        """Check if a local branch exists."""
+        result = self._run_git(['rev-parse', '--verify', '--quiet', f'refs/heads/{branch}'])
+        return result[0] == 0
+
+    def add_worktree(self, path: str, branch: str) -> Tuple[bool, str, bool]:
+        """
+        Check out a branch in a separate working directory. The branch is
+        created from the current HEAD if it doesn't exist yet.
+
+        Args:
+            path: Directory for the new worktree
+            branch: Branch to check out there
+
+        Returns:
+            Tuple of (success, message, created) - created is False when an
+            existing worktree or branch was reused
+        """
+        if not self.is_initialized():
+            return False, "Repository not initialized", False
+
+        if os.path.exists(os.path.join(path, '.git')):
+            return True, "Worktree already exists", False
+
+        try:
+            # Forget worktrees whose directories were deleted
+            self._run_git(['worktree', 'prune'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if self.branch_exists(branch):
+                result = self._run_git(['worktree', 'add', path, branch])
+                created = False
+            else:
+                result = self._run_git(['worktree', 'add', '-b', branch, path, 'HEAD'])
+                created = True
+
+            if result[0] != 0:
+                return False, f"Failed to add worktree: {result[2]}", False
+            return True, f"Worktree ready at {path}", created
+
+        except Exception as e:
+            return False, f"Error adding worktree: {str(e)}", False
+
+    def remove_worktree(self, path: str, branch: str = None) -> Tuple[bool, str]:
+        """
+        Remove a worktree and optionally delete its branch.
+
+        Args:
+            path: Worktree directory
+            branch: Branch to delete afterwards (unmerged work is discarded)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        try:
+            if os.path.exists(path):
+                result = self._run_git(['worktree', 'remove', '--force', path])
+                if result[0] != 0:
+                    return False, f"Failed to remove worktree: {result[2]}"
+            self._run_git(['worktree', 'prune'])
+
+            if branch and self.branch_exists(branch):
+                result = self._run_git(['branch', '-D', branch])
+                if result[0] != 0:
+                    return False, f"Failed to delete branch: {result[2]}"
+            return True, "Worktree removed"
+
+        except Exception as e:
+            return False, f"Error removing worktree: {str(e)}"
+
+    def merge_branch(self, branch: str, abort_on_conflict: bool = True) -> Tuple[bool, str, List[str]]:
+        """
+        Merge a branch into the checked out branch.
+
+        Args:
+            branch: Branch to merge
+            abort_on_conflict: Undo the merge on conflicts (otherwise the
+                conflict markers are left in the working tree to be resolved)
+
+        Returns:
+            Tuple of (success, message, conflicting files)
+        """
+        if not self.is_initialized():
+            return False, "Repository not initialized", []
+
+        try:
+            result = self._run_git(['merge', '--no-ff', '--no-edit', '-m', f"Merge {branch}", branch])
+            if result[0] == 0:
+                return True, f"Merged {branch}", []
+
+            conflict_result = self._run_git(['diff', '--name-only', '--diff-filter=U'])
+            conflicts = [f for f in conflict_result[1].strip().split('\n') if f] if conflict_result[0] == 0 else []
+
+            if abort_on_conflict:
+                self._run_git(['merge', '--abort'])
+
+            if conflicts:
+                return False, f"Merge conflicts in {len(conflicts)} file(s)", conflicts
+            # e.g. uncommitted local changes that the merge would overwrite
+            return False, f"Merge failed: {(result[2] or result[1]).strip()[:500]}", []
+
+        except Exception as e:
+            return False, f"Error merging: {str(e)}", []
+
+    # =========================================================================
+    # BACKUP CHECKPOINTS
+    # =========================================================================
+
+    def get_checkpoint(self) -> Optional[Dict]:
+        """
+        Describe the tree as HEAD plus its uncommitted changes, so a backup can
+        refer to the commit instead of copying the files it already has.
+
+        Returns:
+            {'commit', 'branch', 'tracked': [paths of HEAD unchanged in the
+            working tree], 'dirty': [paths of HEAD changed or deleted]}, or
+            None if there is no commit yet
+        """
+        if not self.is_initialized():
+            return None
+
+        head = self._run_git(['rev-parse', '--verify', '--quiet', 'HEAD'])
+        if head[0] != 0:
+            return None
+        commit = head[1].strip()
+
+        # Staged and unstaged changes against HEAD (renames as delete + add)
+        diff = self._run_git(['diff', '--no-renames', '--name-only', '-z', commit])
+        files = self._run_git(['ls-tree', '-r', '--name-only', '-z', commit])
+        if diff[0] != 0 or files[0] != 0:
+            return None
+        dirty = set(f for f in diff[1].split('\0') if f)
+        committed = [f for f in files[1].split('\0') if f]
+
+        return {
+            'commit': commit,
+            'branch': self.get_current_branch(),
+            'tracked': [f for f in committed if f not in dirty],
+            'dirty': sorted(f for f in committed if f in dirty),
+        }
+
+    def list_tracked_files(self) -> Optional[List[str]]:
+        """Paths in the index (None on error)."""
+        result = self._run_git(['ls-files', '-z'])
+        if result[0] != 0:
+            return None
+        return [f for f in result[1].split('\0') if f]
+
+    def pin_backup_ref(self, name: str, commit_hash: str) -> bool:
+        """Keep a checkpoint commit reachable while a backup refers to it."""
+        result = self._run_git(['update-ref', f"{BACKUP_REF_PREFIX}{name}", commit_hash])
+        return result[0] == 0
+
+    def prune_backup_refs(self, keep_names) -> int:
+        """Delete backup refs whose backups no longer exist. Returns the number deleted."""
+        result = self._run_git(['for-each-ref', '--format=%(refname)', BACKUP_REF_PREFIX])
+        if result[0] != 0:
+            return 0
+        deleted = 0
+        for ref in result[1].split():
+            if ref[len(BACKUP_REF_PREFIX):] not in keep_names:
+                if self._run_git(['update-ref', '-d', ref])[0] == 0:
+                    deleted += 1
+        return deleted
+
+    def restore_tracked_files(self, commit_hash: str) -> Tuple[bool, str]:
+        """
+        Make tracked files match a commit without moving HEAD (the restored
+        state shows up as uncommitted changes, like a rollback before its commit).
+
+        Returns:
+            Tuple of (success, message)
+        """
+        if not self.is_initialized():
+            return False, "Repository not initialized"
+
+        verify = self._run_git(['cat-file', '-t', commit_hash])
+        if verify[0] != 0:
+            return False, f"Commit {commit_hash} not found"
+
+        # Index and working tree to the commit's tree; files it lacks are removed
+        result = self._run_git(['read-tree', '-u', '--reset', commit_hash])
+        if result[0] != 0:
+            return False, f"Failed to restore files: {result[2]}"
+        return True, f"Restored tracked files from {commit_hash[:7]}"
+
+    def open_archive(self, commit_hash: str) -> subprocess.Popen:
+        """Start `git archive` for a commit; the caller reads the tar from stdout and waits."""
+        return subprocess.Popen(
+            ['git', '-C', self.repo_path, 'archive', '--format=tar', commit_hash],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    def _parse_porcelain(self, output: str) -> Dict[str, List[str]]:
+        """Split `git status --porcelain` output into modified/added/deleted/untracked/conflicted."""
+        changes = {'modified': [], 'added': [], 'deleted': [], 'untracked': [], 'conflicted': []}
+        for line in (output or '').strip().split('\n'):
+            if len(line) >= 3:
+                status = line[:2]
+                filepath = line[3:]
+                if status == '??':
+                    changes['untracked'].append(filepath)
+                elif 'U' in status or status in ('AA', 'DD'):
+                    changes['conflicted'].append(filepath)
+                elif 'M' in status:
+                    changes['modified'].append(filepath)
+                elif 'A' in status:
+                    changes['added'].append(filepath)
+                elif 'D' in status:
+                    changes['deleted'].append(filepath)
+        return changes
+
+    def _format_changes(self, changes: Dict) -> List[str]:
+        """Format uncommitted changes as prompt lines (max 10 per kind)."""
+        lines = ["Uncommitted changes:"]
+        for f in changes.get('conflicted', [])[:10]:
+            lines.append(f"  U {f} (merge conflict - resolve the markers)")
+        for f in changes.get('modified', [])[:10]:
+            lines.append(f"  M {f}")
+        for f in changes.get('added', [])[:10]:
+            lines.append(f"  A {f}")
+        for f in changes.get('deleted', [])[:10]:
+            lines.append(f"  D {f}")
+        for f in changes.get('untracked', [])[:10]:
+            lines.append(f"  ? {f}")
+        return lines
+
     def _run_git(self, args: List[str]) -> Tuple[int, str, str]:
         """
         Run a git command in the repository.
@@ -615,6 +960,8 @@ class GitManager:
         Returns:
             Tuple of (return_code, stdout, stderr)
         """
+        if args and args[0] not in READ_ONLY_COMMANDS and args[:2] != ['branch', '--show-current']:
+            invalidate_repo(self.repo_path)
         try:
             cmd = ['git', '-C', self.repo_path] + args
             result = subprocess.run(
@@ -629,6 +976,29 @@ class GitManager:
         except Exception as e:
             return 1, '', str(e)
 
+    def _run_git_cached(self, args: List[str]) -> Tuple[int, str, str]:
+        """
+        Run a read-only git command, reusing its last successful result while
+        the repository is watched and unchanged (see watch_repo).
+        """
+        key = os.path.abspath(self.repo_path)
+        with _query_cache_lock:
+            entry = _query_cache.get(key)
+            if entry is None:
+                entry = gen = None
+            else:
+                gen = entry['gen']
+                cached = entry['values'].get(tuple(args))
+                if cached is not None:
+                    return cached
+        result = self._run_git(args)
+        if entry is not None and result[0] == 0:
+            with _query_cache_lock:
+                # Not stored if the repository changed while git was running
+                if _query_cache.get(key) is entry and entry['gen'] == gen:
+                    entry['values'][tuple(args)] = result
+        return result
+
     def _format_duration(self, seconds: int) -> str:
         """Format duration in seconds to human readable string."""
         if seconds < 60:
@@ -7,6 +7,7 @@ Provides tools for Claude to manage projects and tickets via the CodeHero API.
 import json
 import sys
 import os
+import socket
 import mysql.connector
 from datetime import datetime
 from typing import Any, Dict, List, Optional
@@ -19,10 +20,25 @@ DB_CONFIG = {
     'database': 'claude_knowledge'
 }
 
+# Daemon wake-up socket (see CommandListener in claude-daemon.py)
+DAEMON_COMMAND_SOCKET = "/var/run/codehero/commands.sock"
+
 def get_db_connection():
     """Get a database connection."""
     return mysql.connector.connect(**DB_CONFIG)
 
+def notify_daemon(ticket_id: int):
+    """Tell the daemon a ticket was created or changed so it schedules it now (best effort)."""
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.sendto(json.dumps({'ticket_id': int(ticket_id)}).encode('utf-8'), DAEMON_COMMAND_SOCKET)
+        finally:
+            sock.close()
+    except Exception:
+        pass
+
 def log_error(msg: str):
     """Log error to stderr."""
     sys.stderr.write(f"[CodeHero MCP] ERROR: {msg}\n")
@@ -548,6 +564,8 @@ def handle_create_ticket(args: Dict[str, Any]) -> Dict[str, Any]:
             """, (ticket_id, description))
             conn.commit()
 
+        notify_daemon(ticket_id)
+
         result = {
             "success": True,
             "ticket_id": ticket_id,
@@ -607,6 +625,7 @@ def handle_update_ticket(args: Dict[str, Any]) -> Dict[str, Any]:
             cursor.execute("UPDATE tickets SET status = 'open', updated_at = NOW() WHERE id = %s", (ticket_id,))
 
         conn.commit()
+        notify_daemon(ticket_id)
 
         result = {
             "success": True,
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Path Filter - gitignore-style path matching for CodeHero project trees
+Shared by backups, exports, the project map and the editor file tree so they
+agree on what is part of a project and what is regenerable noise.
+
+A PathFilter compiles gitignore lines (negation with !, anchoring with a
+leading or inner /, directory-only with a trailing /, and *, **, ?, [...])
+into a matcher. Plain names and *.ext patterns are set lookups; the rest
+are joined into one regex per directory scope. Filters without negations
+answer with a single pass; with negations the last matching line wins, as
+in git.
+
+Which patterns apply depends on the purpose (see project_filter):
+- backup: regenerable paths of the project type/tech stack plus the
+  project's own backup_exclude lines (! re-includes). The project's
+  .gitignore only when backup_gitignore is set, since it usually also
+  lists things that cannot be regenerated (.env, uploads).
+- tree:   regenerable paths and .git (editor file tree).
+- stats:  like tree, plus every .gitignore in the project (project map).
+"""
+
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from git_manager import gitignore_patterns
+
+
+# Regenerable whatever the tech stack says
+REGENERABLE_ALWAYS = ['__pycache__/', 'node_modules/', 'venv/', '.venv/', '*.py[cod]']
+
+# Build output of project types that have no GITIGNORE_PATTERNS set of their own
+REGENERABLE_BY_TYPE = {
+    'native_android': ['.gradle/', 'build/', '.cxx/'],
+    'react_native': ['.gradle/', 'build/', 'Pods/'],
+    'capacitor': ['.gradle/', 'build/', 'Pods/'],
+}
+
+# Gitignored directories that are not regenerable (editor settings, logs)
+NOT_REGENERABLE = {'.idea/', '.vscode/', 'storage/logs/'}
+
+# File patterns from GITIGNORE_PATTERNS that are build output
+REGENERABLE_FILES = {'*.py[cod]', '*$py.class', '*.class'}
+
+PURPOSES = ('backup', 'tree', 'stats')
+
+_GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+
+def _translate(pattern: str) -> str:
+    """Translate one gitignore glob (without anchoring/negation) to a regex"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                if pattern.startswith('**/', i):
+                    out.append('(?:.*/)?')
+                    i += 3
+                else:
+                    out.append('.*')
+                    i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class _Rule:
+    """One compiled gitignore line, scoped to the directory it was read from"""
+
+    __slots__ = ('base', 'negate', 'dir_only', 'name', 'ext', 'regex')
+
+    def __init__(self, base: str, negate: bool, dir_only: bool, pattern: str, anchored: bool):
+        self.base = base
+        self.negate = negate
+        self.dir_only = dir_only
+        self.name = self.ext = self.regex = None
+        if not anchored and not _GLOB_CHARS.search(pattern):
+            self.name = pattern
+        elif not anchored and pattern.startswith('*.') and not _GLOB_CHARS.search(pattern[2:]):
+            self.ext = pattern[1:]
+        else:
+            self.regex = ('' if anchored else '(?:.*/)?') + _translate(pattern)
+
+    def matches(self, rel: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel.startswith(self.base + '/'):
+                return False
+            rel = rel[len(self.base) + 1:]
+        if self.name is not None:
+            return name == self.name
+        if self.ext is not None:
+            return name.endswith(self.ext)
+        return re.fullmatch(self.regex, rel) is not None
+
+
+def parse_line(line: str) -> Optional[Tuple[bool, bool, str, bool]]:
+    """Parse one gitignore line into (negate, dir_only, pattern, anchored), or None"""
+    line = line.rstrip('\n\r')
+    if not line.endswith('\\ '):
+        line = line.rstrip()
+    if not line or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith('\\'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    anchored = '/' in line
+    line = line.lstrip('/')
+    if not line:
+        return None
+    return negate, dir_only, line, anchored
+
+
+class PathFilter:
+    """Compiled set of gitignore-style exclude patterns.
+
+    Paths are relative to the directory the filter is used on, with '/'
+    separators. read_gitignore makes walk() also apply every .gitignore it
+    meets, scoped to its directory.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), read_gitignore: bool = False):
+        self.patterns = []
+        self.read_gitignore = read_gitignore
+        self._rules = []
+        self._compiled = None
+        self.add(patterns)
+
+    def add(self, lines: Iterable[str], base: str = '') -> 'PathFilter':
+        """Append gitignore lines; base scopes them to a subdirectory"""
+        for line in lines:
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            negate, dir_only, pattern, anchored = parsed
+            if not base:
+                self.patterns.append(line.strip())
+            self._rules.append(_Rule(base, negate, dir_only, pattern, anchored))
+        self._compiled = None
+        return self
+
+    def scoped(self, lines: Iterable[str], base: str) -> 'PathFilter':
+        """A copy with extra lines scoped to base (a nested .gitignore)"""
+        child = PathFilter(read_gitignore=self.read_gitignore)
+        child.patterns = list(self.patterns)
+        child._rules = list(self._rules)
+        return child.add(lines, base)
+
+    def spec(self) -> Dict:
+        """JSON-serializable description (stored in backup manifests)"""
+        return {'patterns': list(self.patterns), 'gitignore': self.read_gitignore}
+
+    @classmethod
+    def from_spec(cls, spec: Optional[Dict]) -> Optional['PathFilter']:
+        if not spec:
+            return None
+        return cls(spec.get('patterns', []), spec.get('gitignore', False))
+
+    def _compile(self):
+        """Group negation-free rules by scope into name/extension sets and one regex.
+        Built aside and assigned once, so threads sharing a filter never see it half done."""
+        if any(rule.negate for rule in self._rules):
+            self._compiled = False
+            return
+        scopes = {}
+        for rule in self._rules:
+            scope = scopes.setdefault(rule.base, {True: ([], set(), set()), False: ([], set(), set())})
+            for is_dir in ((True,) if rule.dir_only else (True, False)):
+                regexes, names, exts = scope[is_dir]
+                if rule.name is not None:
+                    names.add(rule.name)
+                elif rule.ext is not None:
+                    exts.add(rule.ext)
+                else:
+                    regexes.append(rule.regex)
+        compiled = []
+        for base, scope in scopes.items():
+            kinds = {}
+            for is_dir, (regexes, names, exts) in scope.items():
+                regex = re.compile('|'.join(f'(?:{r})' for r in regexes)) if regexes else None
+                kinds[is_dir] = (names, tuple(exts), regex)
+            compiled.append((base + '/' if base else '', kinds))
+        self._compiled = compiled
+
+    def match(self, rel: str, is_dir: bool = False) -> bool:
+        """Whether this exact path is excluded (parents are not checked; see excluded)"""
+        if self._compiled is None:
+            self._compile()
+        name = rel.rpartition('/')[2]
+        if self._compiled is False:
+            for rule in reversed(self._rules):
+                if rule.matches(rel, name, is_dir):
+                    return not rule.negate
+            return False
+        for prefix, kinds in self._compiled:
+            sub = rel
+            if prefix:
+                if not rel.startswith(prefix):
+                    continue
+                sub = rel[len(prefix):]
+            names, exts, regex = kinds[is_dir]
+            if name in names or (exts and name.endswith(exts)) \
+                    or (regex is not None and regex.fullmatch(sub)):
+                return True
+        return False
+
+    def excluded(self, rel: str, is_dir: bool = False) -> bool:
+        """Whether a path is excluded by itself or through one of its parent directories"""
+        parts = rel.split('/')
+        for i in range(1, len(parts)):
+            if self.match('/'.join(parts[:i]), True):
+                return True
+        return self.match(rel, is_dir)
+
+    def enter(self, dirpath: str, rel_dir: str, filenames: Iterable[str]) -> 'PathFilter':
+        """The filter for the entries of a directory: with read_gitignore,
+        its .gitignore (if filenames has one) is added, scoped to rel_dir"""
+        if self.read_gitignore and '.gitignore' in filenames:
+            lines = read_ignore_file(os.path.join(dirpath, '.gitignore'))
+            if lines:
+                return self.scoped(lines, rel_dir)
+        return self
+
+    def walk(self, root: str) -> Iterator[Tuple[str, str, List[str], List[str]]]:
+        """os.walk over root without excluded paths.
+
+        Yields (dirpath, rel_dir, dirnames, filenames); rel_dir is '' for root.
+        Excluded directories are not entered. dirnames can be pruned further
+        in place, as with os.walk. Symlinked directories are listed in
+        dirnames but not entered.
+        """
+        scopes = {'': self}
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root)
+            rel_dir = '' if rel_dir == '.' else rel_dir
+            filt = scopes.pop(rel_dir, self).enter(dirpath, rel_dir, filenames)
+            prefix = rel_dir + '/' if rel_dir else ''
+            dirnames[:] = [d for d in dirnames if not filt.match(prefix + d, True)]
+            filenames[:] = [f for f in filenames if not filt.match(prefix + f, False)]
+            for d in dirnames:
+                scopes[prefix + d] = filt
+            yield dirpath, rel_dir, dirnames, filenames
+
+
+def read_ignore_file(path: str) -> List[str]:
+    """Lines of an ignore file ([] if missing or unreadable)"""
+    try:
+        with open(path, 'r', errors='ignore') as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def regenerable_patterns(project_type: str = '', tech_stack: str = '') -> List[str]:
+    """Paths that a build or package install recreates, for this project type and tech stack"""
+    patterns = list(REGENERABLE_ALWAYS)
+    for line in gitignore_patterns(project_type or '', tech_stack or ''):
+        if (line.endswith('/') and line not in NOT_REGENERABLE) or line in REGENERABLE_FILES:
+            if line not in patterns:
+                patterns.append(line)
+    for line in REGENERABLE_BY_TYPE.get(project_type, []):
+        if line not in patterns:
+            patterns.append(line)
+    return patterns
+
+
+def project_filter(project: Dict, purpose: str = 'backup') -> PathFilter:
+    """Build the filter for a project row (needs project_type, tech_stack and,
+    for backups, backup_exclude / backup_gitignore)."""
+    if purpose not in PURPOSES:
+        raise ValueError(f"Unknown path filter purpose: {purpose}")
+    patterns = regenerable_patterns(project.get('project_type'), project.get('tech_stack'))
+    if purpose == 'backup':
+        patterns += (project.get('backup_exclude') or '').splitlines()
+        return PathFilter(patterns, read_gitignore=bool(project.get('backup_gitignore')))
+    return PathFilter(['.git/'] + patterns, read_gitignore=(purpose == 'stats'))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Project Analyzer - One-pass scan of a project folder for the project map
+Replaces the separate `tree -L 3`, stats and language walks of map
+generation with a single parallel scan that collects, per project:
+- structure summary (tree-style, directories to SUMMARY_DEPTH with file counts),
+- file count and total size,
+- language histogram (see file_index.LANGUAGES),
+- entry point candidates at any depth (app.py, main.go, index.php, ...),
+- key files (manifests, build and container files, docs).
+
+Directories are listed through the shared file index (os.scandir underneath),
+sibling directories in parallel on a thread pool, and skipped without being
+entered when the path filter excludes them. A scan stops at ANALYZE_MAX_FILES
+files or ANALYZE_TIME_BUDGET seconds; the result is then marked truncated and
+counts are lower bounds. With a change watcher on the project, listings come
+from memory and a rescan costs little more than the tree rendering.
+"""
+
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
+
+from file_index import FileEntry, FileIndex, get_file_index
+from path_filter import PathFilter
+
+
+ANALYZE_WORKERS = 8             # Directories listed in parallel
+ANALYZE_MAX_FILES = 50000       # Stop scanning after this many files...
+ANALYZE_TIME_BUDGET = 5.0       # ...or after this many seconds
+
+SUMMARY_DEPTH = 3               # Directory levels shown in the structure summary
+SUMMARY_FILES_PER_DIR = 12      # Files listed per directory before "... N more files"
+SUMMARY_MAX_CHARS = 5000
+MAX_ENTRY_POINTS = 20
+MAX_KEY_FILES = 30
+
+# File name -> what it starts (matched at any depth, shallowest first)
+ENTRY_POINTS = {
+    'app.py': 'Application', 'main.py': 'Entry point', 'server.py': 'Server',
+    'manage.py': 'Django management', 'wsgi.py': 'WSGI entry', 'asgi.py': 'ASGI entry',
+    '__main__.py': 'Package entry', 'index.js': 'Entry point', 'index.ts': 'Entry point',
+    'main.js': 'Entry point', 'main.ts': 'Entry point', 'server.js': 'Server',
+    'server.ts': 'Server', 'app.js': 'Application', 'index.php': 'Web entry',
+    'artisan': 'Laravel console', 'main.go': 'Go main', 'main.rs': 'Rust main',
+    'Program.cs': '.NET entry', 'main.dart': 'Flutter/Dart entry',
+    'MainActivity.kt': 'Android activity', 'MainActivity.java': 'Android activity',
+    'App.tsx': 'App component', 'App.jsx': 'App component', 'App.vue': 'App component',
+}
+
+# File name -> purpose, for files worth reading first
+KEY_FILES = {
+    'README.md': 'Documentation', 'package.json': 'Node dependencies and scripts',
+    'requirements.txt': 'Python dependencies', 'pyproject.toml': 'Python project config',
+    'setup.py': 'Python package', 'composer.json': 'PHP dependencies',
+    'go.mod': 'Go module', 'Cargo.toml': 'Rust crate', 'pubspec.yaml': 'Dart/Flutter dependencies',
+    'build.gradle': 'Gradle build', 'build.gradle.kts': 'Gradle build',
+    'settings.gradle': 'Gradle settings', 'settings.gradle.kts': 'Gradle settings',
+    'AndroidManifest.xml': 'Android manifest', 'capacitor.config.json': 'Capacitor config',
+    'capacitor.config.ts': 'Capacitor config', 'tsconfig.json': 'TypeScript config',
+    'vite.config.js': 'Vite config', 'vite.config.ts': 'Vite config',
+    'webpack.config.js': 'Webpack config', 'next.config.js': 'Next.js config',
+    'Dockerfile': 'Container image', 'docker-compose.yml': 'Container services',
+    'docker-compose.yaml': 'Container services', 'Makefile': 'Build tasks',
+    '.env.example': 'Environment template', 'schema.sql': 'Database schema',
+}
+KEY_FILE_EXTENSIONS = {'.csproj': '.NET project', '.sln': '.NET solution'}
+
+
+class ProjectAnalysis:
+    """Result of analyze_project()"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.file_count = 0
+        self.total_size = 0                     # Bytes
+        self.languages = Counter()
+        self.entry_points: List[Dict] = []      # [{'file', 'purpose'}], shallowest first
+        self.key_files: List[Dict] = []
+        self.structure_summary = ''
+        self.truncated = False                  # Stopped by the file or time budget
+        self.elapsed = 0.0
+        self.dirs: Dict[str, tuple] = {}        # rel_dir -> (dirs, files) of scanned directories
+
+    @property
+    def primary_language(self) -> str:
+        return self.languages.most_common(1)[0][0] if self.languages else 'unknown'
+
+
+def analyze_project(root: str, path_filter: PathFilter = None, index: FileIndex = None,
+                    max_files: int = ANALYZE_MAX_FILES,
+                    time_budget: float = ANALYZE_TIME_BUDGET) -> ProjectAnalysis:
+    """Scan a project folder once (see module docstring)"""
+    analysis = ProjectAnalysis(root)
+    index = index or get_file_index(root)
+    started = time.monotonic()
+    deadline = started + time_budget
+
+    def scan(rel_dir: str, filt: Optional[PathFilter]):
+        visible, filt = index.visible(rel_dir, filt, True)
+        return rel_dir, visible, filt
+
+    with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS, thread_name_prefix='analyzer') as pool:
+        pending = {pool.submit(scan, '', path_filter)}
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if analysis.file_count >= max_files or time.monotonic() >= deadline:
+                analysis.truncated = True
+                break
+            for future in done:
+                rel_dir, visible, filt = future.result()
+                if visible is None:
+                    continue
+                dirs = [e for e in visible if e.is_dir]
+                files = [e for e in visible if not e.is_dir]
+                analysis.dirs[rel_dir] = (dirs, files)
+                _collect(analysis, rel_dir, files)
+                prefix = rel_dir + '/' if rel_dir else ''
+                for entry in dirs:
+                    if not entry.is_link:
+                        pending.add(pool.submit(scan, prefix + entry.name, filt))
+        for future in pending:
+            future.cancel()
+
+    analysis.entry_points.sort(key=lambda e: (e['file'].count('/'), e['file']))
+    del analysis.entry_points[MAX_ENTRY_POINTS:]
+    analysis.key_files.sort(key=lambda e: (e['file'].count('/'), e['file']))
+    del analysis.key_files[MAX_KEY_FILES:]
+    analysis.structure_summary = render_structure(analysis)
+    analysis.elapsed = time.monotonic() - started
+    return analysis
+
+
+def _collect(analysis: ProjectAnalysis, rel_dir: str, files: List[FileEntry]):
+    """Add one directory's files to the counts (called on the scanning thread only)"""
+    prefix = rel_dir + '/' if rel_dir else ''
+    analysis.file_count += len(files)
+    for entry in files:
+        analysis.total_size += entry.size
+        language = entry.language
+        if language:
+            analysis.languages[language] += 1
+        if entry.name in ENTRY_POINTS:
+            analysis.entry_points.append({'file': prefix + entry.name, 'purpose': ENTRY_POINTS[entry.name]})
+        purpose = KEY_FILES.get(entry.name) or KEY_FILE_EXTENSIONS.get(os.path.splitext(entry.name)[1])
+        if purpose:
+            analysis.key_files.append({'file': prefix + entry.name, 'purpose': purpose})
+
+
+def render_structure(analysis: ProjectAnalysis) -> str:
+    """Tree-style outline: directories to SUMMARY_DEPTH levels with the number of
+    files below them, and up to SUMMARY_FILES_PER_DIR files per directory"""
+    totals = {}
+    for rel_dir in sorted(analysis.dirs, key=lambda d: -d.count('/') if d else 1):
+        dirs, files = analysis.dirs[rel_dir]
+        prefix = rel_dir + '/' if rel_dir else ''
+        totals[rel_dir] = len(files) + sum(totals.get(prefix + d.name, 0) for d in dirs)
+
+    lines = [os.path.basename(analysis.root.rstrip('/')) + '/']
+    size = len(lines[0])
+
+    def render(rel_dir: str, indent: str, depth: int) -> bool:
+        nonlocal size
+        dirs, files = analysis.dirs[rel_dir]
+        prefix = rel_dir + '/' if rel_dir else ''
+        rows = [(d, True) for d in dirs] + [(f, False) for f in files[:SUMMARY_FILES_PER_DIR]]
+        hidden_files = len(files) - SUMMARY_FILES_PER_DIR
+        for i, (entry, is_dir) in enumerate(rows):
+            last = i == len(rows) - 1 and hidden_files <= 0
+            rel = prefix + entry.name
+            if not is_dir:
+                label = entry.name
+            elif entry.is_link:
+                label = f"{entry.name}/ (link)"
+            elif rel in totals:
+                label = f"{entry.name}/ ({totals[rel]} files)"
+            else:
+                label = f"{entry.name}/ (not scanned)"
+            line = indent + ('└── ' if last else '├── ') + label
+            size += len(line) + 1
+            if size > SUMMARY_MAX_CHARS:
+                return False
+            lines.append(line)
+            if is_dir and rel in analysis.dirs and depth < SUMMARY_DEPTH:
+                if not render(rel, indent + ('    ' if last else '│   '), depth + 1):
+                    return False
+        if hidden_files > 0:
+            lines.append(f"{indent}└── ... {hidden_files} more file{'s' if hidden_files > 1 else ''}")
+            size += len(lines[-1]) + 1
+        return True
+
+    if '' in analysis.dirs and not render('', '', 1):
+        lines.append('... (truncated)')
+    if analysis.truncated:
+        lines.append(f"... (scan stopped after {analysis.file_count} files)")
+    return '\n'.join(lines)
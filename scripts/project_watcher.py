@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Project Watcher - Change notifications for CodeHero project folders
+Runs in the daemon and in the web app, so caches there can be kept until a
+file actually changes instead of expiring on a timer.
+
+Each active project's web_path and app_path is watched with Linux inotify
+(one watch per directory, skipping .git/ and regenerable folders such as
+node_modules/; .git itself is watched for HEAD/index changes only). Roots
+where inotify is unavailable, or where the watch limit is reached, are
+polled every WATCH_POLL_INTERVAL seconds instead.
+
+Changes are debounced per root and published to subscribers as dicts:
+    {'type': 'change', 'project_id', 'root', 'paths', 'structural', 'git'}
+paths are relative to root (None when unknown, e.g. after an inotify queue
+overflow); structural is True if anything was created, deleted or moved;
+git is True if the repository state (HEAD, index) changed. 'watch' and
+'unwatch' events mark when a root starts and stops being watched; 'watch'
+carries the filter of the directories covered by inotify (None for a polled
+root).
+
+The watcher itself keeps the shared caches correct (file index and git
+query cache, see invalidate_shared_caches); callers subscribe for their own.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from file_index import get_file_index
+from git_manager import invalidate_repo, watch_repo
+from path_filter import PathFilter, project_filter
+
+
+WATCH_DEBOUNCE = 0.5            # Seconds of quiet before a root's changes are published
+WATCH_DEBOUNCE_MAX = 3.0        # ...but publish at least this often during a burst
+WATCH_POLL_INTERVAL = 15        # Seconds between scans of polled roots
+WATCH_SYNC_INTERVAL = 60        # Seconds between re-reading the list of active projects
+WATCH_MAX_DIRS = 20000          # Directories per root before falling back to polling
+
+# Files in .git whose change means the repository state changed
+GIT_STATE_FILES = {'HEAD', 'index', 'packed-refs', 'ORIG_HEAD', 'MERGE_HEAD'}
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+STRUCTURAL_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+
+class _WatchLimit(Exception):
+    """A root needs more inotify watches than it may have"""
+
+
+class Inotify:
+    """Minimal inotify binding over libc (no third-party package needed)"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[tuple]:
+        """Pending events as (wd, mask, name); [] if there are none"""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Root:
+    """One watched folder and its not yet published changes"""
+
+    def __init__(self, project_id: int, path: str, path_filter: PathFilter):
+        self.project_id = project_id
+        self.path = path
+        self.path_filter = path_filter
+        self.wds: Dict[str, int] = {}       # rel_dir -> inotify watch
+        self.polling = False
+        self.poll_state = None
+        self.polled_at = 0
+        self.reset()
+
+    def reset(self):
+        self.paths = set()
+        self.everything = False
+        self.structural = False
+        self.git = False
+        self.first_at = self.last_at = None
+
+    def mark(self, rel: Optional[str], structural: bool = False, git: bool = False):
+        now = time.monotonic()
+        if rel is None:
+            self.everything = True
+        else:
+            self.paths.add(rel)
+        self.structural = self.structural or structural
+        self.git = self.git or git
+        self.first_at = self.first_at or now
+        self.last_at = now
+
+    def take(self) -> Dict:
+        event = {'type': 'change', 'project_id': self.project_id, 'root': self.path,
+                 'paths': None if self.everything else sorted(self.paths),
+                 'structural': self.structural or self.everything, 'git': self.git or self.everything}
+        self.reset()
+        return event
+
+
+def invalidate_shared_caches(event: Dict):
+    """Keep this process's file index and git query cache in step with a watcher event"""
+    index = get_file_index(event['root'])
+    if event['type'] == 'change':
+        index.invalidate(event['paths'])
+        invalidate_repo(event['root'])
+        return
+    watching = event['type'] == 'watch'
+    index.watched = event.get('path_filter') if watching else None
+    index.invalidate()
+    watch_repo(event['root'], watching)
+
+
+class ProjectWatcher(threading.Thread):
+    """Watches the folders of active projects and publishes debounced changes.
+
+    load_projects() returns the project rows to watch (id, web_path,
+    app_path, project_type, tech_stack); it is called every
+    WATCH_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, load_projects: Callable[[], List[Dict]], log: Callable = None):
+        super().__init__(daemon=True, name='project-watcher')
+        self.load_projects = load_projects
+        self.log_func = log
+        self.running = True
+        self.wake_r, self.wake_w = os.pipe()     # stop() wakes the select() below
+        self.lock = threading.Lock()
+        self.subscribers: List[Callable[[Dict], None]] = [invalidate_shared_caches]
+        self.roots: Dict[str, _Root] = {}
+        self.wd_map: Dict[int, tuple] = {}  # wd -> (root, rel_dir)
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            self.inotify = None
+            self.log(f"inotify unavailable ({e}), polling project folders instead", "WARNING")
+
+    def log(self, message, level="INFO"):
+        if self.log_func:
+            self.log_func(f"[Watcher] {message}", level)
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        self.subscribers.append(callback)
+
+    def is_watching(self, project_id: int) -> bool:
+        with self.lock:
+            return any(root.project_id == project_id for root in self.roots.values())
+
+    def stop(self):
+        self.running = False
+        try:
+            os.write(self.wake_w, b'x')
+        except OSError:
+            pass
+
+    # ---------- roots ----------
+
+    def sync(self, projects: List[Dict]):
+        """Watch exactly the folders of these projects"""
+        desired = {}
+        for project in projects:
+            for key in ('web_path', 'app_path'):
+                path = project.get(key)
+                if path and os.path.isdir(path):
+                    desired.setdefault(os.path.abspath(path), project)
+        with self.lock:
+            current = set(self.roots)
+        for path in current - set(desired):
+            self._remove_root(path)
+        for path in set(desired) - current:
+            project = desired[path]
+            self._add_root(_Root(project['id'], path, project_filter(project, 'tree')))
+
+    def _add_root(self, root: _Root):
+        with self.lock:
+            self.roots[root.path] = root
+        if self.inotify:
+            try:
+                self._watch_tree(root, '')
+                if os.path.isdir(os.path.join(root.path, '.git')):
+                    self._add_watch(root, '.git')
+            except _WatchLimit:
+                self._start_polling(root)
+        else:
+            self._start_polling(root)
+        self._publish_watch(root)
+
+    def _remove_root(self, path: str):
+        with self.lock:
+            root = self.roots.pop(path, None)
+        if root is None:
+            return
+        self._unwatch(root, '')
+        self.publish({'type': 'unwatch', 'project_id': root.project_id, 'root': root.path})
+
+    def _start_polling(self, root: _Root):
+        self._unwatch(root, '')
+        root.polling = True
+        root.poll_state = self._poll_state(root)
+        root.polled_at = time.monotonic()
+        self.log(f"Polling {root.path} (inotify unavailable or watch limit reached)")
+
+    def _publish_watch(self, root: _Root):
+        # Polled roots only notice changes every WATCH_POLL_INTERVAL: no listing is trusted
+        self.publish({'type': 'watch', 'project_id': root.project_id, 'root': root.path,
+                      'path_filter': None if root.polling else root.path_filter})
+
+    # ---------- inotify ----------
+
+    def _add_watch(self, root: _Root, rel_dir: str):
+        if len(root.wds) >= WATCH_MAX_DIRS:
+            raise _WatchLimit()
+        try:
+            wd = self.inotify.add_watch(os.path.join(root.path, rel_dir) if rel_dir else root.path, WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise _WatchLimit()
+            return      # Vanished or unreadable
+        root.wds[rel_dir] = wd
+        self.wd_map[wd] = (root, rel_dir)
+
+    def _watch_tree(self, root: _Root, rel_dir: str):
+        """Watch rel_dir and every directory below it that the root's filter keeps"""
+        top = os.path.join(root.path, rel_dir) if rel_dir else root.path
+        for dirpath, dirnames, _ in os.walk(top):
+            rel = os.path.relpath(dirpath, root.path)
+            rel = '' if rel == '.' else rel
+            prefix = rel + '/' if rel else ''
+            dirnames[:] = [d for d in dirnames if not root.path_filter.match(prefix + d, True)]
+            self._add_watch(root, rel)
+
+    def _unwatch(self, root: _Root, rel_dir: str):
+        """Remove the watches of rel_dir and below ('' for the whole root)"""
+        prefix = rel_dir + '/' if rel_dir else ''
+        for rel in [r for r in root.wds if not rel_dir or r == rel_dir or r.startswith(prefix)]:
+            wd = root.wds.pop(rel)
+            self.wd_map.pop(wd, None)
+            if self.inotify:
+                self.inotify.rm_watch(wd)
+
+    def _handle_events(self):
+        for wd, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: everything may have changed
+                for root in list(self.roots.values()):
+                    root.mark(None)
+                continue
+            entry = self.wd_map.get(wd)
+            if entry is None:
+                continue
+            root, rel_dir = entry
+            if mask & IN_IGNORED:
+                # Watch removed by the kernel (directory deleted)
+                self.wd_map.pop(wd, None)
+                if root.wds.get(rel_dir) == wd:
+                    del root.wds[rel_dir]
+                continue
+
+            if rel_dir == '.git':
+                if name in GIT_STATE_FILES:
+                    root.mark('.git/' + name, git=True)
+                continue
+
+            rel = f"{rel_dir}/{name}" if rel_dir and name else (name or rel_dir)
+            is_dir = bool(mask & IN_ISDIR)
+            if name and root.path_filter.match(rel, is_dir):
+                # Regenerable noise (*.pyc, a new node_modules/, ...): not published,
+                # but the listing of its directory is stale
+                get_file_index(root.path).invalidate([rel])
+                continue
+            if is_dir and mask & IN_MOVED_FROM:
+                self._unwatch(root, rel)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO) and not root.polling:
+                try:
+                    self._watch_tree(root, rel)
+                except _WatchLimit:
+                    self._start_polling(root)
+                    self._publish_watch(root)
+            root.mark(rel, structural=bool(mask & STRUCTURAL_MASK))
+
+    # ---------- polling ----------
+
+    def _poll_state(self, root: _Root) -> Dict[str, tuple]:
+        state = {}
+        for dirpath, rel_dir, dirnames, filenames in root.path_filter.walk(root.path):
+            prefix = rel_dir + '/' if rel_dir else ''
+            for name in dirnames:
+                state[prefix + name + '/'] = None
+            for name in filenames:
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                    state[prefix + name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+        for name in GIT_STATE_FILES:
+            try:
+                state['.git/' + name] = os.stat(os.path.join(root.path, '.git', name)).st_mtime_ns
+            except OSError:
+                pass
+        return state
+
+    def _poll(self, root: _Root):
+        state = self._poll_state(root)
+        previous, root.poll_state = root.poll_state, state
+        root.polled_at = time.monotonic()
+        if previous is None:
+            return
+        structural = state.keys() != previous.keys()
+        for key in state.keys() | previous.keys():
+            if key not in state or key not in previous or state[key] != previous[key]:
+                root.mark(key.rstrip('/'), structural=structural, git=key.startswith('.git/'))
+
+    # ---------- loop ----------
+
+    def publish(self, event: Dict):
+        for callback in list(self.subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                self.log(f"Subscriber error: {e}", "ERROR")
+
+    def run(self):
+        next_sync = 0
+        while self.running:
+            try:
+                now = time.monotonic()
+                if now >= next_sync:
+                    self.sync(self.load_projects())
+                    next_sync = now + WATCH_SYNC_INTERVAL
+
+                roots = list(self.roots.values())
+                timeout = min(next_sync - now, WATCH_POLL_INTERVAL)
+                if any(root.first_at for root in roots):
+                    timeout = min(timeout, WATCH_DEBOUNCE)
+                fds = [self.wake_r] + ([self.inotify.fd] if self.inotify and self.wd_map else [])
+                ready, _, _ = select.select(fds, [], [], max(0.0, timeout))
+                if self.inotify and self.inotify.fd in ready:
+                    self._handle_events()
+
+                now = time.monotonic()
+                for root in roots:
+                    if root.polling and now - root.polled_at >= WATCH_POLL_INTERVAL:
+                        self._poll(root)
+                    if root.first_at and (now - root.last_at >= WATCH_DEBOUNCE
+                                          or now - root.first_at >= WATCH_DEBOUNCE_MAX):
+                        self.publish(root.take())
+            except Exception as e:
+                self.log(f"Error: {e}", "ERROR")
+                select.select([self.wake_r], [], [], WATCH_POLL_INTERVAL)
+
+        for path in list(self.roots):
+            self._remove_root(path)
+        if self.inotify:
+            self.inotify.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
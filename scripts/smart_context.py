@@ -7,15 +7,54 @@ Handles: Project Maps, Project Knowledge, Conversation Extractions
 import os
 import json
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 
+from token_counter import count_tokens
+from path_filter import PathFilter, project_filter
+from project_analyzer import analyze_project
+from code_index import get_code_index
+
 # Token thresholds
 MAX_TOTAL_TOKENS = 100000       # Max tokens for conversation history
 RECENT_TOKENS_BUDGET = 50000    # Budget for recent messages (full verbatim)
 EXTRACTION_THRESHOLD = 50000    # When to trigger extraction
 MAX_SINGLE_MESSAGE = 10000      # Truncate messages larger than this
-PROJECT_MAP_EXPIRY_DAYS = 7     # Refresh project map after this
+PROJECT_MAP_EXPIRY_DAYS = 7     # Refresh project map after this (unless a watcher keeps it current)
+PROJECT_MAP_MIN_AGE_MINUTES = 15    # A changed project's map is regenerated at most this often
+PROJECT_OUTLINE_TOKENS = 3000       # Code outline (ranked files and symbols) in the project map
+CODE_INDEX_MAX_PATHS = 200          # Larger change batches wait for the next map generation
+
+# Background extraction
+EXTRACTION_SOFT_THRESHOLD = 35000   # Start summarizing older messages in the background
+EXTRACTION_KEEP_RECENT = 15000      # ...keeping this many recent tokens unsummarized
+EXTRACTION_WORKERS = 2              # Concurrent Haiku extractions
+EXTRACTION_WAIT_TIMEOUT = 45        # Max wait for a job when over EXTRACTION_THRESHOLD
+
+# Hierarchical extractions: level-0 chunks are merged into level-1, level-1 into level-2
+EXTRACTION_CHUNK_TOKENS = 12000     # Messages per level-0 extraction
+EXTRACTION_MERGE_FANOUT = 4         # Merge this many same-level extractions into one
+EXTRACTION_MAX_LEVEL = 2            # Top level (merges into itself)
+EXTRACTION_JSON_FIELDS = ['decisions', 'problems_solved', 'files_modified',
+                          'blocking_issues', 'waiting_for_user', 'external_dependencies',
+                          'key_code_snippets', 'important_variables', 'tests_status',
+                          'error_patterns', 'important_notes']
+
+
+class ContextSnapshot:
+    """Conversation state for one prompt build, loaded once and shared by the
+    system-context builder and the history renderer"""
+
+    def __init__(self, ticket_id: int, history: List[Dict] = None,
+                 extraction: Optional[Dict] = None, extraction_context: str = "",
+                 total_tokens: int = 0):
+        self.ticket_id = ticket_id
+        self.history = history or []                # Unsummarized messages to send verbatim
+        self.extraction = extraction                # Active extractions combined (get_combined_extraction)
+        self.extraction_context = extraction_context
+        self.total_tokens = total_tokens            # Unsummarized tokens before selection
 
 
 class SmartContextManager:
@@ -24,6 +63,12 @@ class SmartContextManager:
     def __init__(self, db_pool, logger=None):
         self.db_pool = db_pool
         self.logger = logger or (lambda msg, level="INFO": print(f"[{level}] {msg}"))
+        # Background extraction jobs (pool created on first use), one per ticket at a time
+        self.extraction_pool = None
+        self.extraction_jobs = {}
+        self.extraction_lock = threading.Lock()
+        # ProjectWatcher reporting file changes (set by the daemon), see invalidate_project_map
+        self.watcher = None
 
     def get_db(self):
         return self.db_pool.get_connection()
@@ -33,10 +78,8 @@ class SmartContextManager:
             self.logger(message, level)
 
     def count_tokens(self, text: str) -> int:
-        """Estimate token count (4 chars ≈ 1 token for English/code)"""
-        if not text:
-            return 0
-        return len(text) // 4
+        """Estimate token count (see token_counter)"""
+        return count_tokens(text)
 
     def truncate_message(self, content: str, max_tokens: int = MAX_SINGLE_MESSAGE) -> str:
         """Truncate message if too large, keeping start and end"""
@@ -48,7 +91,8 @@ class SmartContextManager:
             return content
 
         # Keep first 40% and last 40%, insert truncation notice
-        char_limit = max_tokens * 4
+        # (chars per token measured on this content, so non-English text isn't over-kept)
+        char_limit = int(max_tokens * len(content) / tokens)
         first_part = content[:int(char_limit * 0.4)]
         last_part = content[-int(char_limit * 0.4):]
 
@@ -149,32 +193,41 @@ class SmartContextManager:
             return None
 
         try:
-            # Gather project information
-            tree_output = self._get_tree_output(project_path)
-            readme_content = self._read_file_if_exists(os.path.join(project_path, 'README.md'))
+            # One scan for structure, counts, languages, entry points and key files
+            # (.gitignore'd and regenerable paths left out, capped by file count and time)
+            analysis = analyze_project(project_path, self._get_path_filter(project_id))
+            if analysis.truncated:
+                self.log(f"Project scan stopped after {analysis.file_count} files "
+                         f"({analysis.elapsed:.1f}s), map is partial", "WARNING")
             requirements = self._read_file_if_exists(os.path.join(project_path, 'requirements.txt'))
             package_json = self._read_file_if_exists(os.path.join(project_path, 'package.json'))
+            file_count, total_size = analysis.file_count, analysis.total_size // 1024
+            primary_language = analysis.primary_language
 
-            # Count files and size
-            file_count, total_size = self._get_project_stats(project_path)
-
-            # Detect primary language
-            primary_language = self._detect_language(project_path)
+            # Symbol outline from the persistent code index (only changed files are parsed)
+            code_index = get_code_index(project_path)
+            code_index.update(analysis)
+            code_index.save()
+            code_outline = code_index.outline(PROJECT_OUTLINE_TOKENS,
+                                              [e['file'] for e in analysis.entry_points])
 
             # Build simple map without Claude (for now)
             # TODO: Use claude_func to generate intelligent summary
             map_data = {
-                'structure_summary': tree_output[:5000] if tree_output else '',
-                'entry_points': json.dumps(self._detect_entry_points(project_path)),
-                'key_files': json.dumps([]),
+                'structure_summary': analysis.structure_summary,
+                'entry_points': json.dumps(analysis.entry_points),
+                'key_files': json.dumps(analysis.key_files),
                 'tech_stack': json.dumps(self._detect_tech_stack(requirements, package_json)),
                 'dependencies': json.dumps({'raw': requirements[:2000]}) if requirements else None,
-                'architecture_type': None,
-                'design_patterns': json.dumps([]),
+                'architecture_type': code_index.architecture_type(),
+                'design_patterns': json.dumps(code_index.design_patterns()),
+                'code_outline': code_outline,
                 'file_count': file_count,
                 'total_size_kb': total_size,
                 'primary_language': primary_language,
-                'expires_at': datetime.now() + timedelta(days=PROJECT_MAP_EXPIRY_DAYS)
+                # Watched projects keep their map until the watcher reports a change
+                'expires_at': None if self.watcher and self.watcher.is_watching(project_id)
+                else datetime.now() + timedelta(days=PROJECT_MAP_EXPIRY_DAYS)
             }
 
             # Save to database
@@ -184,15 +237,18 @@ class SmartContextManager:
             cursor.execute("""
                 INSERT INTO project_maps
                 (project_id, structure_summary, entry_points, key_files, tech_stack,
-                 dependencies, architecture_type, design_patterns, file_count,
+                 dependencies, architecture_type, design_patterns, code_outline, file_count,
                  total_size_kb, primary_language, generated_at, expires_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
                 ON DUPLICATE KEY UPDATE
                 structure_summary = VALUES(structure_summary),
                 entry_points = VALUES(entry_points),
                 key_files = VALUES(key_files),
                 tech_stack = VALUES(tech_stack),
                 dependencies = VALUES(dependencies),
+                architecture_type = VALUES(architecture_type),
+                design_patterns = VALUES(design_patterns),
+                code_outline = VALUES(code_outline),
                 file_count = VALUES(file_count),
                 total_size_kb = VALUES(total_size_kb),
                 primary_language = VALUES(primary_language),
@@ -202,7 +258,7 @@ class SmartContextManager:
                 project_id, map_data['structure_summary'], map_data['entry_points'],
                 map_data['key_files'], map_data['tech_stack'], map_data['dependencies'],
                 map_data['architecture_type'], map_data['design_patterns'],
-                map_data['file_count'], map_data['total_size_kb'],
+                map_data['code_outline'], map_data['file_count'], map_data['total_size_kb'],
                 map_data['primary_language'], map_data['expires_at']
             ))
 
@@ -222,6 +278,41 @@ class SmartContextManager:
             self.log(f"Error generating project map: {e}", "ERROR")
             return None
 
+    def invalidate_project_map(self, project_id: int):
+        """Mark a project's map stale after files were added, removed or moved.
+        It expires PROJECT_MAP_MIN_AGE_MINUTES after it was generated at the
+        earliest, so a ticket creating files does not change its prompt every turn."""
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE project_maps
+                SET expires_at = GREATEST(NOW(), generated_at + INTERVAL %s MINUTE)
+                WHERE project_id = %s
+                AND (expires_at IS NULL OR expires_at > GREATEST(NOW(), generated_at + INTERVAL %s MINUTE))
+            """, (PROJECT_MAP_MIN_AGE_MINUTES, project_id, PROJECT_MAP_MIN_AGE_MINUTES))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.log(f"Error invalidating project map: {e}", "ERROR")
+
+    def refresh_code_index(self, project_id: int, root: str, paths: Optional[List[str]]):
+        """Reparse changed files in a project's code index (project watcher events).
+        The map is marked stale when symbols or imports changed, so the outline
+        follows edits that do not add or remove files."""
+        if paths is None or len(paths) > CODE_INDEX_MAX_PATHS:
+            return      # Full update on the next map generation
+        try:
+            code_index = get_code_index(root)
+            if not code_index.files:
+                return  # No map generated from this root yet
+            if code_index.update(paths=paths):
+                code_index.save()
+                self.invalidate_project_map(project_id)
+        except Exception as e:
+            self.log(f"Error refreshing code index: {e}", "ERROR")
+
     def get_or_create_project_map(self, project_id: int, project_path: str) -> Optional[Dict]:
         """Get existing map or create new one"""
         pmap = self.get_project_map(project_id)
@@ -237,7 +328,15 @@ class SmartContextManager:
 
         parts = ["\n=== PROJECT STRUCTURE ==="]
 
-        if pmap.get('structure_summary'):
+        if pmap.get('code_outline'):
+            # Top-level folders only; the outline says where the code is
+            top_level = [line[4:] for line in (pmap.get('structure_summary') or '').splitlines()
+                         if line.startswith(('├── ', '└── ')) and '/ (' in line]
+            if top_level:
+                parts.append(f"Folders: {', '.join(top_level)}")
+            parts.append("\nCode outline (most used files first):")
+            parts.append(pmap['code_outline'])
+        elif pmap.get('structure_summary'):
             # Limit structure to reasonable size
             structure = pmap['structure_summary']
             if len(structure) > 2000:
@@ -255,23 +354,26 @@ class SmartContextManager:
                 entry_str = ', '.join([e.get('file', str(e)) if isinstance(e, dict) else str(e) for e in entries[:5]])
                 parts.append(f"Entry Points: {entry_str}")
 
+        if pmap.get('key_files'):
+            keys = pmap['key_files']
+            if isinstance(keys, list) and keys:
+                key_str = ', '.join([k.get('file', str(k)) if isinstance(k, dict) else str(k) for k in keys[:10]])
+                parts.append(f"Key Files: {key_str}")
+
         if pmap.get('primary_language'):
             parts.append(f"Primary Language: {pmap['primary_language']}")
 
+        if pmap.get('architecture_type'):
+            parts.append(f"Architecture: {pmap['architecture_type']}")
+
+        if pmap.get('design_patterns'):
+            patterns = pmap['design_patterns']
+            if isinstance(patterns, list) and patterns:
+                parts.append(f"Patterns: {', '.join(patterns[:6])}")
+
         parts.append("=========================\n")
         return '\n'.join(parts)
 
-    def _get_tree_output(self, path: str, max_depth: int = 3) -> str:
-        """Get directory tree output"""
-        try:
-            result = subprocess.run(
-                ['tree', '-L', str(max_depth), '-I', '__pycache__|node_modules|.git|*.pyc', path],
-                capture_output=True, text=True, timeout=10
-            )
-            return result.stdout if result.returncode == 0 else ""
-        except:
-            return ""
-
     def _read_file_if_exists(self, path: str, max_size: int = 10000) -> Optional[str]:
         """Read file content if it exists"""
         try:
@@ -282,60 +384,19 @@ class SmartContextManager:
             pass
         return None
 
-    def _get_project_stats(self, path: str) -> tuple:
-        """Get file count and total size"""
-        file_count = 0
-        total_size = 0
-        try:
-            for root, dirs, files in os.walk(path):
-                # Skip common non-source directories
-                dirs[:] = [d for d in dirs if d not in ['__pycache__', 'node_modules', '.git', 'venv', '.venv']]
-                for f in files:
-                    file_count += 1
-                    try:
-                        total_size += os.path.getsize(os.path.join(root, f))
-                    except:
-                        pass
-        except:
-            pass
-        return file_count, total_size // 1024
-
-    def _detect_language(self, path: str) -> str:
-        """Detect primary programming language"""
-        extensions = {}
+    def _get_path_filter(self, project_id: int) -> PathFilter:
+        """Filter of paths that are not project source (stats purpose, see path_filter)"""
+        project = {}
         try:
-            for root, dirs, files in os.walk(path):
-                dirs[:] = [d for d in dirs if d not in ['__pycache__', 'node_modules', '.git', 'venv']]
-                for f in files:
-                    ext = os.path.splitext(f)[1].lower()
-                    if ext in ['.py', '.js', '.ts', '.jsx', '.tsx', '.php', '.java', '.go', '.rs', '.rb']:
-                        extensions[ext] = extensions.get(ext, 0) + 1
-        except:
-            pass
-
-        if not extensions:
-            return 'unknown'
-
-        lang_map = {'.py': 'Python', '.js': 'JavaScript', '.ts': 'TypeScript',
-                    '.jsx': 'React', '.tsx': 'React/TypeScript', '.php': 'PHP',
-                    '.java': 'Java', '.go': 'Go', '.rs': 'Rust', '.rb': 'Ruby'}
-
-        top_ext = max(extensions, key=extensions.get)
-        return lang_map.get(top_ext, top_ext)
-
-    def _detect_entry_points(self, path: str) -> List[Dict]:
-        """Detect common entry points"""
-        entry_files = ['app.py', 'main.py', 'index.js', 'index.ts', 'server.py',
-                       'manage.py', 'wsgi.py', 'asgi.py', 'index.php', 'main.go']
-        found = []
-        try:
-            for f in entry_files:
-                fp = os.path.join(path, f)
-                if os.path.exists(fp):
-                    found.append({'file': f, 'purpose': 'Entry point'})
-        except:
-            pass
-        return found
+            conn = self.get_db()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT project_type, tech_stack FROM projects WHERE id = %s", (project_id,))
+            project = cursor.fetchone() or {}
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.log(f"Error loading project for path filter: {e}", "WARNING")
+        return project_filter(project, 'stats')
 
     def _detect_tech_stack(self, requirements: str, package_json: str) -> List[str]:
         """Detect tech stack from dependency files"""
@@ -483,38 +544,88 @@ class SmartContextManager:
     # ═══════════════════════════════════════════════════════════════════════════
 
     def get_extraction(self, ticket_id: int) -> Optional[Dict]:
-        """Get latest conversation extraction for ticket"""
+        """Get the extraction covering the most recent messages of a ticket"""
         try:
             conn = self.get_db()
             cursor = conn.cursor(dictionary=True)
             cursor.execute("""
                 SELECT * FROM conversation_extractions
-                WHERE ticket_id = %s
-                ORDER BY created_at DESC LIMIT 1
+                WHERE ticket_id = %s AND merged_into_id IS NULL
+                ORDER BY covers_msg_to_id DESC, created_at DESC LIMIT 1
             """, (ticket_id,))
             extraction = cursor.fetchone()
             cursor.close()
             conn.close()
-
-            if extraction:
-                json_fields = ['decisions', 'problems_solved', 'files_modified',
-                              'blocking_issues', 'waiting_for_user', 'external_dependencies',
-                              'key_code_snippets', 'important_variables', 'tests_status',
-                              'error_patterns', 'important_notes']
-                for field in json_fields:
-                    if extraction.get(field) and isinstance(extraction[field], str):
-                        try:
-                            extraction[field] = json.loads(extraction[field])
-                        except:
-                            pass
-            return extraction
+            return self._parse_extraction(extraction) if extraction else None
         except Exception as e:
             self.log(f"Error getting extraction: {e}", "ERROR")
             return None
 
+    def get_active_extractions(self, ticket_id: int) -> List[Dict]:
+        """Get all extractions not yet merged into a higher level, newest first.
+        Together they cover every summarized message of the ticket."""
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT * FROM conversation_extractions
+                WHERE ticket_id = %s AND merged_into_id IS NULL
+                ORDER BY covers_msg_to_id DESC, created_at DESC
+            """, (ticket_id,))
+            extractions = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return [self._parse_extraction(e) for e in extractions]
+        except Exception as e:
+            self.log(f"Error getting extractions: {e}", "ERROR")
+            return []
+
+    def get_combined_extraction(self, ticket_id: int) -> Optional[Dict]:
+        """All active extractions of a ticket combined into one (newest status first)"""
+        return self._combine_extractions(self.get_active_extractions(ticket_id))
+
+    def _parse_extraction(self, extraction: Dict) -> Dict:
+        for field in EXTRACTION_JSON_FIELDS:
+            if extraction.get(field) and isinstance(extraction[field], str):
+                try:
+                    extraction[field] = json.loads(extraction[field])
+                except:
+                    pass
+        return extraction
+
+    def _combine_extractions(self, extractions: List[Dict]) -> Optional[Dict]:
+        """Combine parsed extractions given newest first: lists are concatenated
+        without duplicates (newest items first), status comes from the newest"""
+        if not extractions:
+            return None
+        if len(extractions) == 1:
+            return extractions[0]
+
+        combined = {'current_status': next((e['current_status'] for e in extractions if e.get('current_status')), '')}
+        for field in ['decisions', 'problems_solved', 'files_modified', 'blocking_issues',
+                      'key_code_snippets', 'error_patterns', 'important_notes']:
+            items = []
+            for extraction in extractions:
+                values = extraction.get(field)
+                if isinstance(values, list):
+                    for value in values:
+                        if value and value not in items:
+                            items.append(value)
+            combined[field] = items
+        combined['covers_msg_from_id'] = min((e['covers_msg_from_id'] for e in extractions
+                                             if e.get('covers_msg_from_id') is not None), default=None)
+        combined['covers_msg_to_id'] = max((e['covers_msg_to_id'] for e in extractions
+                                           if e.get('covers_msg_to_id') is not None), default=None)
+        combined['messages_summarized'] = sum(e.get('messages_summarized') or 0 for e in extractions)
+        combined['tokens_before'] = sum(e.get('tokens_before') or 0 for e in extractions)
+        return combined
+
     def build_extraction_context(self, ticket_id: int) -> str:
         """Build extraction context string for system prompt"""
-        extraction = self.get_extraction(ticket_id)
+        return self.format_extraction_context(self.get_combined_extraction(ticket_id))
+
+    def format_extraction_context(self, extraction: Optional[Dict]) -> str:
+        """Format an extraction row (as returned by get_extraction) for the system prompt"""
         if not extraction:
             return ""
 
@@ -568,13 +679,12 @@ class SmartContextManager:
         return '\n'.join(parts)
 
     def _extract_with_haiku(self, conversation_text: List[str], files: List[str]) -> Optional[Dict]:
-        """Use Claude Haiku to create intelligent extraction"""
-        try:
-            # Build prompt for Haiku
-            prompt = f"""Analyze this conversation and extract key information in JSON format.
+        """Use Claude Haiku to create intelligent extraction (one chunk of the conversation)"""
+        # Build prompt for Haiku
+        prompt = f"""Analyze this conversation and extract key information in JSON format.
 
 CONVERSATION:
-{chr(10).join(conversation_text[-30:])}
+{chr(10).join(conversation_text)}
 
 FILES MENTIONED: {', '.join(files[:20]) if files else 'None'}
 
@@ -601,6 +711,43 @@ These notes will be shown to the AI in EVERY future conversation about this tick
 
 Keep each item concise (under 100 chars). Focus on technical decisions and implementations."""
 
+        return self._run_haiku(prompt)
+
+    def _merge_with_haiku(self, extractions: List[Dict]) -> Optional[Dict]:
+        """Use Claude Haiku to merge consecutive extractions into one"""
+        parts = []
+        for extraction in reversed(extractions):  # Oldest first reads naturally
+            parts.append(json.dumps({
+                'decisions': extraction.get('decisions') or [],
+                'problems_solved': extraction.get('problems_solved') or [],
+                'current_status': extraction.get('current_status') or '',
+                'key_info': extraction.get('key_code_snippets') or [],
+                'important_notes': extraction.get('important_notes') or [],
+            }, default=str))
+
+        prompt = f"""These are summaries of consecutive parts of one conversation, oldest first.
+Merge them into a single summary of the whole conversation.
+
+SUMMARIES:
+{chr(10).join(parts)}
+
+Respond with ONLY a JSON object (no markdown, no explanation):
+{{
+    "decisions": ["decision 1", "decision 2", ...],
+    "problems_solved": ["problem 1: solution", "problem 2: solution", ...],
+    "current_status": "Brief status of where things stand (from the latest summary)",
+    "key_info": "Most important technical details to remember (configs, values, patterns used)",
+    "important_notes": ["note 1", "note 2", ...]
+}}
+
+Keep every important_note unless a later summary contradicts it. Drop decisions and
+problems that were superseded later. Keep each item concise (under 100 chars)."""
+
+        return self._run_haiku(prompt)
+
+    def _run_haiku(self, prompt: str) -> Optional[Dict]:
+        """Run a prompt through the Claude CLI with Haiku and parse the JSON answer"""
+        try:
             # Call Claude Haiku using CLI
             result = subprocess.run(
                 ['/home/claude/.local/bin/claude', '--model', 'haiku', '--print'],
@@ -639,7 +786,35 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
             return None
 
     def create_extraction(self, ticket_id: int, messages: List[Dict], claude_func=None) -> Optional[Dict]:
-        """Create extraction from older messages using Claude Haiku"""
+        """Create level-0 extractions from older messages using Claude Haiku (one per
+        EXTRACTION_CHUNK_TOKENS window, so nothing is left out) and roll them up"""
+        chunks = []
+        chunk_tokens = 0
+        for msg in messages:
+            msg_tokens = msg.get('token_count') or self.count_tokens(msg.get('content'))
+            if chunks and chunk_tokens + msg_tokens <= EXTRACTION_CHUNK_TOKENS:
+                chunks[-1].append(msg)
+                chunk_tokens += msg_tokens
+            else:
+                chunks.append([msg])
+                chunk_tokens = msg_tokens
+
+        results = [r for r in (self._create_chunk_extraction(ticket_id, chunk) for chunk in chunks) if r]
+        if not results:
+            return None
+
+        self.rollup_extractions(ticket_id)
+
+        if len(results) == 1:
+            return results[0]
+        combined = dict(results[-1])
+        combined['covers_msg_from_id'] = results[0]['covers_msg_from_id']
+        for field in ['messages_summarized', 'tokens_before', 'tokens_after']:
+            combined[field] = sum(r[field] for r in results)
+        return combined
+
+    def _create_chunk_extraction(self, ticket_id: int, messages: List[Dict]) -> Optional[Dict]:
+        """Create one level-0 extraction from a window of messages"""
 
         self.log(f"Creating extraction for ticket {ticket_id} from {len(messages)} messages")
 
@@ -704,10 +879,10 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
 
             cursor.execute("""
                 INSERT INTO conversation_extractions
-                (ticket_id, decisions, problems_solved, files_modified, current_status,
+                (ticket_id, level, decisions, problems_solved, files_modified, current_status,
                  blocking_issues, waiting_for_user, key_code_snippets, tests_status, error_patterns,
                  important_notes, covers_msg_from_id, covers_msg_to_id, messages_summarized, tokens_before, tokens_after)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, 0, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
                 ticket_id, extraction_data['decisions'], extraction_data['problems_solved'],
                 extraction_data['files_modified'], extraction_data['current_status'],
@@ -749,6 +924,88 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
             self.log(f"Error creating extraction: {e}", "ERROR")
             return None
 
+    def rollup_extractions(self, ticket_id: int):
+        """Merge every EXTRACTION_MERGE_FANOUT active extractions of a level into one of the
+        next level (the top level merges into itself), so a ticket never has more than
+        a few active extractions however long it runs"""
+        for level in range(EXTRACTION_MAX_LEVEL + 1):
+            while True:
+                try:
+                    conn = self.get_db()
+                    cursor = conn.cursor(dictionary=True)
+                    cursor.execute("""
+                        SELECT * FROM conversation_extractions
+                        WHERE ticket_id = %s AND level = %s AND merged_into_id IS NULL
+                        ORDER BY covers_msg_to_id ASC, created_at ASC
+                        LIMIT %s
+                    """, (ticket_id, level, EXTRACTION_MERGE_FANOUT))
+                    group = cursor.fetchall()
+                    cursor.close()
+                    conn.close()
+                except Exception as e:
+                    self.log(f"Error loading extractions to merge: {e}", "ERROR")
+                    return
+
+                if len(group) < EXTRACTION_MERGE_FANOUT:
+                    break
+                group = [self._parse_extraction(e) for e in reversed(group)]  # Newest first
+                if not self._merge_extractions(ticket_id, group, min(level + 1, EXTRACTION_MAX_LEVEL)):
+                    return
+
+    def _merge_extractions(self, ticket_id: int, extractions: List[Dict], level: int) -> bool:
+        """Store a merged extraction of the given level and point the merged rows at it"""
+        self.log(f"Merging {len(extractions)} extractions of ticket {ticket_id} into level {level}")
+        combined = self._combine_extractions(extractions)
+        merged = self._merge_with_haiku(extractions)
+        if merged:
+            decisions = merged.get('decisions', [])
+            problems = merged.get('problems_solved', [])
+            current_status = merged.get('current_status', '') or combined['current_status']
+            key_info = merged.get('key_info', '')
+            key_snippets = [key_info] if key_info else []
+            important_notes = merged.get('important_notes', [])
+        else:
+            # Fallback - keep the newest items of each list
+            decisions = combined['decisions']
+            problems = combined['problems_solved']
+            current_status = combined['current_status']
+            key_snippets = combined['key_code_snippets']
+            important_notes = combined['important_notes']
+
+        tokens_after = self.count_tokens(json.dumps(decisions) + json.dumps(problems) + current_status)
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO conversation_extractions
+                (ticket_id, level, decisions, problems_solved, files_modified, current_status,
+                 blocking_issues, waiting_for_user, key_code_snippets, tests_status, error_patterns,
+                 important_notes, covers_msg_from_id, covers_msg_to_id, messages_summarized, tokens_before, tokens_after)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                ticket_id, level, json.dumps(decisions[:10]), json.dumps(problems[:10]),
+                json.dumps(combined['files_modified'][:20]), current_status,
+                json.dumps(combined['blocking_issues'][:10]), json.dumps([]),
+                json.dumps(key_snippets[:5]), json.dumps({}), json.dumps(combined['error_patterns'][:10]),
+                json.dumps(important_notes[:15]),
+                combined['covers_msg_from_id'], combined['covers_msg_to_id'],
+                combined['messages_summarized'], combined['tokens_before'], tokens_after
+            ))
+            merged_id = cursor.lastrowid
+            ids = [e['id'] for e in extractions]
+            placeholders = ','.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                UPDATE conversation_extractions SET merged_into_id = %s
+                WHERE id IN ({placeholders})
+            """, [merged_id] + ids)
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return True
+        except Exception as e:
+            self.log(f"Error merging extractions: {e}", "ERROR")
+            return False
+
     def _update_project_knowledge_from_extraction(self, ticket_id: int, decisions: List,
                                                    problems: List, important_notes: List):
         """Update project_knowledge table with learnings from extraction"""
@@ -855,6 +1112,11 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
 
     def get_smart_history(self, ticket_id: int) -> List[Dict]:
         """Get conversation history - ONLY unsummarized messages"""
+        return self.load_context_snapshot(ticket_id).history
+
+    def load_context_snapshot(self, ticket_id: int) -> ContextSnapshot:
+        """Load unsummarized messages and the extraction for one prompt build.
+        Older messages are extracted at most once here; callers share the result."""
         try:
             conn = self.get_db()
             cursor = conn.cursor(dictionary=True)
@@ -870,51 +1132,141 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
             cursor.close()
             conn.close()
 
-            if not unsummarized_messages:
-                return []
-
-            # Calculate/update token counts if needed
+            # Calculate token counts if missing and store them so it's done once
+            missing = []
             for msg in unsummarized_messages:
                 if not msg.get('token_count') or msg['token_count'] == 0:
-                    msg['token_count'] = self.count_tokens(msg.get('content', ''))
+                    msg['token_count'] = self.count_tokens(msg.get('content') or msg.get('tool_input') or '')
+                    if msg['token_count']:
+                        missing.append((msg['token_count'], msg['id']))
+            if missing:
+                self.update_message_token_counts(missing)
 
             # Calculate total tokens of unsummarized
             total_tokens = sum(m.get('token_count', 0) for m in unsummarized_messages)
 
-            # If under threshold, return all unsummarized
-            if total_tokens < EXTRACTION_THRESHOLD:
-                return unsummarized_messages
-
-            # Over threshold - need to extract older messages
-            # Select recent messages within budget
-            recent = []
-            recent_tokens = 0
-
-            for msg in reversed(unsummarized_messages):
-                msg_tokens = msg.get('token_count', 0)
+            # If under threshold, use all unsummarized
+            recent = unsummarized_messages
+            if total_tokens >= EXTRACTION_THRESHOLD:
+                # Over threshold - older messages must be summarized for this build
+                older, recent = self._split_recent(unsummarized_messages, RECENT_TOKENS_BUDGET)
 
                 # Truncate very large messages
-                if msg_tokens > MAX_SINGLE_MESSAGE:
-                    msg['content'] = self.truncate_message(msg.get('content', ''), MAX_SINGLE_MESSAGE)
-                    msg_tokens = MAX_SINGLE_MESSAGE
-
-                if recent_tokens + msg_tokens > RECENT_TOKENS_BUDGET:
-                    break
+                for msg in recent:
+                    if msg.get('token_count', 0) > MAX_SINGLE_MESSAGE:
+                        msg['content'] = self.truncate_message(msg.get('content', ''), MAX_SINGLE_MESSAGE)
+
+                # Normally already queued at the soft watermark - just wait for it
+                if older:
+                    self.wait_for_extraction(self.schedule_extraction(ticket_id, older))
+                    # Whatever was not summarized (timeout, failed chunks) is sent
+                    # truncated rather than left out
+                    left = self.filter_unsummarized(older)
+                    if left:
+                        recent = self._truncate_to_budget(left, MAX_TOTAL_TOKENS - RECENT_TOKENS_BUDGET) + recent
+
+            elif total_tokens >= EXTRACTION_SOFT_THRESHOLD:
+                # Getting close - summarize ahead of time, off the worker thread
+                older, _ = self._split_recent(unsummarized_messages, EXTRACTION_KEEP_RECENT)
+                if older:
+                    self.schedule_extraction(ticket_id, older)
+
+            # Read the extractions after any new one was created above
+            extraction = self.get_combined_extraction(ticket_id)
+            return ContextSnapshot(
+                ticket_id,
+                history=recent,
+                extraction=extraction,
+                extraction_context=self.format_extraction_context(extraction),
+                total_tokens=total_tokens
+            )
 
-                recent.insert(0, msg)
-                recent_tokens += msg_tokens
+        except Exception as e:
+            self.log(f"Error getting smart history: {e}", "ERROR")
+            return ContextSnapshot(ticket_id)
 
-            # Extract older unsummarized messages
-            if len(recent) < len(unsummarized_messages):
-                older_messages = unsummarized_messages[:-len(recent)] if recent else unsummarized_messages
-                if older_messages:
-                    self.create_extraction(ticket_id, older_messages)
+    def filter_unsummarized(self, messages: List[Dict]) -> List[Dict]:
+        """The messages not yet covered by an extraction (all of them if that can't be read)"""
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            ids = [m['id'] for m in messages]
+            cursor.execute(f"""
+                SELECT id FROM conversation_messages
+                WHERE id IN ({','.join(['%s'] * len(ids))}) AND is_summarized = TRUE
+            """, ids)
+            summarized = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.log(f"Error reading summarized messages: {e}", "ERROR")
+            summarized = set()
+        return [m for m in messages if m['id'] not in summarized]
+
+    def _truncate_to_budget(self, messages: List[Dict], budget: int) -> List[Dict]:
+        """Copies of the messages, each truncated to an equal share of budget tokens.
+        The originals may still be in a running extraction job and are left whole."""
+        share = max(budget // len(messages), 1)
+        truncated = []
+        for msg in messages:
+            msg = dict(msg)
+            if msg.get('token_count', 0) > share:
+                msg['content'] = self.truncate_message(msg.get('content', ''), share)
+            truncated.append(msg)
+        self.log(f"Sending {len(messages)} unsummarized older messages truncated to {share} tokens each", "WARNING")
+        return truncated
+
+    def _split_recent(self, messages: List[Dict], budget: int) -> tuple:
+        """Split messages into (older, recent) where recent fits in budget tokens"""
+        recent = []
+        recent_tokens = 0
+        for msg in reversed(messages):
+            msg_tokens = min(msg.get('token_count', 0), MAX_SINGLE_MESSAGE)
+            if recent_tokens + msg_tokens > budget:
+                break
+            recent.insert(0, msg)
+            recent_tokens += msg_tokens
+        return messages[:len(messages) - len(recent)], recent
 
-            return recent
+    # ═══════════════════════════════════════════════════════════════════════════
+    # BACKGROUND EXTRACTION
+    # ═══════════════════════════════════════════════════════════════════════════
 
+    def schedule_extraction(self, ticket_id: int, messages: List[Dict]):
+        """Queue create_extraction for a ticket. Returns the job's future; if one is
+        already running for this ticket, that one is returned instead."""
+        with self.extraction_lock:
+            job = self.extraction_jobs.get(ticket_id)
+            if job:
+                return job
+            if self.extraction_pool is None:
+                self.extraction_pool = ThreadPoolExecutor(
+                    max_workers=EXTRACTION_WORKERS, thread_name_prefix='extraction')
+            self.log(f"Queued background extraction for ticket {ticket_id} ({len(messages)} messages)")
+            job = self.extraction_pool.submit(self.create_extraction, ticket_id, messages)
+            self.extraction_jobs[ticket_id] = job
+        job.add_done_callback(lambda _job: self._extraction_done(ticket_id, _job))
+        return job
+
+    def _extraction_done(self, ticket_id: int, job):
+        with self.extraction_lock:
+            if self.extraction_jobs.get(ticket_id) is job:
+                del self.extraction_jobs[ticket_id]
+
+    def wait_for_extraction(self, job, timeout: int = EXTRACTION_WAIT_TIMEOUT):
+        """Wait for a queued extraction; on timeout it keeps running in the background"""
+        try:
+            return job.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.log(f"Extraction still running after {timeout}s - continuing without it", "WARNING")
         except Exception as e:
-            self.log(f"Error getting smart history: {e}", "ERROR")
-            return []
+            self.log(f"Background extraction failed: {e}", "ERROR")
+        return None
+
+    def shutdown(self):
+        """Stop the extraction pool (running jobs finish, queued ones are dropped)"""
+        if self.extraction_pool:
+            self.extraction_pool.shutdown(wait=False, cancel_futures=True)
 
     def update_message_token_count(self, message_id: int, token_count: int):
         """Update token count for a message"""
@@ -930,6 +1282,20 @@ Keep each item concise (under 100 chars). Focus on technical decisions and imple
         except Exception as e:
             self.log(f"Error updating token count: {e}", "ERROR")
 
+    def update_message_token_counts(self, counts: List[tuple]):
+        """Update token counts for several messages: [(token_count, message_id), ...]"""
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.executemany("""
+                UPDATE conversation_messages SET token_count = %s WHERE id = %s
+            """, counts)
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            self.log(f"Error updating token counts: {e}", "ERROR")
+
     # ═══════════════════════════════════════════════════════════════════════════
     # BUILD COMPLETE CONTEXT
     # ═══════════════════════════════════════════════════════════════════════════
@@ -1039,10 +1405,10 @@ Important: After publishing, restart the service to apply changes.
         parts.append("============================\n")
         return '\n'.join(parts)
 
-    def build_full_context(self, ticket: Dict, user_id: str = None) -> Dict:
-        """Build complete context for Claude API call"""
+    def build_static_context(self, ticket: Dict, user_id: str = None) -> str:
+        """Build the parts of the context that only change with the project map,
+        project knowledge or user preferences (see get_context_version)"""
         project_id = ticket.get('project_id')
-        ticket_id = ticket.get('id')
         project_path = ticket.get('web_path') or ticket.get('app_path')
 
         context_parts = []
@@ -1075,17 +1441,48 @@ Important: After publishing, restart the service to apply changes.
         if dotnet_context:
             context_parts.append(dotnet_context)
 
-        # 7. Ticket extraction (if exists)
-        if ticket_id:
-            extraction_context = self.build_extraction_context(ticket_id)
-            if extraction_context:
-                context_parts.append(extraction_context)
+        return '\n'.join(context_parts)
+
+    def get_context_version(self, project_id: int) -> tuple:
+        """Cheap version stamp of the static context: (map generated_at, knowledge last_updated).
+        An expired map reports None so callers rebuild and regenerate it."""
+        if not project_id:
+            return (None, None)
+        try:
+            conn = self.get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT
+                    (SELECT generated_at FROM project_maps
+                     WHERE project_id = %s AND (expires_at IS NULL OR expires_at > NOW())),
+                    (SELECT last_updated FROM project_knowledge WHERE project_id = %s)
+            """, (project_id, project_id))
+            row = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return tuple(row) if row else (None, None)
+        except Exception as e:
+            self.log(f"Error getting context version: {e}", "ERROR")
+            return (None, None)
+
+    def build_full_context(self, ticket: Dict, user_id: str = None) -> Dict:
+        """Build complete context for Claude API call"""
+        ticket_id = ticket.get('id')
+
+        context_parts = []
+
+        # 1-5. Static project context
+        static_context = self.build_static_context(ticket, user_id)
+        if static_context:
+            context_parts.append(static_context)
 
-        # 8. Recent messages
-        history = self.get_smart_history(ticket_id) if ticket_id else []
+        # 7-8. Ticket extraction and recent messages, loaded together
+        snapshot = self.load_context_snapshot(ticket_id) if ticket_id else ContextSnapshot(ticket_id)
+        if snapshot.extraction_context:
+            context_parts.append(snapshot.extraction_context)
 
         return {
             'system_context': '\n'.join(context_parts),
-            'history': history,
-            'has_extraction': bool(self.get_extraction(ticket_id)) if ticket_id else False
+            'history': snapshot.history,
+            'has_extraction': bool(snapshot.extraction)
         }
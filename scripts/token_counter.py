@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Token Counter - Offline token estimation for CodeHero
+Shared by the daemon, SmartContextManager and the web app so every
+token_count stored in conversation_messages uses the same estimate.
+
+Backends:
+- approx:   BPE-style pre-tokenizer (same splitting rules as cl100k-type
+            tokenizers) with per-piece costs calibrated for English, code,
+            Greek/Cyrillic and CJK text. Default, no dependencies.
+- tiktoken: Real BPE counts via the optional `tiktoken` package (must have
+            its encoding cached locally - no downloads at runtime).
+- fallback: Calibrated character-class ratio, used for huge texts or if the
+            selected backend fails.
+"""
+
+import json
+import math
+import re
+from typing import Callable, Dict, Optional
+
+
+# Texts larger than this skip the regex pass and use the calibrated fallback
+APPROX_MAX_CHARS = 1_000_000
+
+# Same split rules as cl100k-style BPE pre-tokenizers: contractions, words
+# (optionally with one leading space), 1-3 digit groups, punctuation runs, whitespace
+_PIECE_RE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+", re.IGNORECASE)
+
+# Characters per token for non-ASCII letters, by script
+_SCRIPT_RATIOS = (
+    (0x0370, 0x03FF, 1.7),   # Greek
+    (0x1F00, 0x1FFF, 1.7),   # Greek extended
+    (0x0400, 0x04FF, 2.5),   # Cyrillic
+    (0x2E80, 0x9FFF, 1.0),   # CJK
+    (0xAC00, 0xD7AF, 1.0),   # Hangul
+)
+_DEFAULT_NON_ASCII_RATIO = 2.0
+
+
+def _non_ascii_ratio(ch: str) -> float:
+    code = ord(ch)
+    for start, end, ratio in _SCRIPT_RATIOS:
+        if start <= code <= end:
+            return ratio
+    return _DEFAULT_NON_ASCII_RATIO
+
+
+def _word_tokens(word: str) -> float:
+    """Cost of a run of letters"""
+    if word.isascii():
+        # Common words are a single token; long identifiers split every ~4 chars
+        n = len(word)
+        return 1 if n <= 5 else 1 + math.ceil((n - 5) / 4)
+    ascii_letters = sum(1 for ch in word if ch.isascii())
+    cost = sum(1 / _non_ascii_ratio(ch) for ch in word if not ch.isascii())
+    if ascii_letters:
+        cost += 1 + ascii_letters / 4
+    return max(1, cost)
+
+
+def _approx_count(text: str) -> int:
+    if len(text) > APPROX_MAX_CHARS:
+        return _calibrated_count(text)
+    tokens = 0.0
+    for piece in _PIECE_RE.findall(text):
+        stripped = piece.lstrip(' ')
+        if not stripped:
+            tokens += 1                         # whitespace run
+        elif stripped[0].isdigit():
+            tokens += 1                         # 1-3 digit group
+        elif stripped[0].isalpha():
+            tokens += _word_tokens(stripped)
+        elif stripped[0].isspace():
+            tokens += 1                         # newline/indent run
+        elif stripped.isascii():
+            tokens += math.ceil(len(stripped) / 2)  # punctuation pairs often merge
+        else:
+            # Emoji and other symbols are several UTF-8 bytes each
+            tokens += math.ceil(len(stripped.encode('utf-8')) / 2)
+    return int(math.ceil(tokens))
+
+
+def _calibrated_count(text: str) -> int:
+    """Character-class ratio estimate (no regex pass)"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    non_ascii_chars = len(text) - ascii_chars
+    return int(math.ceil(ascii_chars / 3.8 + non_ascii_chars / 1.8))
+
+
+_BACKENDS: Dict[str, Callable[[str], int]] = {
+    'approx': _approx_count,
+    'fallback': _calibrated_count,
+}
+_active_backend = 'approx'
+
+
+def register_backend(name: str, func: Callable[[str], int]):
+    """Register a custom token counting function"""
+    _BACKENDS[name] = func
+
+
+def _load_tiktoken() -> Optional[Callable[[str], int]]:
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return None
+
+
+def configure_tokenizer(name: Optional[str]) -> str:
+    """Select the backend by name (approx, tiktoken, fallback or a registered one).
+    Unknown or unavailable backends leave 'approx' active. Returns the active name."""
+    global _active_backend
+    name = (name or 'approx').strip().lower()
+    if name == 'tiktoken' and 'tiktoken' not in _BACKENDS:
+        func = _load_tiktoken()
+        if func:
+            _BACKENDS['tiktoken'] = func
+    _active_backend = name if name in _BACKENDS else 'approx'
+    return _active_backend
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Estimate the number of tokens in text"""
+    if not text:
+        return 0
+    try:
+        return _BACKENDS[_active_backend](text)
+    except Exception:
+        return _calibrated_count(text)
+
+
+def count_message_tokens(content: Optional[str], tool_input=None) -> int:
+    """Token count stored with a conversation message (content, or tool input for tool_use)"""
+    if content:
+        return count_tokens(content)
+    if tool_input:
+        if not isinstance(tool_input, str):
+            tool_input = json.dumps(tool_input)
+        return count_tokens(tool_input)
+    return 0
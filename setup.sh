@@ -77,7 +77,11 @@ LOG_DIR="${LOG_DIR:-/var/log/codehero}"
 WEB_ROOT="${WEB_ROOT:-/var/www/projects}"
 APP_ROOT="${APP_ROOT:-/opt/apps}"
 MAX_PARALLEL_PROJECTS="${MAX_PARALLEL_PROJECTS:-3}"
+ADAPTIVE_CONCURRENCY="${ADAPTIVE_CONCURRENCY:-yes}"
+PARALLEL_FLOOR="${PARALLEL_FLOOR:-1}"
+PARALLEL_CEILING="${PARALLEL_CEILING:-}"
 REVIEW_DEADLINE_DAYS="${REVIEW_DEADLINE_DAYS:-7}"
+PROJECT_WATCHER="${PROJECT_WATCHER:-yes}"
 SSL_CERT="${SSL_CERT:-${CONFIG_DIR}/ssl/cert.pem}"
 SSL_KEY="${SSL_KEY:-${CONFIG_DIR}/ssl/key.pem}"
 ENABLE_AUTOSTART="${ENABLE_AUTOSTART:-yes}"
@@ -395,6 +399,8 @@ mkdir -p ${INSTALL_DIR}/web/templates
 mkdir -p ${LOG_DIR}
 mkdir -p /var/run/codehero
 mkdir -p /var/backups/codehero
+mkdir -p /var/lib/codehero/worktrees
+mkdir -p /var/lib/codehero/code-index
 
 # Create tmpfiles.d config
 cat > /etc/tmpfiles.d/codehero.conf << TMPEOF
@@ -435,6 +441,7 @@ touch ${LOG_DIR}/daemon.log ${LOG_DIR}/web.log
 chown ${CLAUDE_USER}:${CLAUDE_USER} ${LOG_DIR}/daemon.log ${LOG_DIR}/web.log
 chown -R ${CLAUDE_USER}:${CLAUDE_USER} /var/run/codehero
 chown -R ${CLAUDE_USER}:${CLAUDE_USER} /var/backups/codehero
+chown -R ${CLAUDE_USER}:${CLAUDE_USER} /var/lib/codehero
 chown -R ${CLAUDE_USER}:${CLAUDE_USER} /home/${CLAUDE_USER}
 chmod 2775 ${WEB_ROOT}
 
@@ -632,7 +639,11 @@ INSTALL_DIR=${INSTALL_DIR}
 WEB_ROOT=${WEB_ROOT}
 APP_ROOT=${APP_ROOT}
 MAX_PARALLEL_PROJECTS=${MAX_PARALLEL_PROJECTS}
+ADAPTIVE_CONCURRENCY=${ADAPTIVE_CONCURRENCY}
+PARALLEL_FLOOR=${PARALLEL_FLOOR}
+PARALLEL_CEILING=${PARALLEL_CEILING}
 REVIEW_DEADLINE_DAYS=${REVIEW_DEADLINE_DAYS}
+PROJECT_WATCHER=${PROJECT_WATCHER}
 TELEGRAM_BOT_TOKEN=${TELEGRAM_BOT_TOKEN:-}
 TELEGRAM_CHAT_ID=${TELEGRAM_CHAT_ID:-}
 NOTIFY_TICKET_COMPLETED=${NOTIFY_TICKET_COMPLETED:-yes}
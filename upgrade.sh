@@ -669,6 +669,12 @@ mkdir -p /var/run/codehero
 chown -R claude:claude /var/run/codehero 2>/dev/null || true
 echo "  Fixed /var/run/codehero permissions"
 
+# Ticket worktrees and code index (state directory of the daemon and web app)
+mkdir -p /var/lib/codehero/worktrees
+mkdir -p /var/lib/codehero/code-index
+chown -R claude:claude /var/lib/codehero 2>/dev/null || true
+echo "  Fixed /var/lib/codehero permissions"
+
 # Ensure tmpfiles.d config exists for reboot persistence
 cat > /etc/tmpfiles.d/codehero.conf << TMPEOF
 # Create runtime directory for CodeHero
@@ -13,7 +13,7 @@ try:
 except:
     VERSION = "unknown"
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import re
@@ -22,9 +22,11 @@ import mysql.connector
 from mysql.connector import pooling
 import bcrypt
 import os
+from stat import S_ISREG
 import pty
 import pwd
 import select
+import socket
 import struct
 import fcntl
 import termios
@@ -43,6 +45,7 @@ import urllib.request
 import urllib.error
 from datetime import datetime
 from functools import wraps
+from collections import deque
 import sys
 sys.path.insert(0, '/opt/codehero/scripts')
 try:
@@ -50,6 +53,13 @@ try:
 except ImportError:
     SmartContextManager = None
 
+try:
+    from token_counter import count_tokens, configure_tokenizer
+except ImportError:
+    def count_tokens(text):
+        return len(text.encode('utf-8')) // 4 if text else 0
+    configure_tokenizer = None
+
 try:
     from lsp_manager import LSPManager, lsp_manager
     LSP_ENABLED = True
@@ -65,6 +75,44 @@ except ImportError:
     GitManager = None
     get_git_manager = None
 
+try:
+    from archive_writer import open_archive, resolve_format, iter_output
+except ImportError:
+    open_archive = None
+    resolve_format = None
+    iter_output = None
+
+try:
+    from path_filter import project_filter
+except ImportError:
+    project_filter = None
+
+try:
+    from file_index import get_file_index, invalidate_file_index, TREE_PAGE
+except ImportError:
+    get_file_index = None
+    invalidate_file_index = None
+    TREE_PAGE = 500
+
+try:
+    from project_watcher import ProjectWatcher
+except ImportError:
+    ProjectWatcher = None
+
+ARCHIVE_MIMETYPES = {'zip': 'application/zip', 'tar.zst': 'application/zstd'}
+ARCHIVE_EXTENSIONS = {'zip': '.zip', 'tar.zst': '.tar.zst'}
+
+try:
+    from backup_store import (BackupStore, DumpStream, load_sql, snapshot_name, project_git,
+                              SNAPSHOT_EXT, BACKUP_SCHEMA_DUMP, BACKUP_DATA_DUMP)
+except ImportError:
+    BackupStore = None
+    DumpStream = None
+    load_sql = None
+    snapshot_name = None
+    project_git = None
+    SNAPSHOT_EXT = '.snap'
+
 def to_iso_utc(dt):
     """Convert datetime to ISO format with UTC indicator for JavaScript"""
     if dt is None:
@@ -90,6 +138,8 @@ def safe_filename(filename):
 CONFIG_FILE = "/etc/codehero/system.conf"
 DAEMON_SCRIPT = "/opt/codehero/scripts/claude-daemon.py"
 PID_FILE = "/var/run/codehero/daemon.pid"
+DAEMON_COMMAND_SOCKET = "/var/run/codehero/commands.sock"
+BROADCAST_SOCKET = "/var/run/codehero/broadcast.sock"
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.secret_key = os.urandom(24)
@@ -112,6 +162,8 @@ def load_config():
     return config
 
 config = load_config()
+if configure_tokenizer:
+    configure_tokenizer(config.get('TOKENIZER', 'approx'))
 
 try:
     db_pool = pooling.MySQLConnectionPool(
@@ -301,7 +353,8 @@ def logout():
 @login_required
 def dashboard():
     stats = {'projects': 0, 'open_tickets': 0, 'in_progress': 0, 'awaiting_input': 0,
-             'completed_today': 0, 'daemon_status': 'stopped', 'active_workers': [], 'max_workers': 3}
+             'completed_today': 0, 'daemon_status': 'stopped', 'active_workers': [], 'max_workers': 3,
+             'nodes': []}
     projects = []
     recent_tickets = []
 
@@ -334,7 +387,7 @@ def dashboard():
 
         # Active workers - tickets in progress with project info
         cursor.execute("""
-            SELECT t.ticket_number, t.title, p.name as project_name
+            SELECT t.ticket_number, t.title, p.name as project_name, t.claimed_by
             FROM tickets t
             JOIN projects p ON t.project_id = p.id
             WHERE t.status = 'in_progress'
@@ -342,6 +395,20 @@ def dashboard():
         """)
         stats['active_workers'] = cursor.fetchall()
         stats['max_workers'] = int(config.get('MAX_PARALLEL_PROJECTS', '3'))
+        # Current limit when the daemon adapts concurrency
+        try:
+            cursor.execute("SELECT max_parallel FROM daemon_status WHERE id = 1")
+            row = cursor.fetchone()
+            if row and row.get('max_parallel'):
+                stats['max_workers'] = row['max_parallel']
+        except Exception:
+            pass
+
+        # Daemon nodes (several hosts can run daemons against this database)
+        stats['nodes'] = get_daemon_nodes(cursor)
+        live_nodes = [n for n in stats['nodes'] if n['alive']]
+        if len(live_nodes) > 1:
+            stats['max_workers'] = sum(n['max_parallel'] or 0 for n in live_nodes) or stats['max_workers']
 
         cursor.execute("SELECT * FROM projects WHERE status = 'active' ORDER BY updated_at DESC LIMIT 10")
         projects = cursor.fetchall()
@@ -495,6 +562,7 @@ def reopen_project(project_id):
         conn.commit()
         cursor.close()
         conn.close()
+        notify_daemon(project_id=project_id)  # Its open tickets are schedulable again
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -503,7 +571,9 @@ def reopen_project(project_id):
 @app.route('/api/project/<int:project_id>/export', methods=['GET'])
 @login_required
 def export_project(project_id):
-    """Export project files and database as a zip file"""
+    """Export project files and database as a zip (or tar.zst) file.
+    The archive is streamed as it is built (chunked transfer), so the first
+    bytes go out right away and nothing is staged on disk."""
     try:
         conn = get_db()
         cursor = conn.cursor(dictionary=True)
@@ -515,93 +585,98 @@ def export_project(project_id):
         if not project:
             return jsonify({'success': False, 'message': 'Project not found'}), 404
 
-        # Create temp directory for export
-        temp_dir = tempfile.mkdtemp()
-        export_name = f"{project['code']}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        export_path = os.path.join(temp_dir, export_name)
-        os.makedirs(export_path)
+        if open_archive is None:
+            return jsonify({'success': False, 'message': 'Archive writer not available'}), 500
 
-        try:
-            # Copy web folder
-            if project.get('web_path') and os.path.exists(project['web_path']):
-                web_dest = os.path.join(export_path, 'web')
-                shutil.copytree(project['web_path'], web_dest, dirs_exist_ok=True)
-
-            # Copy app folder
-            if project.get('app_path') and os.path.exists(project['app_path']):
-                app_dest = os.path.join(export_path, 'app')
-                shutil.copytree(project['app_path'], app_dest, dirs_exist_ok=True)
-
-            # Export database if exists
-            if project.get('db_name') and project.get('db_user') and project.get('db_password'):
-                db_dir = os.path.join(export_path, 'database')
-                os.makedirs(db_dir, exist_ok=True)
-
-                db_host = project.get('db_host', 'localhost')
-                db_name = project['db_name']
-                db_user = project['db_user']
-                db_pass = project['db_password']
-
-                # Export schema (structure only)
-                schema_file = os.path.join(db_dir, 'schema.sql')
-                schema_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-data {db_name}"
-                result = subprocess.run(schema_cmd, shell=True, capture_output=True, text=True)
-                if result.returncode == 0:
-                    with open(schema_file, 'w') as f:
-                        f.write(result.stdout)
-
-                # Export data only
-                data_file = os.path.join(db_dir, 'data.sql')
-                data_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-create-info {db_name}"
-                result = subprocess.run(data_cmd, shell=True, capture_output=True, text=True)
-                if result.returncode == 0:
-                    with open(data_file, 'w') as f:
-                        f.write(result.stdout)
-
-            # Create project info file
-            info_file = os.path.join(export_path, 'project_info.json')
-            project_info = {
-                'name': project['name'],
-                'code': project['code'],
-                'description': project.get('description'),
-                'project_type': project.get('project_type'),
-                'tech_stack': project.get('tech_stack'),
-                'web_path': project.get('web_path'),
-                'app_path': project.get('app_path'),
-                'db_name': project.get('db_name'),
-                'db_user': project.get('db_user'),
-                'db_host': project.get('db_host', 'localhost'),
-                'preview_url': project.get('preview_url'),
-                'exported_at': datetime.now().isoformat()
-            }
-            with open(info_file, 'w') as f:
-                json.dump(project_info, f, indent=2, ensure_ascii=False)
-
-            # Create zip file
-            zip_path = os.path.join(temp_dir, f"{export_name}.zip")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(export_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_name = os.path.relpath(file_path, export_path)
-                        zipf.write(file_path, arc_name)
-
-            # Send file and cleanup after
-            return send_file(
-                zip_path,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name=f"{export_name}.zip"
-            )
+        # ?format=tar.zst for a faster multi-threaded zstd archive (zip if zstd is missing)
+        fmt = resolve_format(request.args.get('format', 'zip'))
+        export_name = f"{project['code']}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
-        except Exception as e:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            raise e
+        # Built on a background thread straight from the project folders into the
+        # response; the writer blocks while the client is behind and stops if it disconnects
+        def write_export(dest):
+            with open_archive(dest, fmt) as archive:
+                # Web and app folders, without what the backup policy leaves out (node_modules/ etc.)
+                path_filter = project_filter(project) if project_filter else None
+                for root_name in ('web', 'app'):
+                    src_root = project.get(f'{root_name}_path')
+                    if src_root and os.path.isdir(src_root):
+                        add_tree_to_archive(archive, root_name, src_root, path_filter)
+
+                # Export database if exists: schema (structure only) and data only,
+                # streamed from mysqldump into the archive
+                if project.get('db_name') and project.get('db_user') and project.get('db_password'):
+                    for member, options in (('database/schema.sql', ['--no-data']),
+                                            ('database/data.sql', ['--no-create-info', '--single-transaction'])):
+                        with DumpStream(project, options) as dump:
+                            archive.add_stream(member, dump)
+                        if not dump.ok:
+                            archive.add_bytes(member + '.FAILED', b'mysqldump failed - the dump above is incomplete\n')
+
+                # Project info file
+                project_info = {
+                    'name': project['name'],
+                    'code': project['code'],
+                    'description': project.get('description'),
+                    'project_type': project.get('project_type'),
+                    'tech_stack': project.get('tech_stack'),
+                    'web_path': project.get('web_path'),
+                    'app_path': project.get('app_path'),
+                    'db_name': project.get('db_name'),
+                    'db_user': project.get('db_user'),
+                    'db_host': project.get('db_host', 'localhost'),
+                    'preview_url': project.get('preview_url'),
+                    'exported_at': datetime.now().isoformat()
+                }
+                archive.add_bytes('project_info.json',
+                                  json.dumps(project_info, indent=2, ensure_ascii=False).encode('utf-8'))
+
+        # No Content-Length: sent chunked. No ranges either, as the bytes only exist while streaming
+        download_name = f"{export_name}{ARCHIVE_EXTENSIONS[fmt]}"
+        return Response(iter_output(write_export), mimetype=ARCHIVE_MIMETYPES[fmt], headers={
+            'Content-Disposition': f'attachment; filename="{download_name}"',
+            'Accept-Ranges': 'none',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',      # Don't let nginx buffer the whole archive
+        })
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def get_project_path_filter(project_id, purpose):
+    """PathFilter of a project for the given purpose (None if unavailable)"""
+    if project_filter is None:
+        return None
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""SELECT project_type, tech_stack, backup_exclude, backup_gitignore
+                      FROM projects WHERE id = %s""", (project_id,))
+    project = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return project_filter(project, purpose) if project else None
+
+
+def add_tree_to_archive(archive, prefix, src_root, path_filter=None):
+    """Add every file under src_root to an archive as prefix/<relative path>
+    (symlinked files are followed, symlinked directories are not).
+    Paths excluded by path_filter are skipped without being walked."""
+    walk = path_filter.walk(src_root) if path_filter else (
+        (dirpath, os.path.relpath(dirpath, src_root), dirnames, filenames)
+        for dirpath, dirnames, filenames in os.walk(src_root))
+    for dirpath, rel_dir, dirnames, filenames in walk:
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            if S_ISREG(st.st_mode):
+                arcname = os.path.join(prefix, name) if rel_dir in ('', '.') else os.path.join(prefix, rel_dir, name)
+                archive.add_file(arcname, full, st)
+
+
 # ============ DATABASE EDITOR ============
 
 def get_project_db_connection(project_id):
@@ -863,7 +938,8 @@ def project_editor(project_id):
 @app.route('/api/project/<int:project_id>/editor/tree', methods=['GET'])
 @login_required
 def get_file_tree(project_id):
-    """Get recursive file tree"""
+    """Get one page of the file tree below ?path, expanded ?depth levels
+    (?offset/?limit page through big folders). Served from the file index."""
     path_type = request.args.get('path_type', 'web')
     base_path = get_project_path(project_id, path_type)
     if not base_path:
@@ -872,38 +948,25 @@ def get_file_tree(project_id):
     if not os.path.exists(base_path):
         return jsonify({'success': False, 'message': 'Project path does not exist'})
 
-    def build_tree(path, rel_path=''):
-        items = []
-        try:
-            entries = sorted(os.listdir(path), key=lambda x: (not os.path.isdir(os.path.join(path, x)), x.lower()))
-            for entry in entries:
-                # Skip hidden and common ignored files
-                if entry.startswith('.') or entry in ['node_modules', '__pycache__', 'vendor', '.git']:
-                    continue
+    if get_file_index is None:
+        return jsonify({'success': False, 'message': 'File index not available'})
 
-                full_path = os.path.join(path, entry)
-                entry_rel = os.path.join(rel_path, entry) if rel_path else entry
-
-                if os.path.isdir(full_path):
-                    items.append({
-                        'name': entry,
-                        'path': entry_rel,
-                        'type': 'dir',
-                        'children': build_tree(full_path, entry_rel)
-                    })
-                else:
-                    items.append({
-                        'name': entry,
-                        'path': entry_rel,
-                        'type': 'file',
-                        'size': os.path.getsize(full_path)
-                    })
-        except PermissionError:
-            pass
-        return items
+    rel_dir = request.args.get('path', '').strip().strip('/')
+    if rel_dir and not os.path.normpath(os.path.join(base_path, rel_dir)).startswith(os.path.normpath(base_path) + os.sep):
+        return jsonify({'success': False, 'message': 'Invalid path'})
+
+    depth = request.args.get('depth', 2, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', TREE_PAGE, type=int)
 
-    tree = build_tree(base_path)
-    return jsonify({'success': True, 'tree': tree, 'base_path': base_path})
+    # Hidden files and regenerable folders of the project's type/tech stack (node_modules, vendor, ...) are left out
+    path_filter = get_project_path_filter(project_id, 'tree')
+    page = get_file_index(base_path).tree(rel_dir, depth, offset, limit, path_filter, hidden=False)
+    if page is None:
+        return jsonify({'success': False, 'message': 'Folder not found'})
+
+    return jsonify({'success': True, 'tree': page['items'], 'path': rel_dir, 'total': page['total'],
+                    'offset': page['offset'], 'next_offset': page['next_offset'], 'base_path': base_path})
 
 
 @app.route('/api/project/<int:project_id>/editor/file', methods=['GET'])
@@ -969,6 +1032,8 @@ def save_file_content(project_id):
 
         with open(full_path, 'w', encoding='utf-8') as f:
             f.write(content)
+        if invalidate_file_index:
+            invalidate_file_index(base_path, [os.path.relpath(full_path, base_path)])
         return jsonify({'success': True, 'message': 'File saved'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -1067,95 +1132,61 @@ def create_project_backup(project_id, trigger='manual'):
         if not project:
             return False, "Project not found", None
 
+        if BackupStore is None:
+            return False, "Backup store not available", None
+
         project_code = project['code']
         backup_subdir = os.path.join(BACKUP_DIR, project_code)
-        os.makedirs(backup_subdir, exist_ok=True)
-
-        # Create backup filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_name = f"{project_code}_{timestamp}_{trigger}.zip"
-        backup_path = os.path.join(backup_subdir, backup_name)
-
-        # Create temp directory for backup contents
-        temp_dir = tempfile.mkdtemp()
-        temp_backup = os.path.join(temp_dir, 'backup')
-        os.makedirs(temp_backup)
-
-        try:
-            # Copy web folder
-            if project.get('web_path') and os.path.exists(project['web_path']):
-                web_dest = os.path.join(temp_backup, 'web')
-                shutil.copytree(project['web_path'], web_dest, dirs_exist_ok=True)
-
-            # Copy app folder
-            if project.get('app_path') and os.path.exists(project['app_path']):
-                app_dest = os.path.join(temp_backup, 'app')
-                shutil.copytree(project['app_path'], app_dest, dirs_exist_ok=True)
-
-            # Export database if exists
-            if project.get('db_name') and project.get('db_user') and project.get('db_password'):
-                db_dir = os.path.join(temp_backup, 'database')
-                os.makedirs(db_dir, exist_ok=True)
-
-                db_host = project.get('db_host', 'localhost')
-                db_name = project['db_name']
-                db_user = project['db_user']
-                db_pass = project['db_password']
-
-                # Export schema
-                schema_file = os.path.join(db_dir, 'schema.sql')
-                schema_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-data {db_name} 2>/dev/null"
-                result = subprocess.run(schema_cmd, shell=True, capture_output=True, text=True)
-                if result.returncode == 0:
-                    with open(schema_file, 'w') as f:
-                        f.write(result.stdout)
-
-                # Export data
-                data_file = os.path.join(db_dir, 'data.sql')
-                data_cmd = f"mysqldump -h {db_host} -u {db_user} -p'{db_pass}' --no-create-info {db_name} 2>/dev/null"
-                result = subprocess.run(data_cmd, shell=True, capture_output=True, text=True)
-                if result.returncode == 0:
-                    with open(data_file, 'w') as f:
-                        f.write(result.stdout)
-
-            # Create backup info
-            info_file = os.path.join(temp_backup, 'backup_info.json')
-            backup_info = {
-                'project_id': project_id,
-                'project_code': project_code,
-                'project_name': project['name'],
-                'trigger': trigger,
-                'created_at': datetime.now().isoformat(),
-                'web_path': project.get('web_path'),
-                'app_path': project.get('app_path'),
-                'db_name': project.get('db_name')
-            }
-            with open(info_file, 'w') as f:
-                json.dump(backup_info, f, indent=2)
-
-            # Create zip
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(temp_backup):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_name = os.path.relpath(file_path, temp_backup)
-                        zipf.write(file_path, arc_name)
-
-            # Cleanup old backups (keep last MAX_BACKUPS)
-            cleanup_old_backups(backup_subdir)
-
-            return True, f"Backup created: {backup_name}", backup_name
-
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        store = BackupStore(backup_subdir)
+        backup_name = snapshot_name(project_code, trigger)
+
+        # Database dumps are streamed from mysqldump into the store, never held in memory
+        db_files = {}
+        if project.get('db_name') and project.get('db_user') and project.get('db_password'):
+            db_files['database/schema.sql'] = lambda: DumpStream(project, BACKUP_SCHEMA_DUMP)
+            db_files['database/data.sql'] = lambda: DumpStream(project, BACKUP_DATA_DUMP)
+
+        # Snapshot web/app folders - unchanged files are shared with earlier backups,
+        # and a clean git repo is recorded as its HEAD commit
+        backup_info = {
+            'project_id': project_id,
+            'project_code': project_code,
+            'project_name': project['name'],
+            'trigger': trigger,
+            'web_path': project.get('web_path'),
+            'app_path': project.get('app_path'),
+            'db_name': project.get('db_name')
+        }
+        # Regenerable paths (node_modules/ etc.) and the project's backup_exclude are left out
+        git = get_project_backup_git(project)
+        path_filter = project_filter(project) if project_filter else None
+        store.snapshot(backup_name,
+                       {'web': project.get('web_path'), 'app': project.get('app_path')},
+                       files=db_files, info=backup_info, git=git,
+                       filters={'web': path_filter, 'app': path_filter})
+
+        # Cleanup old backups (keep last MAX_BACKUPS)
+        cleanup_old_backups(backup_subdir, git)
+
+        return True, f"Backup created: {backup_name}", backup_name
 
     except Exception as e:
         return False, str(e), None
 
 
-def cleanup_old_backups(backup_dir):
-    """Remove old backups, keep only MAX_BACKUPS most recent"""
+def get_project_backup_git(project):
+    """GitManager per backup root for git checkpoints ({} without git)"""
+    if not GIT_ENABLED or project_git is None:
+        return {}
+    return project_git(project, get_git_manager(project))
+
+
+def cleanup_old_backups(backup_dir, git=None):
+    """Remove old backups, keep only MAX_BACKUPS most recent snapshots
+    (and MAX_BACKUPS legacy zip archives)"""
     try:
+        if BackupStore is not None:
+            BackupStore(backup_dir).prune(MAX_BACKUPS, git=git)
         backups = sorted(
             [f for f in os.listdir(backup_dir) if f.endswith('.zip')],
             key=lambda x: os.path.getmtime(os.path.join(backup_dir, x)),
@@ -1181,52 +1212,65 @@ def restore_project_backup(project_id, backup_filename):
             return False, "Project not found"
 
         project_code = project['code']
-        backup_path = os.path.join(BACKUP_DIR, project_code, backup_filename)
-
-        if not os.path.exists(backup_path):
-            return False, "Backup file not found"
+        backup_filename = os.path.basename(backup_filename)
+        is_snapshot = backup_filename.endswith(SNAPSHOT_EXT)
+        if is_snapshot:
+            if BackupStore is None:
+                return False, "Backup store not available"
+            store = BackupStore(os.path.join(BACKUP_DIR, project_code))
+            if not store.exists(backup_filename):
+                return False, "Backup file not found"
+        else:
+            backup_path = os.path.join(BACKUP_DIR, project_code, backup_filename)
+            if not os.path.exists(backup_path):
+                return False, "Backup file not found"
 
-        # Extract to temp directory
         temp_dir = tempfile.mkdtemp()
 
         try:
-            with zipfile.ZipFile(backup_path, 'r') as zipf:
-                zipf.extractall(temp_dir)
-
-            # Restore web folder
-            web_backup = os.path.join(temp_dir, 'web')
-            if os.path.exists(web_backup) and project.get('web_path'):
-                # Clear existing and copy
-                if os.path.exists(project['web_path']):
-                    shutil.rmtree(project['web_path'])
-                shutil.copytree(web_backup, project['web_path'])
-
-            # Restore app folder
-            app_backup = os.path.join(temp_dir, 'app')
-            if os.path.exists(app_backup) and project.get('app_path'):
-                if os.path.exists(project['app_path']):
-                    shutil.rmtree(project['app_path'])
-                shutil.copytree(app_backup, project['app_path'])
-
-            # Restore database
-            db_dir = os.path.join(temp_dir, 'database')
-            if os.path.exists(db_dir) and project.get('db_name'):
-                db_host = project.get('db_host', 'localhost')
-                db_name = project['db_name']
-                db_user = project['db_user']
-                db_pass = project['db_password']
-
-                # Restore schema first
-                schema_file = os.path.join(db_dir, 'schema.sql')
-                if os.path.exists(schema_file):
-                    cmd = f"mysql -h {db_host} -u {db_user} -p'{db_pass}' {db_name} < {schema_file} 2>/dev/null"
-                    subprocess.run(cmd, shell=True)
-
-                # Restore data
-                data_file = os.path.join(db_dir, 'data.sql')
-                if os.path.exists(data_file):
-                    cmd = f"mysql -h {db_host} -u {db_user} -p'{db_pass}' {db_name} < {data_file} 2>/dev/null"
-                    subprocess.run(cmd, shell=True)
+            db_sources = {}
+            if is_snapshot:
+                # Rewrites only files that differ from the snapshot, removes the rest
+                manifest = store.restore(backup_filename, {
+                    'web': project.get('web_path'),
+                    'app': project.get('app_path')
+                }, git=get_project_backup_git(project))
+                for dump in ('schema.sql', 'data.sql'):
+                    if 'h' in manifest['roots'].get('database', {}).get(dump, {}):
+                        db_sources[dump] = lambda dump=dump: store.open_entry(manifest, 'database', dump)
+            else:
+                # Legacy zip archive: extract to temp directory
+                with zipfile.ZipFile(backup_path, 'r') as zipf:
+                    zipf.extractall(temp_dir)
+
+                # Restore web folder
+                web_backup = os.path.join(temp_dir, 'web')
+                if os.path.exists(web_backup) and project.get('web_path'):
+                    # Clear existing and copy
+                    if os.path.exists(project['web_path']):
+                        shutil.rmtree(project['web_path'])
+                    shutil.copytree(web_backup, project['web_path'])
+
+                # Restore app folder
+                app_backup = os.path.join(temp_dir, 'app')
+                if os.path.exists(app_backup) and project.get('app_path'):
+                    if os.path.exists(project['app_path']):
+                        shutil.rmtree(project['app_path'])
+                    shutil.copytree(app_backup, project['app_path'])
+
+                for dump in ('schema.sql', 'data.sql'):
+                    dump_file = os.path.join(temp_dir, 'database', dump)
+                    if os.path.exists(dump_file):
+                        db_sources[dump] = lambda dump_file=dump_file: open(dump_file, 'rb')
+
+            # Restore database: schema first, then data, streamed into mysql
+            if db_sources and project.get('db_name') and project.get('db_user') and project.get('db_password'):
+                for dump in ('schema.sql', 'data.sql'):
+                    if dump in db_sources:
+                        with db_sources[dump]() as src:
+                            ok, error = load_sql(project, src)
+                        if not ok:
+                            return False, f"Files restored, but loading {dump} failed: {error}"
 
             return True, "Restore completed successfully"
 
@@ -1265,6 +1309,20 @@ def api_list_backups(project_id):
             return jsonify({'success': True, 'backups': []})
 
         backups = []
+        if BackupStore is not None:
+            for snap in BackupStore(backup_dir).list_snapshots():
+                backups.append({
+                    'filename': snap['name'],
+                    'size': snap['size'],
+                    'stored': snap['new_bytes'],
+                    'files': snap['files'],
+                    'changed_files': snap['new_files'],
+                    'created': snap['created_at'],
+                    'trigger': snap['trigger'],
+                    'git': snap['git']
+                })
+
+        # Zip archives from before the snapshot store
         for f in sorted(os.listdir(backup_dir), reverse=True):
             if f.endswith('.zip'):
                 path = os.path.join(backup_dir, f)
@@ -1280,6 +1338,7 @@ def api_list_backups(project_id):
                     'trigger': trigger
                 })
 
+        backups.sort(key=lambda b: b['created'], reverse=True)
         return jsonify({'success': True, 'backups': backups})
 
     except Exception as e:
@@ -1310,7 +1369,7 @@ def api_download_backup(project_id, filename):
     try:
         conn = get_db()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT code FROM projects WHERE id = %s", (project_id,))
+        cursor.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
         project = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -1318,7 +1377,27 @@ def api_download_backup(project_id, filename):
         if not project:
             return jsonify({'success': False, 'message': 'Project not found'}), 404
 
-        backup_path = os.path.join(BACKUP_DIR, project['code'], filename)
+        filename = os.path.basename(filename)
+        backup_dir = os.path.join(BACKUP_DIR, project['code'])
+
+        if filename.endswith(SNAPSHOT_EXT) and BackupStore is not None:
+            store = BackupStore(backup_dir)
+            if not store.exists(filename):
+                return jsonify({'success': False, 'message': 'Backup not found'}), 404
+            # Assembled as an archive (?format=tar.zst or zip) straight into the
+            # response, like the project export
+            fmt = resolve_format(request.args.get('format', 'zip'))
+            git = get_project_backup_git(project)
+            download_name = filename[:-len(SNAPSHOT_EXT)] + ARCHIVE_EXTENSIONS[fmt]
+            return Response(iter_output(lambda dest: store.export(filename, dest, fmt, git=git)),
+                            mimetype=ARCHIVE_MIMETYPES[fmt], headers={
+                                'Content-Disposition': f'attachment; filename="{download_name}"',
+                                'Accept-Ranges': 'none',
+                                'Cache-Control': 'no-store',
+                                'X-Accel-Buffering': 'no',
+                            })
+
+        backup_path = os.path.join(backup_dir, filename)
 
         if not os.path.exists(backup_path):
             return jsonify({'success': False, 'message': 'Backup not found'}), 404
@@ -1336,7 +1415,7 @@ def api_delete_backup(project_id, filename):
     try:
         conn = get_db()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT code FROM projects WHERE id = %s", (project_id,))
+        cursor.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
         project = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -1344,7 +1423,16 @@ def api_delete_backup(project_id, filename):
         if not project:
             return jsonify({'success': False, 'message': 'Project not found'})
 
-        backup_path = os.path.join(BACKUP_DIR, project['code'], filename)
+        filename = os.path.basename(filename)
+        backup_dir = os.path.join(BACKUP_DIR, project['code'])
+
+        if filename.endswith(SNAPSHOT_EXT) and BackupStore is not None:
+            # Objects still used by other snapshots are kept
+            if BackupStore(backup_dir).delete(filename, git=get_project_backup_git(project)):
+                return jsonify({'success': True, 'message': 'Backup deleted'})
+            return jsonify({'success': False, 'message': 'Backup not found'})
+
+        backup_path = os.path.join(backup_dir, filename)
 
         if os.path.exists(backup_path):
             os.remove(backup_path)
@@ -1820,7 +1908,7 @@ def upload_file(project_id):
                 cursor2 = conn2.cursor()
                 file_list = ', '.join(uploaded)
                 msg = f"[Uploaded files to ticket_files/: {file_list}]"
-                msg_tokens = len(msg.encode('utf-8')) // 4
+                msg_tokens = count_tokens(msg)
                 cursor2.execute(
                     "INSERT INTO conversation_messages (ticket_id, role, content, token_count) VALUES (%s, 'user', %s, %s)",
                     (ticket_id, msg, msg_tokens)
@@ -1879,22 +1967,17 @@ def list_files(project_id):
         if not os.path.exists(current_path):
             return jsonify({'success': True, 'files': [], 'base_path': base_path, 'current_path': current_path})
 
+        # Directories first, then files (the index keeps listings in that order)
         files = []
-        for item in sorted(os.listdir(current_path)):
-            item_path = os.path.join(current_path, item)
-            rel_path = os.path.join(subdir, item) if subdir else item
-            stat = os.stat(item_path)
+        for entry in get_file_index(base_path).listdir(subdir) or []:
             files.append({
-                'name': item,
-                'path': rel_path,
-                'is_dir': os.path.isdir(item_path),
-                'size': stat.st_size if not os.path.isdir(item_path) else None,
-                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                'name': entry.name,
+                'path': os.path.join(subdir, entry.name) if subdir else entry.name,
+                'is_dir': entry.is_dir,
+                'size': entry.size if not entry.is_dir else None,
+                'modified': datetime.fromtimestamp(entry.mtime_ns / 1e9).isoformat()
             })
 
-        # Sort: directories first, then files
-        files.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
-
         return jsonify({
             'success': True,
             'files': files,
@@ -2165,6 +2248,19 @@ def api_project_detail(project_id):
         if ai_model in ('opus', 'sonnet', 'haiku'):
             updates.append("ai_model = %s")
             params.append(ai_model)
+    if 'parallel_tickets' in data:
+        try:
+            parallel_tickets = int(data['parallel_tickets'])
+        except (TypeError, ValueError):
+            parallel_tickets = 1
+        updates.append("parallel_tickets = %s")
+        params.append(max(1, min(parallel_tickets, 8)))
+    if 'backup_exclude' in data:
+        updates.append("backup_exclude = %s")
+        params.append((data['backup_exclude'] or '').strip() or None)
+    if 'backup_gitignore' in data:
+        updates.append("backup_gitignore = %s")
+        params.append(1 if data['backup_gitignore'] else 0)
 
     # Android settings
     if 'android_device_type' in data:
@@ -2195,6 +2291,8 @@ def api_project_detail(project_id):
         cursor.execute(f"UPDATE projects SET {', '.join(updates)} WHERE id = %s", params)
         conn.commit()
         cursor.close(); conn.close()
+        if 'parallel_tickets' in data:
+            notify_daemon(project_id=project_id)  # More lanes can start waiting tickets now
         return jsonify({'success': True, 'message': 'Project updated'})
     except Exception as e:
         cursor.close(); conn.close()
@@ -2280,6 +2378,7 @@ def api_tickets():
             """, (project_id, ticket_number, title, description, priority, ai_model))
             conn.commit()
             ticket_id = cursor.lastrowid
+            notify_daemon(ticket_id)
             
             cursor.close(); conn.close()
             return jsonify({'success': True, 'ticket_id': ticket_id, 'ticket_number': ticket_number})
@@ -2422,7 +2521,7 @@ def reopen_ticket(ticket_id):
         # If instructions provided, add as a user message for Claude to see
         if instructions:
             reopen_msg = f"[REOPEN] Additional instructions:\n{instructions}"
-            msg_tokens = len(reopen_msg.encode('utf-8')) // 4
+            msg_tokens = count_tokens(reopen_msg)
             cursor.execute("""
                 INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
                 VALUES (%s, 'user', %s, %s, NOW())
@@ -2430,6 +2529,7 @@ def reopen_ticket(ticket_id):
             cursor.execute("UPDATE tickets SET total_tokens = total_tokens + %s WHERE id = %s", (msg_tokens, ticket_id))
 
         conn.commit()
+        notify_daemon(ticket_id)
         cursor.close()
         conn.close()
         return jsonify({'success': True})
@@ -2495,7 +2595,7 @@ def create_ticket_summary(ticket_id):
             return jsonify({'success': False, 'message': 'No messages to summarize'})
 
         # Count tokens before
-        tokens_before = sum(len(m.get('content', '') or '') // 4 for m in messages)
+        tokens_before = sum(m.get('token_count') or count_tokens(m.get('content')) for m in messages)
 
         cursor.close(); conn.close()
 
@@ -2524,7 +2624,7 @@ def create_ticket_summary(ticket_id):
 @app.route('/api/ticket/<int:ticket_id>/settings', methods=['POST'])
 @login_required
 def update_ticket_settings(ticket_id):
-    """Update ticket settings like AI model"""
+    """Update ticket settings like AI model or priority"""
     try:
         data = request.get_json()
         conn = get_db()
@@ -2541,6 +2641,10 @@ def update_ticket_settings(ticket_id):
             elif ai_model == '' or ai_model is None:
                 updates.append("ai_model = NULL")
 
+        if data.get('priority') in ('low', 'medium', 'high', 'critical'):
+            updates.append("priority = %s")
+            params.append(data['priority'])
+
         if not updates:
             cursor.close(); conn.close()
             return jsonify({'success': False, 'message': 'No valid settings to update'})
@@ -2552,6 +2656,7 @@ def update_ticket_settings(ticket_id):
         conn.commit()
         cursor.close()
         conn.close()
+        notify_daemon(ticket_id)  # A new priority changes the scheduling order
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -2663,9 +2768,9 @@ def send_ticket_message(ticket_id):
             if cmd == '/done':
                 # Save command to conversation for display
                 cursor.execute("""
-                    INSERT INTO conversation_messages (ticket_id, role, content, created_at)
-                    VALUES (%s, 'user', %s, NOW())
-                """, (ticket_id, message))
+                    INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
+                    VALUES (%s, 'user', %s, %s, NOW())
+                """, (ticket_id, message, count_tokens(message)))
                 msg_id = cursor.lastrowid
                 cursor.execute("""
                     UPDATE tickets SET status = 'done', closed_at = NOW(),
@@ -2684,6 +2789,7 @@ def send_ticket_message(ticket_id):
                     VALUES (%s, 'info', %s, NOW())
                 """, (ticket_id, log_msg))
                 conn.commit()
+                notify_daemon(ticket_id)
                 # Broadcast log to console
                 socketio.emit('new_log', {'log_type': 'info', 'message': log_msg, 'created_at': datetime.now().isoformat() + 'Z'}, room='console')
                 # Broadcast message immediately
@@ -2700,9 +2806,9 @@ def send_ticket_message(ticket_id):
             elif cmd == '/skip':
                 # Save command to conversation for display
                 cursor.execute("""
-                    INSERT INTO conversation_messages (ticket_id, role, content, created_at)
-                    VALUES (%s, 'user', %s, NOW())
-                """, (ticket_id, message))
+                    INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
+                    VALUES (%s, 'user', %s, %s, NOW())
+                """, (ticket_id, message, count_tokens(message)))
                 msg_id = cursor.lastrowid
                 cursor.execute("""
                     UPDATE tickets SET status = 'skipped', closed_at = NOW(),
@@ -2721,6 +2827,7 @@ def send_ticket_message(ticket_id):
                     VALUES (%s, 'warning', %s, NOW())
                 """, (ticket_id, log_msg))
                 conn.commit()
+                notify_daemon(ticket_id)
                 # Broadcast log to console
                 socketio.emit('new_log', {'log_type': 'warning', 'message': log_msg, 'created_at': datetime.now().isoformat() + 'Z'}, room='console')
                 # Broadcast message immediately
@@ -2736,9 +2843,9 @@ def send_ticket_message(ticket_id):
             elif cmd == '/stop':
                 # Save command to conversation for display
                 cursor.execute("""
-                    INSERT INTO conversation_messages (ticket_id, role, content, created_at)
-                    VALUES (%s, 'user', %s, NOW())
-                """, (ticket_id, message))
+                    INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
+                    VALUES (%s, 'user', %s, %s, NOW())
+                """, (ticket_id, message, count_tokens(message)))
                 msg_id = cursor.lastrowid
                 # Signal daemon to stop Claude and wait for input
                 cursor.execute("""
@@ -2752,6 +2859,7 @@ def send_ticket_message(ticket_id):
                     VALUES (%s, 'warning', %s, NOW())
                 """, (ticket_id, log_msg))
                 conn.commit()
+                notify_daemon(ticket_id)
                 # Broadcast log to console
                 socketio.emit('new_log', {'log_type': 'warning', 'message': log_msg, 'created_at': datetime.now().isoformat() + 'Z'}, room='console')
                 # Broadcast message immediately
@@ -2766,7 +2874,7 @@ def send_ticket_message(ticket_id):
                 return jsonify({'success': True, 'message': 'Stop signal sent'})
 
         # Save user message
-        msg_tokens = len(message.encode('utf-8')) // 4
+        msg_tokens = count_tokens(message)
         cursor.execute("""
             INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
             VALUES (%s, 'user', %s, %s, NOW())
@@ -2782,6 +2890,7 @@ def send_ticket_message(ticket_id):
         cursor.execute("UPDATE tickets SET total_tokens = total_tokens + %s, updated_at = NOW() WHERE id = %s", (msg_tokens, ticket_id))
         
         conn.commit()
+        notify_daemon(ticket_id)
         
         # Get the inserted message
         cursor.execute("SELECT * FROM conversation_messages WHERE ticket_id = %s ORDER BY id DESC LIMIT 1", (ticket_id,))
@@ -2799,6 +2908,22 @@ def send_ticket_message(ticket_id):
 
 # ============ DAEMON CONTROL ============
 
+def notify_daemon(ticket_id=None, project_id=None):
+    """Tell the daemon a ticket changed: the worker running it reads user_messages
+    now, and new/reopened tickets are scheduled immediately. With project_id
+    (e.g. a reactivated project) only the scheduler is woken.
+    Best effort - the daemon still rescans the tables on a slow timer."""
+    payload = {'ticket_id': int(ticket_id)} if ticket_id else {'project_id': int(project_id)}
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.sendto(json.dumps(payload).encode('utf-8'), DAEMON_COMMAND_SOCKET)
+        finally:
+            sock.close()
+    except Exception:
+        pass
+
 @app.route('/api/daemon/start', methods=['POST'])
 @login_required
 def start_daemon():
@@ -2827,6 +2952,26 @@ def stop_daemon():
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
+def get_daemon_nodes(cursor):
+    """Registered daemon nodes with an 'alive' flag (empty if the table doesn't exist yet)"""
+    try:
+        cursor.execute("""
+            SELECT node_id, hostname, status, started_at, last_heartbeat, max_parallel,
+                   active_workers, active_tickets,
+                   (status = 'running' AND last_heartbeat > DATE_SUB(NOW(), INTERVAL 90 SECOND)) as alive
+            FROM daemon_nodes
+            WHERE status = 'running' OR last_heartbeat > DATE_SUB(NOW(), INTERVAL 1 DAY)
+            ORDER BY node_id
+        """)
+        nodes = cursor.fetchall()
+    except Exception:
+        return []
+    for node in nodes:
+        node['alive'] = bool(node['alive'])
+        tickets = node.get('active_tickets')
+        node['active_tickets'] = (json.loads(tickets) if isinstance(tickets, (str, bytes)) else tickets) or []
+    return nodes
+
 @app.route('/api/daemon/status')
 @login_required
 def daemon_status():
@@ -2856,6 +3001,18 @@ def daemon_status():
         if active:
             status["current_ticket"] = active[0]['ticket_number']
             status["current_title"] = active[0]['title']
+        # Queue depth / time-to-start per priority, published by the daemon's scheduler
+        cursor.execute("SELECT scheduler_stats, max_parallel, concurrency_log FROM daemon_status WHERE id = 1")
+        row = cursor.fetchone() or {}
+        if row.get('scheduler_stats'):
+            stats = row['scheduler_stats']
+            status["scheduler"] = json.loads(stats) if isinstance(stats, (str, bytes)) else stats
+        if row.get('max_parallel'):
+            status["max_parallel"] = row['max_parallel']
+        if row.get('concurrency_log'):
+            log = row['concurrency_log']
+            status["concurrency"] = json.loads(log) if isinstance(log, (str, bytes)) else log
+        status["nodes"] = get_daemon_nodes(cursor)
         cursor.close(); conn.close()
     except: pass
 
@@ -3094,11 +3251,12 @@ def send_console_message():
                     VALUES (%s, %s, '/skip', 'command')
                 """, (ticket['id'], session.get('user_id')))
                 conn.commit()
+                notify_daemon(ticket['id'])
                 cursor.close(); conn.close()
                 return jsonify({'success': True, 'message': 'Skip command sent'})
 
         # Save user message
-        msg_tokens = len(message.encode('utf-8')) // 4
+        msg_tokens = count_tokens(message)
         cursor.execute("""
             INSERT INTO conversation_messages (ticket_id, role, content, token_count, created_at)
             VALUES (%s, 'user', %s, %s, NOW())
@@ -3113,6 +3271,7 @@ def send_console_message():
         cursor.execute("UPDATE tickets SET total_tokens = total_tokens + %s WHERE id = %s", (msg_tokens, ticket['id']))
 
         conn.commit()
+        notify_daemon(ticket['id'])
         cursor.close(); conn.close()
 
         return jsonify({'success': True})
@@ -3687,14 +3846,12 @@ def get_ticket_stats(ticket_id):
 
 # ============ INTERNAL API FOR DAEMON ============
 
-@app.route('/api/internal/broadcast', methods=['POST'])
-def internal_broadcast():
-    """Called by daemon to broadcast new messages via WebSocket"""
-    # Only allow from localhost
-    if request.remote_addr not in ('127.0.0.1', '::1', 'localhost'):
-        return jsonify({'error': 'forbidden'}), 403
+# Highest conversation_messages id per ticket already pushed live by the daemon.
+# message_pusher skips these so clients don't get every daemon message twice.
+live_message_ids = {}
 
-    data = request.get_json()
+def dispatch_broadcast_event(data):
+    """Fan a daemon event out to the Socket.IO rooms"""
     msg_type = data.get('type')
     ticket_id = data.get('ticket_id')
 
@@ -3704,6 +3861,11 @@ def internal_broadcast():
             try: msg['tool_input'] = json.loads(msg['tool_input'])
             except: pass
         socketio.emit('new_message', msg, room=f'ticket_{ticket_id}')
+        if msg.get('ticket_number'):
+            socketio.emit('new_message', msg, room='console')
+        if msg.get('id'):
+            tid = int(ticket_id)
+            live_message_ids[tid] = max(live_message_ids.get(tid, 0), msg['id'])
 
     elif msg_type == 'status' and ticket_id:
         status = data.get('status')
@@ -3711,9 +3873,55 @@ def internal_broadcast():
             'ticket_id': int(ticket_id),
             'status': status
         }, room=f'ticket_{ticket_id}')
+        if status != 'in_progress':
+            live_message_ids.pop(int(ticket_id), None)
+
+@app.route('/api/internal/broadcast', methods=['POST'])
+def internal_broadcast():
+    """Called by daemon to broadcast new messages via WebSocket (fallback for the broadcast socket)"""
+    # Only allow from localhost
+    if request.remote_addr not in ('127.0.0.1', '::1', 'localhost'):
+        return jsonify({'error': 'forbidden'}), 403
 
+    dispatch_broadcast_event(request.get_json() or {})
     return jsonify({'success': True})
 
+def broadcast_stream_reader(conn):
+    """Read newline-delimited JSON events from one daemon connection"""
+    try:
+        with conn, conn.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    dispatch_broadcast_event(json.loads(line))
+                except Exception:
+                    pass
+    except Exception:
+        pass
+
+def broadcast_listener():
+    """Accept the daemon's long-lived event stream on BROADCAST_SOCKET"""
+    try:
+        os.makedirs(os.path.dirname(BROADCAST_SOCKET), exist_ok=True)
+        if os.path.exists(BROADCAST_SOCKET):
+            os.remove(BROADCAST_SOCKET)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(BROADCAST_SOCKET)
+        os.chmod(BROADCAST_SOCKET, 0o660)
+        server.listen(4)
+    except Exception as e:
+        print(f"Broadcast socket error: {e}")
+        return
+
+    while True:
+        try:
+            conn, _ = server.accept()
+            threading.Thread(target=broadcast_stream_reader, args=(conn,), daemon=True).start()
+        except Exception:
+            time.sleep(1)
+
 # ============ CLAUDE ACTIVATION ============
 
 # Store terminal sessions for activation
@@ -4871,46 +5079,136 @@ def handle_disconnect():
                 del lsp_sessions[sid]
 
 # Background thread to push new messages
+FEED_POLL_INTERVAL = 1      # Seconds between change-feed polls
+FEED_BATCH_SIZE = 1000      # Max id range scanned per poll
+FEED_SETTLE_SECONDS = 10    # Ids below the high-water mark are re-scanned this long (late commits)
+
+def room_has_clients(room):
+    """True if any Socket.IO client has joined the room"""
+    try:
+        return bool(socketio.server.manager.rooms.get('/', {}).get(room))
+    except Exception:
+        return True  # Unknown manager implementation - assume someone is listening
+
+def watched_ticket_ids():
+    """Ticket ids whose ticket_<id> room currently has clients"""
+    try:
+        rooms = socketio.server.manager.rooms.get('/', {})
+    except Exception:
+        return None
+    ids = []
+    for room, members in list(rooms.items()):
+        if members and isinstance(room, str) and room.startswith('ticket_'):
+            try:
+                ids.append(int(room[7:]))
+            except ValueError:
+                pass
+    return ids
+
 def message_pusher():
-    last_ids = {}
+    """Change feed over conversation_messages for in_progress tickets.
+
+    Tracks one global high-water mark on conversation_messages.id and fetches
+    new rows for all active tickets with a single primary-key range scan.
+    Ids are allocated before their transaction commits, so a lower id can show
+    up after a higher one: the scan starts from the mark of FEED_SETTLE_SECONDS
+    ago and rows already pushed are skipped.
+    Does no DB work at all while nobody is watching a ticket or the console.
+    """
+    last_id = None
+    settled_id = None       # Every row up to here is committed or given up on
+    marks = deque()         # (time, last_id) - settled_id catches up FEED_SETTLE_SECONDS later
+    pushed = set()          # Ids above settled_id already handled
     while True:
+        time.sleep(FEED_POLL_INTERVAL)
+        console_watched = room_has_clients('console')
+        ticket_ids = watched_ticket_ids()
+        if not console_watched and ticket_ids == []:
+            # Nobody listening - clients load history themselves when they join
+            last_id = None
+            continue
+
         try:
             conn = get_db()
-            if conn:
-                cursor = conn.cursor(dictionary=True)
-
-                # Get active tickets with their ticket_number
-                cursor.execute("SELECT id, ticket_number FROM tickets WHERE status = 'in_progress'")
-                active_tickets = cursor.fetchall()
-
-                for ticket in active_tickets:
-                    tid = ticket['id']
-                    ticket_number = ticket['ticket_number']
-                    last_id = last_ids.get(tid, 0)
-
-                    cursor.execute("""
-                        SELECT * FROM conversation_messages
-                        WHERE ticket_id = %s AND id > %s
-                        ORDER BY id ASC LIMIT 20
-                    """, (tid, last_id))
-
-                    messages = cursor.fetchall()
-                    for msg in messages:
-                        last_ids[tid] = msg['id']
-                        if msg.get('created_at'): msg['created_at'] = to_iso_utc(msg['created_at'])
-                        if msg.get('tool_input') and isinstance(msg['tool_input'], str):
-                            try: msg['tool_input'] = json.loads(msg['tool_input'])
-                            except: pass
-                        socketio.emit('new_message', msg, room=f'ticket_{tid}')
-                        # Also broadcast to console with ticket_number
-                        msg['ticket_number'] = ticket_number
-                        socketio.emit('new_message', msg, room='console')
+            if not conn:
+                continue
+            cursor = conn.cursor(dictionary=True)
 
-                cursor.close(); conn.close()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM conversation_messages")
+            max_id = cursor.fetchone()['max_id']
+            if last_id is None or max_id < last_id:
+                # (Re)start from the current end of the table
+                last_id = settled_id = max_id
+                marks.clear()
+                pushed.clear()
+            upper_id = min(max_id, last_id + FEED_BATCH_SIZE)
+
+            messages = []
+            if upper_id > settled_id:
+                query = """
+                    SELECT m.*, t.ticket_number FROM conversation_messages m
+                    JOIN tickets t ON t.id = m.ticket_id
+                    WHERE m.id > %s AND m.id <= %s AND t.status = 'in_progress'
+                """
+                params = [settled_id, upper_id]
+                if not console_watched and ticket_ids is not None:
+                    query += f" AND m.ticket_id IN ({','.join(['%s'] * len(ticket_ids))})"
+                    params.extend(ticket_ids)
+                cursor.execute(query + " ORDER BY m.id ASC", params)
+                messages = [m for m in cursor.fetchall() if m['id'] not in pushed]
+                last_id = upper_id
+            cursor.close(); conn.close()
+
+            now = time.monotonic()
+            marks.append((now, last_id))
+            while marks and marks[0][0] <= now - FEED_SETTLE_SECONDS:
+                settled_id = marks.popleft()[1]
+            pushed.update(m['id'] for m in messages)
+            pushed.difference_update([i for i in pushed if i <= settled_id])
+
+            by_ticket = {}
+            for msg in messages:
+                tid = msg['ticket_id']
+                # Already pushed live over the daemon broadcast stream
+                if msg['id'] <= live_message_ids.get(tid, 0):
+                    continue
+                if msg.get('created_at'): msg['created_at'] = to_iso_utc(msg['created_at'])
+                if msg.get('tool_input') and isinstance(msg['tool_input'], str):
+                    try: msg['tool_input'] = json.loads(msg['tool_input'])
+                    except: pass
+                by_ticket.setdefault(tid, []).append(msg)
+
+            console_batch = []
+            for tid, batch in by_ticket.items():
+                if ticket_ids is None or tid in ticket_ids:
+                    socketio.emit('new_messages', batch, room=f'ticket_{tid}')
+                console_batch.extend(batch)
+            if console_batch and console_watched:
+                console_batch.sort(key=lambda m: m['id'])
+                socketio.emit('new_messages', console_batch, room='console')
         except: pass
-        time.sleep(1)
 
 threading.Thread(target=message_pusher, daemon=True).start()
+threading.Thread(target=broadcast_listener, daemon=True).start()
+
+
+def load_watched_projects():
+    """Active projects for the project watcher"""
+    conn = get_db()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""SELECT id, web_path, app_path, project_type, tech_stack
+                      FROM projects WHERE status = 'active'""")
+    projects = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return projects
+
+
+# Keeps the editor's file index and git status cache current instead of re-reading on every request
+if ProjectWatcher and config.get('PROJECT_WATCHER', 'yes').lower() == 'yes':
+    ProjectWatcher(load_watched_projects, lambda msg, level="INFO": print(f"[{level}] {msg}")).start()
 
 
 # ============ MAIN ============